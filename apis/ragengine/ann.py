@@ -0,0 +1,110 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class IVFIndex:
+    """
+    Inverted-file index over normalized embeddings.
+
+    Chunks are bucketed by their nearest k-means centroid; a query only scores
+    the chunks of the `nprobe` closest buckets instead of the whole matrix.
+    Buckets are stored CSR style: `list_rows[list_offsets[i]:list_offsets[i+1]]`
+    holds the chunk rows assigned to centroid `i`.
+    """
+
+    def __init__(self, centroids, list_offsets, list_rows, nprobe: int = 8):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        embeddings,
+        n_lists: int = None,
+        n_iter: int = 10,
+        sample_size: int = 100_000,
+        nprobe: int = 8,
+        seed: int = 0,
+    ):
+        """
+        Train spherical k-means centroids and assign every chunk to a bucket.
+
+        Args:
+            embeddings (np.ndarray): Normalized chunk embeddings
+            n_lists (int, optional): Number of buckets, defaults to ~sqrt(chunks)
+            n_iter (int): k-means iterations
+            sample_size (int): Maximum number of rows used to train centroids
+            nprobe (int): Default number of buckets scored per query
+            seed (int): Random seed for centroid initialisation
+
+        Returns:
+            IVFIndex: The built index
+        """
+        embeddings = np.asarray(embeddings)
+        num_rows = len(embeddings)
+        if n_lists is None:
+            n_lists = int(np.sqrt(num_rows))
+        n_lists = max(1, min(n_lists, num_rows))
+
+        rng = np.random.default_rng(seed)
+        sample = embeddings
+        if num_rows > sample_size:
+            sample = embeddings[np.sort(rng.choice(num_rows, sample_size, replace=False))]
+        sample = sample.astype(np.float32)
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignments = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # Re-seed empty buckets so every centroid keeps pulling its weight
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+
+        assignments = _assign(embeddings, centroids)
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        counts = np.bincount(assignments, minlength=n_lists)
+        list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        logger.info("Built IVF index with %d lists over %d embeddings", n_lists, num_rows)
+        return cls(centroids.astype(np.float32), list_offsets, list_rows, nprobe)
+
+    def search(self, query_embedding, nprobe: int = None) -> np.ndarray:
+        """
+        Return the chunk rows stored in the `nprobe` buckets closest to the query.
+        """
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        centroid_scores = np.dot(np.asarray(query_embedding).reshape(-1), self.centroids.T)
+        if nprobe < self.n_lists:
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.n_lists)
+
+        return np.concatenate(
+            [
+                self.list_rows[self.list_offsets[probe] : self.list_offsets[probe + 1]]
+                for probe in probes
+            ]
+        )
+
+
+def _assign(embeddings, centroids, block_size: int = 65_536) -> np.ndarray:
+    assignments = np.empty(len(embeddings), dtype=np.int64)
+    for start in range(0, len(embeddings), block_size):
+        block = np.asarray(embeddings[start : start + block_size], dtype=np.float32)
+        assignments[start : start + block_size] = np.argmax(
+            np.dot(block, centroids.T), axis=1
+        )
+    return assignments
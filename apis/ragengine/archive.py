@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from configs import constants
+
+logger = logging.getLogger(__name__)
+
+
+class HtmlArchive:
+    """
+    Fetched page bodies on disk, gzip-compressed and addressed by the SHA-256
+    of their content, so identical pages are stored once and a knowledge base
+    can be rebuilt without crawling.
+
+    Bodies live under `objects/<2 hex>/<62 hex>.gz`. The pages of the last
+    crawl of every sitemap are listed in a manifest under `manifests/`,
+    mapping each URL to its crawl validators and the `digest` of its body.
+    Files are written to a temporary name and renamed, so readers never see
+    a partial file. Saving a manifest deletes the bodies its previous
+    version listed that no manifest lists any more.
+
+    Args:
+        root (str): Archive directory
+        compresslevel (int): gzip level of the stored bodies
+    """
+
+    def __init__(self, root: str = constants.HTML_ARCHIVE_DIR, compresslevel: int = 6):
+        self.root = root
+        self.compresslevel = compresslevel
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], f"{digest[2:]}.gz")
+
+    def manifest_path(self, sitemap_url: str) -> str:
+        name = hashlib.sha256(sitemap_url.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.root, "manifests", f"{name}.json")
+
+    def put(self, body: bytes) -> str:
+        """Store `body` unless already present; returns its digest"""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.object_path(digest)
+        try:
+            # A fresh mtime tells `save_manifest` the body is in use again
+            os.utime(path)
+        except FileNotFoundError:
+            _write_atomic(path, gzip.compress(body, self.compresslevel, mtime=0))
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self.object_path(digest), "rb") as object_file:
+            return gzip.decompress(object_file.read())
+
+    def load_manifest(self, sitemap_url: str) -> dict:
+        """URL -> crawl validators and body `digest` of the last archived crawl"""
+        try:
+            with open(self.manifest_path(sitemap_url)) as manifest_file:
+                return json.load(manifest_file)["pages"]
+        except FileNotFoundError:
+            return {}
+
+    def save_manifest(self, sitemap_url: str, pages: dict):
+        """
+        Record the pages of a crawl, then delete the bodies only the previous
+        crawl of this sitemap used. Bodies stored again since that crawl, by
+        any ingestion, are kept.
+        """
+        path = self.manifest_path(sitemap_url)
+        try:
+            previous_saved_at = os.path.getmtime(path)
+        except FileNotFoundError:
+            previous_saved_at = None
+        dropped = _digests(self.load_manifest(sitemap_url)) - _digests(pages)
+
+        manifest = {"sitemap_url": sitemap_url, "pages": pages}
+        _write_atomic(path, json.dumps(manifest).encode("utf-8"))
+        logger.info("Archived %d pages of %s", len(pages), sitemap_url)
+
+        referenced = self._referenced_digests() if dropped else None
+        if referenced is not None:
+            self._prune(dropped - referenced, previous_saved_at)
+
+    def _referenced_digests(self) -> set | None:
+        referenced = set()
+        manifests_dir = os.path.join(self.root, "manifests")
+        for name in os.listdir(manifests_dir):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(manifests_dir, name)) as manifest_file:
+                        referenced |= _digests(json.load(manifest_file)["pages"])
+                except (OSError, ValueError, KeyError) as e:
+                    # An unreadable manifest could list anything: keep every body
+                    logger.warning("Not pruning the archive, error reading manifest %s: %s", name, e)
+                    return None
+        return referenced
+
+    def _prune(self, digests, saved_before: float):
+        removed = 0
+        for digest in digests:
+            path = self.object_path(digest)
+            try:
+                if os.path.getmtime(path) <= saved_before:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        logger.info("Removed %d archived pages no longer referenced", removed)
+
+
+def _digests(pages: dict) -> set:
+    return {crawl["digest"] for crawl in pages.values() if "digest" in crawl}
+
+
+def _write_atomic(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        with open(tmp_path, "wb") as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -1,86 +1,285 @@
+import asyncio
+import atexit
+import logging
+import threading
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import google.generativeai as genai
 
-from configs.constants import GEMINI_API_KEY
+from configs import constants
+from .cache import AnswerCache, LRUCache, normalize_query
+from .context_formatters import format_chunks_for_llm
+from .embedding_service import INGEST_PRIORITY, QUERY_PRIORITY, EmbeddingService
+from .llm import LLMProvider, get_llm_provider
+from .metrics import timed
+from .retrieval import (
+    build_page_index,
+    num_chunks,
+    query_block_size,
+    ranked_rows,
+    retrieve_chunks,
+    search_batch,
+    top_k_pages,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class Brain:
 
-    def __init__(self, embedding_model_name: str = "BAAI/bge-small-en-v1.5"):
-        self.embed_model = SentenceTransformer(
-            embedding_model_name, trust_remote_code=True
+    def __init__(
+        self,
+        embedding_model_name: str = "BAAI/bge-small-en-v1.5",
+        llm: LLMProvider = None,
+    ):
+        self.embedding_model_name = embedding_model_name
+        # The embedding model and the LLM client are created on first use or
+        # by `warm_up`, so importing and constructing a Brain stays cheap
+        self._embed_model = None
+        self._llm = llm
+        self._load_lock = threading.Lock()
+
+        self._pool = None
+        self.embedding_service = EmbeddingService(self._encode)
+        atexit.register(self.close)
+
+        # Answers are scoped by knowledge base version, so answers from other
+        # knowledge bases or older ingests of the same site are never served
+        self.query_cache = LRUCache(constants.QUERY_CACHE_SIZE, constants.QUERY_CACHE_TTL)
+        self.answer_cache = AnswerCache(
+            constants.ANSWER_CACHE_SIZE,
+            constants.ANSWER_CACHE_TTL,
+            constants.ANSWER_CACHE_SIMILARITY,
         )
-        genai.configure(api_key=GEMINI_API_KEY)
-        print(f"Loaded embedding model: {embedding_model_name}")
+
+    @property
+    def embed_model(self):
+        if self._embed_model is None:
+            with self._load_lock:
+                if self._embed_model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    self._embed_model = SentenceTransformer(
+                        self.embedding_model_name, trust_remote_code=True
+                    )
+                    logger.info("Loaded embedding model: %s", self.embedding_model_name)
+        return self._embed_model
+
+    @property
+    def llm(self) -> LLMProvider:
+        if self._llm is None:
+            with self._load_lock:
+                if self._llm is None:
+                    self._llm = get_llm_provider()
+        return self._llm
+
+    @property
+    def is_ready(self) -> bool:
+        return self._embed_model is not None and self._llm is not None
+
+    def warm_up(self):
+        """Load the embedding model and LLM client and run one query through them"""
+        # Accessing the property is what creates the client
+        self.llm
+        self.embedding_service.embed(["warm up"], priority=QUERY_PRIORITY).result()
+
+    def _encode(self, documents: list[str], use_multi_process: bool):
+        with timed("embed_batch", items=len(documents)):
+            if use_multi_process and len(documents) >= constants.EMBEDDING_POOL_MIN_BATCH:
+                if self._pool is None:
+                    self._pool = self.embed_model.start_multi_process_pool()
+                return self.embed_model.encode_multi_process(
+                    documents, self._pool, normalize_embeddings=True
+                )
+            return self.embed_model.encode(documents, normalize_embeddings=True)
+
+    def close(self):
+        self.embedding_service.close()
+        if self._pool is not None:
+            self._embed_model.stop_multi_process_pool(self._pool)
+            self._pool = None
 
     def generate_embeddings(
         self, documents: list[str], use_multi_process: bool = False
     ) -> list[list[float]]:
-        if use_multi_process:
-            pool = self.embed_model.start_multi_process_pool()
-            embeddings = self.embed_model.encode_multi_process(
-                documents, pool, normalize_embeddings=True, show_progress_bar=True
-            )
-            self.embed_model.stop_multi_process_pool(pool)
-        else:
-            embeddings = self.embed_model.encode(
-                documents, normalize_embeddings=True, show_progress_bar=True
-            )
-        print(
-            f"Generated embeddings for {len(documents)} documents with size {embeddings.size}"
+        embeddings = self.embedding_service.embed(
+            documents, priority=INGEST_PRIORITY, use_multi_process=use_multi_process
+        ).result()
+        logger.debug(
+            "Generated embeddings for %d documents with size %d", len(documents), embeddings.size
         )
         return embeddings
 
+    def encode_query(self, query: str):
+        key = normalize_query(query)
+        with timed("query_encode"):
+            query_embedding = self.query_cache.get(key)
+            if query_embedding is None:
+                query_embedding = self.embedding_service.embed(
+                    [query], priority=QUERY_PRIORITY
+                ).result()
+                self.query_cache.set(key, query_embedding)
+        return query_embedding
+
+    def encode_queries(self, queries: list[str]) -> np.ndarray:
+        """
+        Embeddings of many queries, shape (queries, dim). Queries missing from
+        the query cache are embedded together at ingest priority, so a large
+        batch does not hold up interactive queries.
+        """
+        keys = [normalize_query(query) for query in queries]
+        with timed("query_encode", items=len(queries)):
+            embeddings = [self.query_cache.get(key) for key in keys]
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            if missing:
+                encoded = self.embedding_service.embed(
+                    [queries[i] for i in missing], priority=INGEST_PRIORITY
+                ).result()
+                for i, embedding in zip(missing, encoded):
+                    embeddings[i] = embedding.reshape(1, -1)
+                    self.query_cache.set(keys[i], embeddings[i])
+        return np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+
+    def cache_stats(self) -> dict:
+        return {
+            "query_embeddings": self.query_cache.stats(),
+            "answers": self.answer_cache.stats(),
+        }
+
+    def _page_index(self, VECTOR_DB):
+        page_index = VECTOR_DB.get("page_index")
+        if page_index is None:
+            page_index = build_page_index(VECTOR_DB["data"].keys(), num_chunks(VECTOR_DB))
+        return page_index
+
+    def search(
+        self,
+        VECTOR_DB,
+        query_embedding,
+        k: int = 3,
+        nprobe: int = None,
+        rescore: bool = True,
+        query: str = None,
+        retrieval_mode: str = constants.RETRIEVAL_MODE,
+    ):
+        """
+        Returns:
+            tuple: (pages, chunk_rows) the positions of the `k` best pages and
+                the rows of their best matching chunks, best first
+        """
+        with timed("search"):
+            page_index = self._page_index(VECTOR_DB)
+
+            scores, candidate_rows = retrieve_chunks(
+                VECTOR_DB,
+                query,
+                query_embedding,
+                mode=retrieval_mode,
+                nprobe=nprobe,
+                rescore=rescore,
+            )
+
+            pages = top_k_pages(scores, page_index, k, candidate_rows)
+            rows = ranked_rows(scores, candidate_rows, constants.CONTEXT_CANDIDATES)
+            return pages, rows[np.isin(page_index[rows], pages)]
+
+    def search_batch(
+        self,
+        VECTOR_DB,
+        query_embeddings,
+        k: int = 3,
+        rescore: bool = True,
+        queries: list[str] = None,
+        retrieval_mode: str = constants.RETRIEVAL_MODE,
+        block_size: int = constants.BATCH_QUERY_BLOCK_SIZE,
+    ) -> list:
+        """
+        `search` for many queries, scoring up to `block_size` queries per
+        matrix product; fewer on large knowledge bases, so a block's score
+        matrices stay within `BATCH_SCORE_MEMORY_BYTES`.
+
+        Returns:
+            list: (pages, chunk_rows) per query
+        """
+        page_index = self._page_index(VECTOR_DB)
+        block_size = query_block_size(VECTOR_DB, block_size)
+        queries = queries if queries is not None else [None] * len(query_embeddings)
+        results = []
+        with timed("search", items=len(query_embeddings)):
+            for start in range(0, len(query_embeddings), block_size):
+                stop = start + block_size
+                results.extend(
+                    search_batch(
+                        VECTOR_DB,
+                        queries[start:stop],
+                        query_embeddings[start:stop],
+                        page_index,
+                        k,
+                        mode=retrieval_mode,
+                        rescore=rescore,
+                    )
+                )
+        return results
+
     def get_top_k_matching_docs(
-        self, docs, docs_embedding, query_embedding, k: int = 3
-    ) -> list[int]:
-
-        def bin_search_on_docs_embedding(target):
-            keys = list(docs.keys())
-
-            left, right = 0, len(keys) - 1
-
-            while left <= right:
-                mid = (left + right) // 2
-                start, end = keys[mid].split("-")
-                start, end = int(start), int(end)
-
-                if end < target:
-                    left = mid + 1
-                elif start > target:
-                    right = mid - 1
-                else:
-                    return keys[mid]
-            return keys[left]
-
-        scores = np.dot(query_embedding, docs_embedding.T)
-        top_k_doc_keys = set()
-        for ids in np.argsort(scores.flatten())[::-1]:
-            if len(top_k_doc_keys) == k:
-                break
-            top_k_doc_keys.add(bin_search_on_docs_embedding(ids))
-
-        return top_k_doc_keys
-
-    def get_context(self, docs, docs_embedding, query_embedding) -> str:
-        top_k_doc_keys = self.get_top_k_matching_docs(
-            docs,
-            docs_embedding,
-            query_embedding,
+        self,
+        VECTOR_DB,
+        query_embedding,
+        k: int = 3,
+        nprobe: int = None,
+        rescore: bool = True,
+        query: str = None,
+        retrieval_mode: str = constants.RETRIEVAL_MODE,
+    ) -> list[str]:
+        pages, _ = self.search(
+            VECTOR_DB, query_embedding, k, nprobe, rescore, query, retrieval_mode
         )
-        most_scored_docs = [docs[keys] for keys in top_k_doc_keys]
-        context = ""
-        for doc in most_scored_docs:
-            context += f"{doc}\n"
-        return context
+        doc_keys = list(VECTOR_DB["data"].keys())
+        return [doc_keys[page] for page in pages]
+
+    def get_context(
+        self,
+        VECTOR_DB,
+        query_embedding,
+        nprobe: int = None,
+        rescore: bool = True,
+        top_k_doc_keys=None,
+        chunk_rows=None,
+        max_tokens: int = constants.CONTEXT_MAX_TOKENS,
+    ) -> str:
+        """
+        Prompt context for a query.
 
-    def generate_response(self, query: str, VECTOR_DB) -> str:
+        With `chunk_rows` and a knowledge base that kept its chunk texts, the
+        context is packed from those chunks within `max_tokens`; otherwise the
+        full text of the top pages is used.
+        """
         docs = VECTOR_DB["data"]
-        docs_embedding = VECTOR_DB["embedding"]
-        query_embedding = self.embed_model.encode([query], normalize_embeddings=True)
-        context = self.get_context(docs, docs_embedding, query_embedding)
-        prompt = f"""
+        if chunk_rows is not None and VECTOR_DB.get("chunks") is not None:
+            return self._get_chunk_context(VECTOR_DB, chunk_rows, max_tokens)
+
+        if top_k_doc_keys is None:
+            top_k_doc_keys = self.get_top_k_matching_docs(
+                VECTOR_DB,
+                query_embedding,
+                nprobe=nprobe,
+                rescore=rescore,
+            )
+        return "".join(f"{docs[key]}\n" for key in top_k_doc_keys)
+
+    def _get_chunk_context(self, VECTOR_DB, chunk_rows, max_tokens) -> str:
+        page_index = self._page_index(VECTOR_DB)
+        page_urls = VECTOR_DB.get("page_urls") or []
+        chunk_store = VECTOR_DB["chunks"]
+
+        chunks = []
+        for row in np.asarray(chunk_rows).tolist():
+            page = int(page_index[row])
+            source = page_urls[page] if page < len(page_urls) else None
+            chunks.append((page, row, chunk_store.texts[row], chunk_store.metadata(row), source))
+        return format_chunks_for_llm(chunks, max_tokens)
+
+    def build_prompt(self, query: str, context: str) -> str:
+        return f"""
             You are an intelligent search engine. You will be provided with some retrieved context, as well as the users query.
 
             Your job is to understand the request, and answer based on the retrieved context.
@@ -92,9 +291,252 @@ class Brain:
 
             Question: {query}
         """
-        print(prompt)
-        model = genai.GenerativeModel("gemini-pro")
-        response = model.generate_content(prompt)
-        if response.error:
-            raise Exception(response.error)
-        return response.text
+
+    def prepare_response(
+        self,
+        query: str,
+        VECTOR_DB,
+        nprobe: int = None,
+        rescore: bool = True,
+        use_cache: bool = True,
+        retrieval_mode: str = constants.RETRIEVAL_MODE,
+    ) -> dict:
+        """
+        Run retrieval for `query` and build the LLM prompt.
+
+        Returns:
+            dict: "answer" when the answer cache already has one, otherwise
+                the "prompt" to generate from; plus the "doc_keys" and
+                "query_embedding" and knowledge base "version" needed to
+                cache the generated answer
+        """
+        query_embedding = self.encode_query(query)
+        pages, chunk_rows = self.search(
+            VECTOR_DB,
+            query_embedding,
+            nprobe=nprobe,
+            rescore=rescore,
+            query=query,
+            retrieval_mode=retrieval_mode,
+        )
+        return self._prepare_prompt(query, VECTOR_DB, query_embedding, pages, chunk_rows, use_cache)
+
+    def _prepare_prompt(
+        self,
+        query: str,
+        VECTOR_DB,
+        query_embedding,
+        pages,
+        chunk_rows,
+        use_cache: bool,
+        doc_keys: list[str] = None,
+    ) -> dict:
+        if doc_keys is None:
+            doc_keys = list(VECTOR_DB["data"].keys())
+        top_k_doc_keys = [doc_keys[page] for page in pages]
+        prepared = {
+            "doc_keys": top_k_doc_keys,
+            "query_embedding": query_embedding,
+            "version": VECTOR_DB.get("version"),
+        }
+        if use_cache:
+            answer = self.answer_cache.lookup(
+                top_k_doc_keys, query, query_embedding, scope=prepared["version"]
+            )
+            if answer is not None:
+                return {**prepared, "answer": answer}
+
+        with timed("context"):
+            context = self.get_context(
+                VECTOR_DB,
+                query_embedding,
+                top_k_doc_keys=top_k_doc_keys,
+                chunk_rows=chunk_rows,
+            )
+            prompt = self.build_prompt(query, context)
+        logger.debug("Prompt: %s", prompt)
+        return {**prepared, "prompt": prompt}
+
+    def _cache_answer(self, query: str, prepared: dict, answer: str):
+        self.answer_cache.store(
+            prepared["doc_keys"],
+            query,
+            prepared["query_embedding"],
+            answer,
+            scope=prepared["version"],
+        )
+
+    def generate_response(
+        self,
+        query: str,
+        VECTOR_DB,
+        nprobe: int = None,
+        rescore: bool = True,
+        use_cache: bool = True,
+        retrieval_mode: str = constants.RETRIEVAL_MODE,
+    ) -> str:
+        prepared = self.prepare_response(
+            query, VECTOR_DB, nprobe, rescore, use_cache, retrieval_mode
+        )
+        if "answer" in prepared:
+            return prepared["answer"]
+
+        with timed("generate"):
+            answer = self.llm.generate(prepared["prompt"])
+        if use_cache:
+            self._cache_answer(query, prepared, answer)
+        return answer
+
+    async def agenerate_response(
+        self,
+        query: str,
+        VECTOR_DB,
+        nprobe: int = None,
+        rescore: bool = True,
+        use_cache: bool = True,
+        retrieval_mode: str = constants.RETRIEVAL_MODE,
+    ) -> str:
+        """
+        Async counterpart of `generate_response`.
+
+        Retrieval runs in a worker thread; generation awaits the provider, so
+        no thread is held while the LLM is working.
+        """
+        prepared = await asyncio.to_thread(
+            self.prepare_response,
+            query,
+            VECTOR_DB,
+            nprobe,
+            rescore,
+            use_cache,
+            retrieval_mode,
+        )
+        if "answer" in prepared:
+            return prepared["answer"]
+
+        with timed("generate"):
+            answer = await self.llm.agenerate(prepared["prompt"])
+        if use_cache:
+            self._cache_answer(query, prepared, answer)
+        return answer
+
+    async def astream_response(
+        self,
+        query: str,
+        VECTOR_DB,
+        nprobe: int = None,
+        rescore: bool = True,
+        use_cache: bool = True,
+        retrieval_mode: str = constants.RETRIEVAL_MODE,
+    ):
+        """
+        Yield the answer in fragments as the LLM produces them.
+
+        A cached answer is yielded as a single fragment. The full answer is
+        only cached once the stream completed.
+        """
+        prepared = await asyncio.to_thread(
+            self.prepare_response,
+            query,
+            VECTOR_DB,
+            nprobe,
+            rescore,
+            use_cache,
+            retrieval_mode,
+        )
+        if "answer" in prepared:
+            yield prepared["answer"]
+            return
+
+        fragments = []
+        with timed("generate"):
+            async for fragment in self.llm.astream(prepared["prompt"]):
+                fragments.append(fragment)
+                yield fragment
+        if use_cache:
+            self._cache_answer(query, prepared, "".join(fragments))
+
+    async def answer_batch(
+        self,
+        queries: list[str],
+        VECTOR_DB,
+        k: int = 3,
+        rescore: bool = True,
+        use_cache: bool = True,
+        retrieval_mode: str = constants.RETRIEVAL_MODE,
+        retrieval_only: bool = False,
+        max_concurrency: int = constants.BATCH_GENERATION_CONCURRENCY,
+    ) -> list[dict]:
+        """
+        Retrieve and answer many queries.
+
+        All queries are encoded and searched together (see `search_batch`);
+        the answers are then prepared and generated for at most
+        `max_concurrency` queries at a time. A failed generation only fails
+        its own query.
+
+        Returns:
+            list: One dict per query with its "query" and the "sources" of its
+                top pages, plus the "response" or the "error" of its
+                generation unless `retrieval_only`
+        """
+        query_embeddings = await asyncio.to_thread(self.encode_queries, queries)
+        searched = await asyncio.to_thread(
+            self.search_batch,
+            VECTOR_DB,
+            query_embeddings,
+            k,
+            rescore,
+            queries,
+            retrieval_mode,
+        )
+
+        doc_keys = list(VECTOR_DB["data"].keys())
+        sources = VECTOR_DB.get("page_urls") or doc_keys
+        results = [
+            {"query": query, "sources": [sources[page] for page in pages.tolist()]}
+            for query, (pages, _) in zip(queries, searched)
+        ]
+        if retrieval_only:
+            return results
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def answer(query, query_embedding, pages, chunk_rows):
+            # Prompts are built under the semaphore too, so a large batch takes
+            # at most `max_concurrency` of the shared worker threads
+            async with semaphore:
+                prepared = await asyncio.to_thread(
+                    self._prepare_prompt,
+                    query,
+                    VECTOR_DB,
+                    query_embedding.reshape(1, -1),
+                    pages,
+                    chunk_rows,
+                    use_cache,
+                    doc_keys,
+                )
+                if "answer" in prepared:
+                    return prepared["answer"]
+                with timed("generate"):
+                    response = await self.llm.agenerate(prepared["prompt"])
+            if use_cache:
+                self._cache_answer(query, prepared, response)
+            return response
+
+        answers = await asyncio.gather(
+            *(
+                answer(query, query_embedding, pages, chunk_rows)
+                for query, query_embedding, (pages, chunk_rows) in zip(
+                    queries, query_embeddings, searched
+                )
+            ),
+            return_exceptions=True,
+        )
+        for result, response in zip(results, answers):
+            if isinstance(response, Exception):
+                logger.warning("Batch generation failed for %r: %s", result["query"], response)
+                result["error"] = str(response)
+            else:
+                result["response"] = response
+        return results
@@ -0,0 +1,118 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live and hit/miss counters.
+
+    Args:
+        maxsize (int): Maximum number of entries
+        ttl (float, optional): Seconds an entry stays valid, None for no expiry
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        """Snapshot of the live (key, value) pairs, least recently used first"""
+        with self._lock:
+            return [
+                (key, entry[1])
+                for key, entry in self._entries.items()
+                if not self._expired(entry)
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+    def _expired(self, entry) -> bool:
+        return self.ttl is not None and time.monotonic() - entry[0] > self.ttl
+
+
+class AnswerCache(LRUCache):
+    """
+    Answers keyed by a scope (the knowledge base version), the retrieved page
+    set and the normalized query.
+
+    With a `similarity_threshold`, a miss on the exact key falls back to the
+    cached answer for the same scope and page set whose query embedding has
+    the highest cosine similarity, if it reaches the threshold.
+    """
+
+    def __init__(
+        self, maxsize: int = 1024, ttl: float = None, similarity_threshold: float = None
+    ):
+        super().__init__(maxsize, ttl)
+        self.similarity_threshold = similarity_threshold
+        self.semantic_hits = 0
+
+    def lookup(self, page_keys, query: str, query_embedding, scope=None):
+        pages = (scope, tuple(sorted(page_keys)))
+        cached = self.get((pages, normalize_query(query)))
+        if cached is not None or self.similarity_threshold is None:
+            return None if cached is None else cached[1]
+
+        query_embedding = np.asarray(query_embedding).reshape(-1)
+        best_score, best_answer = self.similarity_threshold, None
+        for (cached_pages, _), (embedding, answer) in self.items():
+            if cached_pages != pages:
+                continue
+            score = float(np.dot(embedding, query_embedding))
+            if score >= best_score:
+                best_score, best_answer = score, answer
+        if best_answer is not None:
+            with self._lock:
+                self.semantic_hits += 1
+        return best_answer
+
+    def store(self, page_keys, query: str, query_embedding, answer: str, scope=None):
+        self.set(
+            ((scope, tuple(sorted(page_keys))), normalize_query(query)),
+            (np.asarray(query_embedding).reshape(-1), answer),
+        )
+
+    def stats(self) -> dict:
+        return {**super().stats(), "semantic_hits": self.semantic_hits}
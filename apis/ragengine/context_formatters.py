@@ -1,3 +1,6 @@
+from configs import constants
+
+
 def format_for_llm(page_data, include_metadata=True, max_chars=None):
     """
     Format scraped page data into a clean context string suitable for LLM processing
@@ -124,6 +127,107 @@ def format_for_embeddings(page_data):
     
     return chunks
 
+def chunk_metadata(chunk):
+    """
+    The part of a `format_for_embeddings` chunk needed to rebuild its context:
+    its type, the heading it sits under and the heading level.
+    """
+    metadata = chunk["metadata"]
+    return {
+        "type": chunk["type"],
+        "heading": metadata.get("heading"),
+        "level": metadata.get("heading_level", metadata.get("level")),
+    }
+
+
+def estimate_tokens(text, chars_per_token=constants.CHARS_PER_TOKEN):
+    """Rough token count of `text` for prompt budgeting"""
+    return len(text) // chars_per_token + 1
+
+
+def format_chunks_for_llm(chunks, max_tokens=None):
+    """
+    Pack matched chunks into a context string within a token budget.
+
+    Chunks are taken best match first; each one brings the source line of its
+    page and the heading it sits under, counted once per page. Chunks whose
+    text was already taken are skipped, and chunks that no longer fit the
+    budget are left out. The selected chunks are then written page by page
+    (best page first) in their original order on the page.
+
+    Args:
+        chunks (list): (page, row, text, metadata, source) tuples ordered by
+            relevance, with `metadata` as returned by `chunk_metadata`
+        max_tokens (int, optional): Token budget (None for no limit)
+
+    Returns:
+        str: Formatted context string
+    """
+    selected = []
+    seen_texts = set()
+    counted_lines = set()
+    remaining = max_tokens
+
+    for page, row, text, metadata, source in chunks:
+        key = " ".join(text.split()).lower()
+        if not key or key in seen_texts:
+            continue
+
+        new_lines = []
+        if (page, None) not in counted_lines and source:
+            new_lines.append(((page, None), f"Source: {source}"))
+        heading = text if metadata["type"] == "heading" else metadata.get("heading")
+        if heading and (page, heading) not in counted_lines:
+            new_lines.append(((page, heading), _heading_line(heading, metadata.get("level"))))
+        body = _body_lines(text, metadata)
+
+        cost = sum(estimate_tokens(line) for _, line in new_lines)
+        cost += sum(estimate_tokens(line) for line in body)
+        if remaining is not None:
+            if cost > remaining:
+                continue
+            remaining -= cost
+
+        seen_texts.add(key)
+        counted_lines.update(line_key for line_key, _ in new_lines)
+        selected.append((page, row, text, metadata, source))
+
+    page_order = {}
+    for page, *_ in selected:
+        page_order.setdefault(page, len(page_order))
+    selected.sort(key=lambda chunk: (page_order[chunk[0]], chunk[1]))
+
+    context_parts = []
+    written_lines = set()
+    for page, row, text, metadata, source in selected:
+        if (page, None) not in written_lines:
+            if context_parts:
+                context_parts.append("")
+            if source:
+                context_parts.append(f"Source: {source}")
+            written_lines.add((page, None))
+
+        heading = text if metadata["type"] == "heading" else metadata.get("heading")
+        if heading and (page, heading) not in written_lines:
+            context_parts.append(_heading_line(heading, metadata.get("level")))
+            written_lines.add((page, heading))
+
+        context_parts.extend(_body_lines(text, metadata))
+
+    return "\n".join(context_parts)
+
+
+def _heading_line(heading, level):
+    return f"{'#' * (level or 1)} {heading}"
+
+
+def _body_lines(text, metadata):
+    if metadata["type"] == "heading":
+        return []
+    if metadata["type"] == "title":
+        return [f"Title: {text}"]
+    return [text]
+
 # Example usage:
 if __name__ == "__main__":
     # Sample page data
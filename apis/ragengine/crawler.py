@@ -0,0 +1,240 @@
+import asyncio
+import importlib.util
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+
+from configs import constants
+from .metrics import timed
+from .scrape import (
+    conditional_headers,
+    is_unchanged,
+    iter_sitemap_batches,
+    parse_page,
+    response_validators,
+)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCrawler:
+    """
+    Asyncio page crawler on a pooled, keep-alive httpx client.
+
+    Concurrency is bounded globally and per host, 429/5xx answers and
+    transport errors are retried with full-jitter exponential backoff
+    (honouring `Retry-After`), and HTTP/2 is used when `h2` is installed.
+    HTML parsing runs in worker threads so it never blocks the event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = constants.CRAWLER_MAX_CONCURRENCY,
+        per_host_concurrency: int = constants.CRAWLER_PER_HOST_CONCURRENCY,
+        max_retries: int = constants.CRAWLER_MAX_RETRIES,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 10.0,
+        http2: bool = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.http2 = (
+            importlib.util.find_spec("h2") is not None if http2 is None else http2
+        )
+        self._global_semaphore = asyncio.Semaphore(max_concurrency)
+        self._host_semaphores = {}
+
+    def _client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.max_concurrency,
+            max_keepalive_connections=self.max_concurrency,
+        )
+        return httpx.AsyncClient(
+            http2=self.http2,
+            limits=limits,
+            timeout=self.timeout,
+            follow_redirects=True,
+        )
+
+    def _host_semaphore(self, url) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self._host_semaphores[host]
+
+    def _retry_delay(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                    return min(max(delay, 0.0), self.backoff_max)
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    async def fetch(self, client, url, headers=None) -> httpx.Response:
+        """GET `url`, retrying 429/5xx answers and transport errors"""
+        global_semaphore, host_semaphore = self._global_semaphore, self._host_semaphore(url)
+        for attempt in range(self.max_retries + 1):
+            response, error = None, None
+            # Per host first: a task waiting on a busy host holds no global slot
+            async with host_semaphore, global_semaphore:
+                try:
+                    response = await client.get(url, headers=headers)
+                except httpx.TransportError as e:
+                    error = e
+
+            retryable = error is not None or response.status_code in RETRY_STATUS_CODES
+            if not retryable or attempt == self.max_retries:
+                break
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+        if error is not None:
+            raise error
+        return response
+
+    async def scrape_page(self, client, url, validators=None, parse: bool = True):
+        """
+        Async counterpart of `scrape.scrape_page`.
+
+        With `parse=False` the body is not parsed; the page data then holds the
+        raw response as `{"html": ..., "crawl": ...}` for a later stage.
+        """
+        try:
+            with timed("page_fetch"):
+                response = await self.fetch(client, url, conditional_headers(validators))
+            if response.status_code == 304:
+                return url, {"crawl": {**(validators or {}), "not_modified": True}}
+            response.raise_for_status()
+
+            if parse:
+                page_data = await asyncio.to_thread(parse_page, response.content)
+            else:
+                page_data = {"html": response.content}
+            page_data["crawl"] = response_validators(response.headers)
+            return url, page_data
+
+        except Exception as e:
+            logger.warning("Error scraping %s: %s", url, e)
+            return url, {}
+
+    async def crawl(self, entries, crawl_state=None, parse: bool = True):
+        """
+        Scrape sitemap entries and yield `(url, page_data)` as pages complete.
+
+        `entries` is an iterable or an async iterable, so pages can be fetched
+        while the sitemap is still being read. At most a small multiple of
+        `max_concurrency` pages are in flight, so memory stays bounded however
+        many entries there are.
+        """
+        crawl_state = crawl_state or {}
+        window = self.max_concurrency * 4
+        entries = aiter(entries) if hasattr(entries, "__aiter__") else _as_async(entries)
+
+        async with self._client() as client:
+            # The next entry is awaited alongside the pages in flight, so
+            # finished pages are yielded while discovery is still slow
+            pending, next_entry, exhausted = set(), None, False
+            try:
+                while pending or not exhausted:
+                    if next_entry is None and not exhausted and len(pending) < window:
+                        next_entry = asyncio.ensure_future(anext(entries, None))
+                    waiting = pending if next_entry is None else pending | {next_entry}
+                    done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                    if next_entry in done:
+                        entry, next_entry = next_entry.result(), None
+                        if entry is None:
+                            exhausted = True
+                        else:
+                            url, previous = entry["url"], crawl_state.get(entry["url"])
+                            if is_unchanged(entry, previous):
+                                yield url, {"crawl": {**previous, "not_modified": True}}
+                            else:
+                                pending.add(
+                                    asyncio.create_task(
+                                        self._scrape_entry(client, entry, previous, parse)
+                                    )
+                                )
+                    for task in done & pending:
+                        pending.discard(task)
+                        yield task.result()
+            finally:
+                for task in pending | ({next_entry} if next_entry is not None else set()):
+                    task.cancel()
+
+    async def _scrape_entry(self, client, entry, previous, parse):
+        url, page_data = await self.scrape_page(client, entry["url"], previous, parse)
+        if "crawl" in page_data:
+            page_data["crawl"]["lastmod"] = entry["lastmod"]
+        return url, page_data
+
+
+async def _as_async(iterable):
+    for item in iterable:
+        yield item
+
+
+async def iter_sitemap_entries_async(sitemap_url, stopped=None):
+    """
+    Async counterpart of `scrape.iter_sitemap_entries`.
+
+    Entries are taken from the sitemap readers in a worker thread, a batch
+    of whatever was discovered at a time, so the event loop never waits on
+    discovery.
+    """
+    closed = False
+    batches = iter_sitemap_batches(
+        sitemap_url, stopped=lambda: closed or (stopped is not None and stopped())
+    )
+    reading = None
+    try:
+        while True:
+            reading = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+            # Shielded: cancelling the await must not orphan the thread
+            if (batch := await asyncio.shield(reading)) is None:
+                break
+            for entry in batch:
+                yield entry
+    finally:
+        closed = True
+        if reading is not None and not reading.done():
+            # The generator can only be closed once the thread hands it back
+            await asyncio.wait([reading])
+        batches.close()
+
+
+async def scrape_site_from_sitemap_async(sitemap_url, crawl_state=None, **crawler_options):
+    """
+    Async counterpart of `scrape.scrape_site_from_sitemap`.
+
+    Pages are fetched while the sitemap is still being read and collected as
+    they complete; the returned dict still lists them in discovery order.
+    """
+    logger.info("Starting sitemap scraping from: %s", sitemap_url)
+
+    site_data = {}
+
+    async def discovered():
+        async for entry in iter_sitemap_entries_async(sitemap_url):
+            site_data[entry["url"]] = {}
+            yield entry
+
+    async for url, page_data in AsyncCrawler(**crawler_options).crawl(discovered(), crawl_state):
+        site_data[url] = page_data
+    logger.info("Found %d URLs in sitemap", len(site_data))
+    return site_data
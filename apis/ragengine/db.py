@@ -1,19 +1,346 @@
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+from collections.abc import Mapping
 from typing import Generator
 
+import numpy as np
+from fastapi import HTTPException, status
 
-class VectorDB:
-    _instance = None
+from configs import constants
+from .store import (
+    ARRAY_KEYS,
+    PageStore,
+    TextStore,
+    heap_nbytes,
+    load_vector_db,
+    published_version_dir,
+    store_vector_db,
+    stored_version,
+)
 
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = {}
-        return cls._instance
+KB_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
 
+logger = logging.getLogger(__name__)
 
-def get_db() -> Generator:
+
+def memory_usage(db) -> int:
+    """
+    Approximate bytes a vector DB holds in process memory: arrays, indexes,
+    page and chunk texts. Memory-mapped files of a stored knowledge base are
+    not counted (see `heap_nbytes`): evicting it would free nothing the page
+    cache could not reclaim on its own.
+    """
+    size = sum(
+        heap_nbytes(db[key]) for key in ARRAY_KEYS if isinstance(db.get(key), np.ndarray)
+    )
+    ann_index = db.get("ann_index")
+    if ann_index is not None:
+        size += sum(
+            heap_nbytes(array)
+            for array in (ann_index.centroids, ann_index.list_offsets, ann_index.list_rows)
+        )
+    bm25_index = db.get("bm25_index")
+    if bm25_index is not None:
+        size += sum(
+            heap_nbytes(array)
+            for array in (bm25_index.offsets, bm25_index.rows, bm25_index.tfs, bm25_index.doc_lengths)
+        )
+        terms = bm25_index.terms
+        size += terms.heap_nbytes if isinstance(terms, TextStore) else sum(len(term) for term in terms)
+    data = db.get("data")
+    if isinstance(data, PageStore):
+        size += data.heap_nbytes
+    elif data:
+        size += sum(len(text) for text in data.values())
+    chunks = db.get("chunks")
+    if chunks is not None:
+        size += chunks.heap_nbytes
+    return size
+
+
+class VectorDBSnapshot(Mapping):
+    """
+    Read-only view of one complete vector DB.
+
+    Snapshots are never modified once published: entries cannot be
+    assigned and the numpy arrays are made read-only. An ingestion or a
+    load builds a new dict and publishes a new snapshot; requests that
+    already hold the previous one finish on it, and it is released with the
+    last of them.
+    """
+
+    def __init__(self, db: Mapping = ()):
+        entries = dict(db)
+        for value in entries.values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        self._entries = entries
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"VectorDBSnapshot(url={self.get('url')!r}, version={self.get('version')!r})"
+
+
+class KnowledgeBaseRegistry:
+    """
+    Named vector DBs, one per site or tenant, sharing a single `Brain`.
+
+    Knowledge bases are persisted under `root/<kb_id>`. They are loaded from
+    disk on first access, and once the loaded ones hold more than
+    `memory_budget` bytes of heap memory (see `memory_usage`) the least
+    recently used are dropped from memory. Only knowledge
+    bases whose current version is on disk are evicted, so nothing is lost;
+    they are reloaded on their next access.
+
+    Every knowledge base is held as an immutable `VectorDBSnapshot` and
+    replaced with read-copy-update: a new snapshot is fully built, then
+    published with a single reference swap. Readers take no lock on the
+    common path, and never see a half-built or half-loaded vector DB.
+    Replaced snapshots are reported as draining until the last request
+    holding them finishes.
+
+    Stored knowledge bases are memory-mapped, so every worker process maps
+    the same physical pages. At most every `reload_interval` seconds an
+    access checks whether the published version on disk changed, e.g.
+    because another worker stored an ingestion, and switches to it. The new
+    version is mapped lazily and the old mapping is released once the
+    requests still holding it finish, so a swap does not double memory.
+
+    Args:
+        root (str): Directory holding one published vector DB per knowledge base
+        memory_budget (int): Heap bytes of loaded knowledge bases to keep in memory
+        reload_interval (float): Seconds between checks for a newer stored version
+    """
+
+    def __init__(
+        self,
+        root: str = constants.KNOWLEDGE_BASES_DIR,
+        memory_budget: int = constants.KNOWLEDGE_BASE_MEMORY_BUDGET,
+        reload_interval: float = constants.KNOWLEDGE_BASE_RELOAD_INTERVAL,
+    ):
+        self.root = root
+        self.memory_budget = memory_budget
+        self.reload_interval = reload_interval
+        # Written under the lock, read without it
+        self._dbs = {}
+        self._last_used = {}
+        # Version directory on disk when each knowledge base was last
+        # loaded, published or stored, and when that was last checked
+        self._seen_versions = {}
+        self._checked_at = {}
+        # Replaced snapshots still referenced by requests, by id
+        self._draining = {}
+        self._lock = threading.RLock()
+
+    def path(self, kb_id: str) -> str:
+        if not KB_ID_PATTERN.match(kb_id):
+            raise ValueError(f"Invalid knowledge base id: {kb_id!r}")
+        return os.path.join(self.root, kb_id)
+
+    def get(self, kb_id: str) -> VectorDBSnapshot:
+        """
+        The current snapshot of `kb_id`, loading it from disk if it is not in
+        memory.
+
+        Unknown ids give an empty, unregistered snapshot; knowledge bases are
+        created by `publish`ing the result of an ingestion.
+        """
+        path = self.path(kb_id)
+        db = self._dbs.get(kb_id)
+        if db is not None and not self._reload_due(kb_id):
+            self._last_used[kb_id] = time.monotonic()
+            return db
+
+        with self._lock:
+            db = self._dbs.get(kb_id)
+            if db is None or self._newer_version_stored(kb_id):
+                if not os.path.lexists(path):
+                    return db if db is not None else VectorDBSnapshot()
+                db = self._load(kb_id)
+            self._last_used[kb_id] = time.monotonic()
+            self.evict(keep=kb_id)
+            return db
+
+    def load(self, kb_id: str) -> VectorDBSnapshot:
+        """
+        (Re)load `kb_id` from disk. Requests already holding the previous
+        snapshot keep using it; new requests get the loaded one.
+        """
+        self.path(kb_id)
+        with self._lock:
+            db = self._load(kb_id)
+            self.evict(keep=kb_id)
+            return db
+
+    def publish(self, kb_id: str, db: Mapping) -> VectorDBSnapshot:
+        """
+        Make a snapshot of the complete vector DB `db` the current one of
+        `kb_id`. Requests already holding the previous snapshot keep using
+        it; new requests get the new one. `db` must not be modified after.
+        """
+        path = self.path(kb_id)
+        snapshot = VectorDBSnapshot(db)
+        with self._lock:
+            self._replace(kb_id, snapshot)
+            self._seen_versions[kb_id] = published_version_dir(path)
+            self._checked_at[kb_id] = self._last_used[kb_id] = time.monotonic()
+            self.evict(keep=kb_id)
+        return snapshot
+
+    def store(self, kb_id: str) -> str:
+        """
+        Persist `kb_id` and switch to the stored files: the in-memory arrays
+        are dropped for mappings that the other workers pick up and share.
+        """
+        snapshot = self._dbs[kb_id]
+        # Written and mapped without the lock: snapshots are immutable, and
+        # readers keep using the in-memory one until the swap
+        version_dir = store_vector_db(snapshot, self.path(kb_id))
+        stored = self._read(kb_id)
+        with self._lock:
+            # Unless a newer snapshot was published meanwhile
+            if self._dbs.get(kb_id) is snapshot:
+                self._install(kb_id, *stored)
+        return version_dir
+
+    def evict(self, keep: str = None):
+        """Drop least recently used knowledge bases until under the memory budget"""
+        with self._lock:
+            usage = {kb_id: memory_usage(db) for kb_id, db in self._dbs.items()}
+            total = sum(usage.values())
+            for kb_id in sorted(self._dbs, key=lambda kb_id: self._last_used.get(kb_id, 0.0)):
+                if total <= self.memory_budget:
+                    break
+                if kb_id == keep or not self._is_persisted(kb_id):
+                    continue
+                self._replace(kb_id, None)
+                total -= usage[kb_id]
+                logger.info("Evicted knowledge base %s from memory", kb_id)
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            kb_ids = set(self._dbs)
+            if os.path.isdir(self.root):
+                kb_ids.update(
+                    name for name in os.listdir(self.root) if KB_ID_PATTERN.match(name)
+                    and os.path.islink(os.path.join(self.root, name))
+                )
+            draining = [kb_id for kb_id, _ in list(self._draining.values())]
+            return [
+                {
+                    "kb_id": kb_id,
+                    "loaded": kb_id in self._dbs,
+                    "status": self._dbs.get(kb_id, {}).get("status"),
+                    "url": self._dbs.get(kb_id, {}).get("url"),
+                    "version": self._dbs.get(kb_id, {}).get("version"),
+                    "memory_bytes": memory_usage(self._dbs.get(kb_id, {})),
+                    "draining_snapshots": draining.count(kb_id),
+                    "ingest_stats": self._dbs.get(kb_id, {}).get("ingest_stats"),
+                    "stored": stored_version(self.path(kb_id)) is not None,
+                }
+                for kb_id in sorted(kb_ids)
+            ]
+
+    def _replace(self, kb_id: str, snapshot: VectorDBSnapshot):
+        """Swap in `snapshot` (None to drop) and track the replaced one until released"""
+        previous = self._dbs.get(kb_id)
+        if snapshot is None:
+            self._dbs.pop(kb_id, None)
+        else:
+            self._dbs[kb_id] = snapshot
+        if previous is None or previous is snapshot:
+            return
+
+        key, version = id(previous), previous.get("version")
+
+        def released(_):
+            self._draining.pop(key, None)
+            logger.debug("Released snapshot of %s version %s", kb_id, version)
+
+        self._draining[key] = (kb_id, weakref.ref(previous, released))
+
+    def _load(self, kb_id: str) -> VectorDBSnapshot:
+        return self._install(kb_id, *self._read(kb_id))
+
+    def _read(self, kb_id: str) -> tuple[str, VectorDBSnapshot]:
+        """Map the published version of `kb_id`; needs no lock"""
+        path = self.path(kb_id)
+        version_dir = published_version_dir(path)
+        db = {}
+        try:
+            load_vector_db(db, path)
+        except FileNotFoundError:
+            # The version was replaced (and removed) between resolving the
+            # symlink and opening its files; the new one is complete
+            version_dir = published_version_dir(path)
+            load_vector_db(db, path)
+        return version_dir, VectorDBSnapshot(db)
+
+    def _install(
+        self, kb_id: str, version_dir: str, snapshot: VectorDBSnapshot
+    ) -> VectorDBSnapshot:
+        self._replace(kb_id, snapshot)
+        self._seen_versions[kb_id] = version_dir
+        self._checked_at[kb_id] = self._last_used[kb_id] = time.monotonic()
+        logger.info("Loaded knowledge base %s version %s", kb_id, snapshot.get("version"))
+        return snapshot
+
+    def _reload_due(self, kb_id: str) -> bool:
+        return time.monotonic() - self._checked_at.get(kb_id, 0.0) >= self.reload_interval
+
+    def _newer_version_stored(self, kb_id: str) -> bool:
+        if not self._reload_due(kb_id):
+            return False
+        self._checked_at[kb_id] = time.monotonic()
+        version_dir = published_version_dir(self.path(kb_id))
+        return version_dir is not None and version_dir != self._seen_versions.get(kb_id)
+
+    def _is_persisted(self, kb_id) -> bool:
+        db = self._dbs[kb_id]
+        return (
+            db.get("status") == "completed"
+            and db.get("version") is not None
+            and stored_version(self.path(kb_id)) == db["version"]
+        )
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> KnowledgeBaseRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = KnowledgeBaseRegistry()
+    return _registry
+
+
+def _open_db(kb_id: str):
+    try:
+        db = get_registry().get(kb_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    logger.debug("Opening db connection %s %d", kb_id, id(db))
+    return db
+
+
+def get_db(kb_id: str = constants.DEFAULT_KB_ID) -> Generator:
     try:
-        db = VectorDB()
-        print("Opening db connection " + str(id(db)))
+        db = _open_db(kb_id)
         yield db
     finally:
-        print("Closing db connection " + str(id(db)))
\ No newline at end of file
+        logger.debug("Closing db connection %s", kb_id)
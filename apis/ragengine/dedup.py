@@ -0,0 +1,72 @@
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+
+from configs import constants
+from .lexical import tokenize
+
+SIMHASH_BITS = 64
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+@lru_cache(maxsize=1 << 16)
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def simhash(text: str, min_tokens: int = constants.SIMHASH_MIN_TOKENS):
+    """
+    64-bit SimHash fingerprint of `text` over its words and word pairs.
+
+    Returns None for texts shorter than `min_tokens`, whose fingerprints are
+    too unstable to compare; those are only deduplicated exactly.
+    """
+    tokens = tokenize(text)
+    if len(tokens) < min_tokens:
+        return None
+
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    hashes = np.fromiter(
+        (_feature_hash(feature) for feature in features), dtype=np.uint64, count=len(features)
+    )
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(features)
+    return int(np.packbits(votes > 0, bitorder="little").view(np.uint64)[0])
+
+
+class SimHashIndex:
+    """
+    Finds fingerprints within `max_distance` bits of a query fingerprint.
+
+    Fingerprints are split into `max_distance + 1` blocks; by the pigeonhole
+    principle two fingerprints that close agree exactly on at least one
+    block, so only fingerprints sharing a block are compared.
+    """
+
+    def __init__(self, max_distance: int = constants.SIMHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._blocks = max_distance + 1
+        self._width = -(-SIMHASH_BITS // self._blocks)
+        self._tables = [{} for _ in range(self._blocks)]
+
+    def _keys(self, fingerprint: int):
+        mask = (1 << self._width) - 1
+        return [(fingerprint >> (block * self._width)) & mask for block in range(self._blocks)]
+
+    def add(self, fingerprint: int, value):
+        for table, key in zip(self._tables, self._keys(fingerprint)):
+            table.setdefault(key, []).append((fingerprint, value))
+
+    def find(self, fingerprint: int):
+        """Value of the first added fingerprint close enough, or None"""
+        for table, key in zip(self._tables, self._keys(fingerprint)):
+            for candidate, value in table.get(key, ()):
+                if (candidate ^ fingerprint).bit_count() <= self.max_distance:
+                    return value
+        return None
@@ -0,0 +1,159 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from configs import constants
+
+QUERY_PRIORITY = 0
+INGEST_PRIORITY = 1
+_STOP_PRIORITY = -1
+
+
+class _Job:
+    """One `embed` call: its texts, pending chunks and result future"""
+
+    def __init__(self, texts, use_multi_process: bool):
+        self.texts = texts
+        self.use_multi_process = use_multi_process
+        self.future = Future()
+        self.results = None
+        self.pending = 0
+
+
+class EmbeddingService:
+    """
+    Long-lived embedding worker shared by queries and ingestion.
+
+    A single thread owns the model (and its multi-process pool, through
+    `encode_fn`) for the lifetime of the process. Work is pulled from a
+    priority queue:
+
+    - query jobs are coalesced into micro-batches of up to `max_batch_size`
+      texts, waiting at most `max_wait` seconds for company;
+    - ingest jobs are split into chunks of `ingest_chunk_size` texts, so a
+      waiting query only ever sits behind one ingest chunk.
+
+    Args:
+        encode_fn (callable): `encode_fn(texts, use_multi_process)` returning
+            an array of normalized embeddings
+        max_batch_size (int): Maximum texts per query micro-batch
+        max_wait (float): Seconds a query waits for other queries to batch with
+        ingest_chunk_size (int): Texts per ingest work item
+    """
+
+    def __init__(
+        self,
+        encode_fn,
+        max_batch_size: int = constants.EMBEDDING_MAX_BATCH_SIZE,
+        max_wait: float = constants.EMBEDDING_MAX_WAIT,
+        ingest_chunk_size: int = constants.EMBEDDING_INGEST_CHUNK_SIZE,
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.ingest_chunk_size = ingest_chunk_size
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def embed(
+        self, texts, priority: int = QUERY_PRIORITY, use_multi_process: bool = False
+    ) -> Future:
+        """
+        Queue `texts` for embedding.
+
+        Returns:
+            Future: Resolves to an array with one embedding per text
+        """
+        self._ensure_started()
+        job = _Job(list(texts), use_multi_process)
+        if not job.texts:
+            job.future.set_result(np.zeros((0, 0), dtype=np.float32))
+            return job.future
+
+        chunk_size = self.max_batch_size if priority == QUERY_PRIORITY else self.ingest_chunk_size
+        starts = range(0, len(job.texts), chunk_size)
+        job.pending = len(starts)
+        for start in starts:
+            self._queue.put(
+                (priority, next(self._sequence), job, start, start + chunk_size)
+            )
+        return job.future
+
+    def close(self):
+        """Stop the worker thread; queued jobs are cancelled"""
+        if self._thread is not None:
+            self._queue.put((_STOP_PRIORITY, next(self._sequence), None, 0, 0))
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="embedding-service", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            priority, _, job, start, stop = item
+            if priority == _STOP_PRIORITY:
+                break
+
+            items = [item]
+            if priority == QUERY_PRIORITY:
+                items = self._gather_queries(item)
+
+            texts = [text for _, _, job, start, stop in items for text in job.texts[start:stop]]
+            try:
+                embeddings = self.encode_fn(texts, items[0][2].use_multi_process)
+            except Exception as e:
+                for _, _, job, _, _ in items:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            offset = 0
+            for _, _, job, start, stop in items:
+                size = len(job.texts[start:stop])
+                if job.results is None:
+                    job.results = np.empty(
+                        (len(job.texts), embeddings.shape[1]), dtype=np.float32
+                    )
+                job.results[start : start + size] = embeddings[offset : offset + size]
+                offset += size
+                job.pending -= 1
+                if job.pending == 0 and not job.future.done():
+                    job.future.set_result(job.results)
+
+        while not self._queue.empty():
+            _, _, job, _, _ = self._queue.get()
+            if job is not None:
+                job.future.cancel()
+
+    def _gather_queries(self, first):
+        """Collect queued query chunks into one micro-batch"""
+        items, size = [first], len(first[2].texts[first[3] : first[4]])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item[0] != QUERY_PRIORITY:
+                self._queue.put(item)
+                break
+            items.append(item)
+            size += len(item[2].texts[item[3] : item[4]])
+        return items
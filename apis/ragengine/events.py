@@ -0,0 +1,28 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def format_event(data, event: str = None) -> str:
+    """Encode `data` as a single Server-Sent Event frame"""
+    frame = f"event: {event}\n" if event else ""
+    return f"{frame}data: {json.dumps(data)}\n\n"
+
+
+async def server_sent_events(fragments):
+    """
+    Wrap an async iterator of answer fragments into an SSE stream.
+
+    Every fragment is sent as a `message` event holding `{"text": ...}`; the
+    stream ends with a `done` event, or an `error` event if generation failed
+    after the response already started.
+    """
+    try:
+        async for fragment in fragments:
+            yield format_event({"text": fragment})
+    except Exception as e:
+        logger.exception("Error streaming response")
+        yield format_event({"detail": str(e)}, event="error")
+        return
+    yield format_event({}, event="done")
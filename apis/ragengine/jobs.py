@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from configs import constants
+from .db import get_registry
+from .pipeline import IngestionCancelled, IngestionProgress
+from .utils import create_knowledge_base_from_sitemap
+
+logger = logging.getLogger(__name__)
+
+
+class JobAlreadyRunning(Exception):
+    pass
+
+
+class IngestionJob:
+    """
+    One ingestion of a sitemap into a knowledge base. Its state goes from
+    "queued" to "running" and ends as "completed", "failed" or "cancelled".
+
+    Args:
+        kb_id (str): Knowledge base the result is published to
+        sitemap_url (str): Sitemap to crawl
+        store (bool): Persist the knowledge base once the ingestion succeeded
+        options (dict): Extra arguments of `create_knowledge_base_from_sitemap`
+    """
+
+    def __init__(self, kb_id: str, sitemap_url: str, store: bool = False, options: dict = None):
+        self.id = uuid.uuid4().hex
+        self.kb_id = kb_id
+        self.sitemap_url = sitemap_url
+        self.store = store
+        self.options = options or {}
+        self.state = "queued"
+        self.error = None
+        self.stored_in = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = IngestionProgress()
+        self.cancel_event = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("completed", "failed", "cancelled")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kb_id": self.kb_id,
+            "sitemap_url": self.sitemap_url,
+            "state": self.state,
+            "error": self.error,
+            "store": self.store,
+            "stored_in": self.stored_in,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress.snapshot() if self.started_at else None,
+        }
+
+
+class JobScheduler:
+    """
+    Runs ingestion jobs in the background, at most `max_concurrent_jobs` at a
+    time; the others wait in submission order.
+
+    A job builds a new vector DB next to the live one, which keeps serving
+    queries, and publishes it to the registry only when it completes; only
+    then is it persisted. One job per knowledge base can be queued or running.
+
+    Args:
+        brain (Brain): Brain used to embed the chunks
+        registry (KnowledgeBaseRegistry, optional): Defaults to `get_registry()`
+        max_concurrent_jobs (int): Jobs running at once
+        max_finished_jobs (int): Finished jobs remembered for status queries
+    """
+
+    def __init__(
+        self,
+        brain,
+        registry=None,
+        max_concurrent_jobs: int = constants.MAX_CONCURRENT_INGESTS,
+        max_finished_jobs: int = constants.MAX_FINISHED_JOBS,
+    ):
+        self.brain = brain
+        self.registry = registry
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_jobs, thread_name_prefix="ingest"
+        )
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kb_id: str, sitemap_url: str, store: bool = False, **options) -> IngestionJob:
+        registry = self.registry or get_registry()
+        registry.path(kb_id)
+        with self._lock:
+            active = self._active_job(kb_id)
+            if active is not None:
+                raise JobAlreadyRunning(
+                    f"Knowledge base {kb_id} is already being ingested by job {active.id}"
+                )
+            job = IngestionJob(kb_id, sitemap_url, store, options)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> IngestionJob:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kb_id: str = None) -> list[IngestionJob]:
+        with self._lock:
+            return [job for job in self._jobs.values() if kb_id is None or job.kb_id == kb_id]
+
+    def active_job(self, kb_id: str) -> IngestionJob:
+        with self._lock:
+            return self._active_job(kb_id)
+
+    def cancel(self, job_id: str) -> IngestionJob:
+        """Ask a job to stop; a queued job is cancelled before it starts"""
+        job = self.get(job_id)
+        if job is not None and not job.done:
+            job.cancel_event.set()
+        return job
+
+    def shutdown(self):
+        """Cancel every unfinished job and wait for the running ones to stop"""
+        for job in self.list():
+            if not job.done:
+                job.cancel_event.set()
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job: IngestionJob):
+        if job.cancel_event.is_set():
+            job.state = "cancelled"
+            job.finished_at = time.time()
+            return
+
+        registry = self.registry or get_registry()
+        job.state = "running"
+        job.started_at = time.time()
+        job.progress = IngestionProgress()
+        try:
+            # Built on a copy: the published vector DB keeps serving meanwhile
+            db = dict(registry.get(job.kb_id))
+            create_knowledge_base_from_sitemap(
+                self.brain,
+                job.sitemap_url,
+                db,
+                progress=job.progress,
+                cancel=job.cancel_event,
+                **job.options,
+            )
+            registry.publish(job.kb_id, db)
+            if job.store:
+                job.stored_in = registry.store(job.kb_id)
+            job.state = "completed"
+        except IngestionCancelled:
+            job.state = "cancelled"
+            logger.info("Cancelled ingestion job %s", job.id)
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+            logger.exception("Ingestion job %s failed", job.id)
+        finally:
+            job.finished_at = time.time()
+
+    def _active_job(self, kb_id: str) -> IngestionJob:
+        for job in self._jobs.values():
+            if job.kb_id == kb_id and not job.done:
+                return job
+        return None
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[: max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job_id]
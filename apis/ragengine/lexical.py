@@ -0,0 +1,126 @@
+import bisect
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+# Words, plus compound tokens such as product codes ("SKU-1234") and error
+# names ("ERR_CONN.RESET") kept whole
+TOKEN_PATTERN = re.compile(r"\w+(?:[-_.:/]\w+)*")
+SPLIT_PATTERN = re.compile(r"[-_.:/]")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased tokens; compound tokens are also emitted part by part"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = SPLIT_PATTERN.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index over chunk texts with BM25 scoring.
+
+    Postings are stored CSR style: the chunk rows containing term `t` are
+    `rows[offsets[t]:offsets[t+1]]`, with their term frequencies in `tfs`.
+    The vocabulary is sorted and query terms are found by binary search, so
+    a memory-mapped one is used as is, without building a lookup table.
+
+    Args:
+        terms (Sequence): Sorted vocabulary, the position of a term is its id
+        offsets (np.ndarray): Start of every term's postings, plus the end
+        rows (np.ndarray): Chunk rows of all postings
+        tfs (np.ndarray): Term frequency of every posting
+        doc_lengths (np.ndarray): Number of tokens of every chunk
+        k1 (float): BM25 term frequency saturation
+        b (float): BM25 length normalization
+    """
+
+    def __init__(self, terms, offsets, rows, tfs, doc_lengths, k1: float = 1.2, b: float = 0.75):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self._avg_length = float(np.mean(doc_lengths)) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, texts, k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        """Index `texts`, one chunk per row"""
+        term_ids = {}
+        posting_terms, posting_rows, posting_tfs = [], [], []
+        doc_lengths = []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+                posting_rows.append(row)
+                posting_tfs.append(tf)
+
+        terms = sorted(term_ids)
+        ranks = np.empty(len(terms), dtype=np.int64)
+        ranks[[term_ids[term] for term in terms]] = np.arange(len(terms))
+        posting_terms = ranks[np.asarray(posting_terms, dtype=np.int64)]
+        order = np.argsort(posting_terms, kind="stable")
+        offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms, minlength=len(term_ids)), out=offsets[1:])
+        return cls(
+            terms=terms,
+            offsets=offsets,
+            rows=np.asarray(posting_rows, dtype=np.int32)[order],
+            tfs=np.minimum(np.asarray(posting_tfs, dtype=np.int64), 65535).astype(np.uint16)[order],
+            doc_lengths=np.asarray(doc_lengths, dtype=np.int32),
+            k1=k1,
+            b=b,
+        )
+
+    def term_id(self, term: str):
+        """Id of `term`, or None when it is not in the vocabulary"""
+        term_id = bisect.bisect_left(self.terms, term)
+        if term_id < len(self.terms) and self.terms[term_id] == term:
+            return term_id
+        return None
+
+    def search(self, query: str, limit: int = None):
+        """
+        Score every chunk that shares a term with `query`.
+
+        Returns:
+            tuple: (rows, scores) ordered by descending score, at most `limit`
+        """
+        num_docs = len(self.doc_lengths)
+        query_terms = [
+            term_id for term_id in map(self.term_id, set(tokenize(query))) if term_id is not None
+        ]
+        if not query_terms or not num_docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        rows, contributions = [], []
+        for term_id in query_terms:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            term_rows = np.asarray(self.rows[start:end])
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+            df = end - start
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (
+                1 - self.b + self.b * self.doc_lengths[term_rows] / max(self._avg_length, 1e-9)
+            )
+            rows.append(term_rows)
+            contributions.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+        unique_rows, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float32)
+
+        if limit is not None and len(scores) > limit:
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            unique_rows, scores = unique_rows[best], scores[best]
+        order = np.lexsort((unique_rows, -scores))
+        return unique_rows[order].astype(np.int64), scores[order]
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+
+from configs import constants
+from .context_formatters import estimate_tokens
+
+
+class LLMProvider(ABC):
+    """
+    Text generation backend used by `Brain`.
+
+    Providers implement `generate` and `stream`; the async variants default
+    to running those in a worker thread and can be overridden with a native
+    async client.
+    """
+
+    @abstractmethod
+    def generate(self, prompt: str) -> str:
+        """Return the whole answer to `prompt`"""
+
+    def stream(self, prompt: str):
+        """Yield the answer in text fragments as they are generated"""
+        yield self.generate(prompt)
+
+    async def agenerate(self, prompt: str) -> str:
+        return await asyncio.to_thread(self.generate, prompt)
+
+    async def astream(self, prompt: str):
+        iterator = iter(self.stream(prompt))
+        while True:
+            fragment = await asyncio.to_thread(next, iterator, None)
+            if fragment is None:
+                return
+            yield fragment
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Google Gemini through `google-generativeai`.
+
+    The model client is created once and shared by every request; the async
+    methods use the library's native async calls, so waiting on Gemini never
+    holds a worker thread.
+    """
+
+    def __init__(self, model_name: str = constants.LLM_MODEL, api_key: str = constants.GEMINI_API_KEY):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str) -> str:
+        response = self.model.generate_content(prompt)
+        if response.error:
+            raise Exception(response.error)
+        return response.text
+
+    def stream(self, prompt: str):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            yield chunk.text
+
+    async def agenerate(self, prompt: str) -> str:
+        response = await self.model.generate_content_async(prompt)
+        if response.error:
+            raise Exception(response.error)
+        return response.text
+
+    async def astream(self, prompt: str):
+        async for chunk in await self.model.generate_content_async(prompt, stream=True):
+            yield chunk.text
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Offline provider with a configurable latency profile.
+
+    The answer is `answer` if given, otherwise a short echo of the question,
+    emitted word by word after `first_token_latency` seconds (plus
+    `seconds_per_prompt_token` for every prompt token, modelling prefill)
+    and then every `token_interval` seconds.
+
+    Args:
+        answer (str, optional): Fixed answer for every prompt
+        first_token_latency (float): Seconds before the first fragment
+        token_interval (float): Seconds between fragments
+        seconds_per_prompt_token (float): Extra first-fragment delay per prompt token
+    """
+
+    def __init__(
+        self,
+        answer: str = None,
+        first_token_latency: float = 0.2,
+        token_interval: float = 0.02,
+        seconds_per_prompt_token: float = 0.0,
+    ):
+        self.answer = answer
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.seconds_per_prompt_token = seconds_per_prompt_token
+
+    def _fragments(self, prompt: str) -> list[str]:
+        answer = self.answer
+        if answer is None:
+            question = prompt.rsplit("Question:", 1)[-1].strip()
+            answer = f"This is a generated answer to: {question}"
+        words = answer.split(" ")
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def _delays(self, prompt, fragments):
+        first = self.first_token_latency + self.seconds_per_prompt_token * estimate_tokens(prompt)
+        return [first] + [self.token_interval] * (len(fragments) - 1)
+
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt))
+
+    def stream(self, prompt: str):
+        fragments = self._fragments(prompt)
+        for delay, fragment in zip(self._delays(prompt, fragments), fragments):
+            time.sleep(delay)
+            yield fragment
+
+    async def agenerate(self, prompt: str) -> str:
+        return "".join([fragment async for fragment in self.astream(prompt)])
+
+    async def astream(self, prompt: str):
+        fragments = self._fragments(prompt)
+        for delay, fragment in zip(self._delays(prompt, fragments), fragments):
+            await asyncio.sleep(delay)
+            yield fragment
+
+
+LLM_PROVIDERS = {"gemini": GeminiProvider, "fake": FakeLLMProvider}
+
+
+def get_llm_provider(name: str = constants.LLM_PROVIDER, **options) -> LLMProvider:
+    if name not in LLM_PROVIDERS:
+        raise ValueError(f"Unknown LLM provider {name!r}, expected one of {tuple(LLM_PROVIDERS)}")
+    return LLM_PROVIDERS[name](**options)
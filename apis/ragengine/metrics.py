@@ -0,0 +1,171 @@
+import contextvars
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Seconds; from sub-millisecond lookups to minute long sitemap fetches
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+REGISTRY = []
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric(ABC):
+    """
+    A named metric with optional labels, registered in `REGISTRY` and
+    rendered in the Prometheus text exposition format.
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = {key: self._copy(value) for key, value in self._values.items()}
+        for key, value in sorted(values.items()):
+            lines.extend(self._samples(dict(zip(self.labelnames, key)), value))
+        return lines
+
+    def _copy(self, value):
+        return value
+
+    @abstractmethod
+    def _samples(self, labels, value) -> list[str]:
+        """Exposition lines of one label set"""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, labels, value):
+        return [f"{self.name}{_format_labels(labels)} {value}"]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    def _samples(self, labels, value):
+        bucket_counts, total, count = value
+        samples, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            samples.append(
+                f"{self.name}_bucket{_format_labels({**labels, 'le': repr(float(bound))})} {cumulative}"
+            )
+        samples.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+        samples.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+        samples.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return samples
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text format"""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each ingestion and query stage.",
+    ("stage",),
+)
+STAGE_ITEMS = Counter(
+    "rag_stage_items_total",
+    "Items (pages, texts, queries) processed by each stage.",
+    ("stage",),
+)
+STAGE_ERRORS = Counter(
+    "rag_stage_errors_total",
+    "Failures in each stage.",
+    ("stage",),
+)
+
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+@contextmanager
+def timed(stage: str, items: int = 1):
+    """
+    Record the duration of the block in `STAGE_SECONDS` and, when the block
+    succeeds, `items` in `STAGE_ITEMS`. Durations are also added to the
+    breakdown of the current `collect_timings` block, if any.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    else:
+        STAGE_ITEMS.inc(items, stage=stage)
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collect the stage durations of this request into the yielded dict.
+
+    The dict is shared with worker threads started through
+    `asyncio.to_thread`, which copy the context.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
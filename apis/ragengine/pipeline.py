@@ -0,0 +1,606 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import islice
+
+import numpy as np
+
+from configs import constants
+from .archive import HtmlArchive
+from .context_formatters import chunk_metadata, format_for_embeddings, format_for_llm
+from .crawler import AsyncCrawler, iter_sitemap_entries_async
+from .dedup import SimHashIndex, normalize_text, simhash
+from .metrics import timed
+from .quantization import dequantize_embeddings
+from .scrape import is_unchanged, iter_sitemap_entries, normalize_url, parse_page, scrape_page
+from .store import ChunkStoreBuilder
+
+_DONE = object()
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionCancelled(Exception):
+    pass
+
+
+class IngestionProgress:
+    """
+    Per-stage counters of an ingestion, updated by the pipeline threads.
+
+    - discovered: URLs found in the sitemap
+    - fetched / parsed / chunked: pages through each stage
+    - embedded: chunk texts sent to the embedding model
+    - pages / chunks: pages and chunks added to the knowledge base
+    """
+
+    STAGES = ("discovered", "fetched", "parsed", "chunked", "embedded", "pages", "chunks")
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self._counts = dict.fromkeys(self.STAGES, 0)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, count: int = 1):
+        with self._lock:
+            self._counts[stage] += count
+
+    def snapshot(self) -> dict:
+        """Counts plus throughput and the estimated seconds left"""
+        with self._lock:
+            counts = dict(self._counts)
+        elapsed = time.monotonic() - self.started_at
+        pages_per_second = counts["pages"] / elapsed if elapsed > 0 else 0.0
+        eta_seconds = None
+        if counts["discovered"] and pages_per_second:
+            eta_seconds = max(counts["discovered"] - counts["pages"], 0) / pages_per_second
+        return {
+            **counts,
+            "elapsed_seconds": round(elapsed, 3),
+            "pages_per_second": round(pages_per_second, 3),
+            "eta_seconds": None if eta_seconds is None else round(eta_seconds, 1),
+        }
+
+
+def chunk_hash(text: str) -> int:
+    """64-bit content hash used to reuse chunk embeddings across crawls"""
+    return int.from_bytes(
+        hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def previous_crawl(brain, sitemap_url: str, db) -> dict:
+    """
+    Collect what the previous crawl of the same sitemap can contribute:
+    validators per URL, page text and chunk rows per URL, the vector row of
+    every chunk and a lookup from chunk hash to its vector row. Nothing is
+    reused across embedding models, and unchanged pages are only skipped when
+    their chunk texts were kept.
+    """
+    previous = {
+        "db": db,
+        "crawl_state": {},
+        "pages": {},
+        "hash_vectors": {},
+        "chunk_vectors": None,
+    }
+    if (
+        db.get("url") != sitemap_url
+        or db.get("chunk_hashes") is None
+        or db.get("embedding") is None
+        or db.get("embedding_model") != brain.embedding_model_name
+    ):
+        return previous
+
+    # Knowledge bases ingested before deduplication have one vector per chunk
+    chunk_vectors = db.get("chunk_vectors")
+    if chunk_vectors is None:
+        chunk_vectors = np.arange(len(db["chunk_hashes"]))
+    previous["chunk_vectors"] = np.asarray(chunk_vectors)
+    previous["hash_vectors"] = dict(
+        zip(np.asarray(db["chunk_hashes"]).tolist(), previous["chunk_vectors"].tolist())
+    )
+    if db.get("chunks") is None:
+        return previous
+
+    page_urls = db.get("page_urls", [])
+    if len(page_urls) != len(db["data"]):
+        # Pages without chunks used to overwrite each other's keys, so the
+        # urls no longer line up with the pages: fetch and chunk them again
+        return previous
+    # Discovered urls are normalized; match those stored before they were
+    previous["crawl_state"] = {
+        normalize_url(url): crawl for url, crawl in (db.get("crawl_state") or {}).items()
+    }
+
+    row = 0
+    for url, (key, llm_context) in zip(page_urls, db["data"].items()):
+        start, end = key.split("-")
+        size = int(end) - int(start)
+        previous["pages"][normalize_url(url)] = (llm_context, slice(row, row + size))
+        row += size
+    return previous
+
+
+def _parse_archived(archive_root: str, digests: list[str]) -> list[dict]:
+    """Read and parse archived bodies; runs in the rebuild worker processes"""
+    archive, pages = HtmlArchive(archive_root), []
+    for digest in digests:
+        try:
+            pages.append(parse_page(archive.get(digest)))
+        except Exception as e:
+            logger.warning("Error extracting archived page %s: %s", digest, e)
+            pages.append({})
+    return pages
+
+
+class EmbeddingBuffer:
+    """
+    Float32 embedding matrix that grows as pages are appended.
+
+    Rows are reserved per page up front and filled in whenever their vectors
+    are available, so reused rows and freshly embedded batches can arrive in
+    any order.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self._capacity = capacity
+        self._array = None
+
+    def reserve(self, num_rows: int) -> int:
+        start = self.size
+        self.size += num_rows
+        return start
+
+    def read(self, rows) -> np.ndarray:
+        return self._array[rows]
+
+    def write(self, rows, values):
+        values = np.asarray(values, dtype=np.float32)
+        if self._array is None:
+            self._array = np.empty(
+                (max(self._capacity, self.size), values.shape[1]), dtype=np.float32
+            )
+        self._grow()
+        self._array[rows] = values
+
+    def to_array(self, dim: int = 0) -> np.ndarray:
+        if self._array is None:
+            return np.zeros((self.size, dim), dtype=np.float32)
+        self._grow()
+        self._array.resize((self.size, self._array.shape[1]), refcheck=False)
+        return self._array
+
+    def _grow(self):
+        if len(self._array) >= self.size:
+            return
+        grown = np.empty(
+            (max(self.size, 2 * len(self._array)), self._array.shape[1]),
+            dtype=np.float32,
+        )
+        grown[: len(self._array)] = self._array
+        self._array = grown
+
+
+class IngestionPipeline:
+    """
+    Streaming fetch -> extract -> chunk -> embed pipeline.
+
+    Stages run concurrently and hand pages to each other through bounded
+    queues, so only a few pages per stage are held in memory and the embedder
+    works while the crawl is still going.
+
+    Chunks repeated within a page are dropped. Across the crawl, chunks whose
+    text was already seen, exactly or (with `near_duplicates`) within a few
+    SimHash bits, are mapped to the vector of the first one, so the embedding
+    matrix only holds distinct vectors. New texts are embedded in batches of
+    `embed_batch_size` and written straight into it; unchanged pages and
+    known chunk hashes reuse the previous vectors.
+
+    Every stage reports to `progress`. Setting `cancel` stops all stages and
+    makes `run` raise `IngestionCancelled`.
+
+    With an `archive`, fetched bodies are stored in it and their digest is
+    kept in the crawl state; a completed run saves the archive manifest of
+    the sitemap. With `rebuild`, pages are read from that manifest instead
+    of being fetched, and parsed by `rebuild_workers` processes.
+    """
+
+    def __init__(
+        self,
+        brain,
+        previous: dict,
+        queue_size: int = constants.PIPELINE_QUEUE_SIZE,
+        extract_workers: int = constants.PIPELINE_EXTRACT_WORKERS,
+        embed_batch_size: int = constants.PIPELINE_EMBED_BATCH_SIZE,
+        use_async_crawler: bool = constants.USE_ASYNC_CRAWLER,
+        fetch_workers: int = constants.PIPELINE_FETCH_WORKERS,
+        near_duplicates: bool = constants.DEDUP_NEAR_DUPLICATES,
+        progress: IngestionProgress = None,
+        cancel: threading.Event = None,
+        archive: HtmlArchive = None,
+        rebuild: bool = False,
+        rebuild_workers: int = constants.REBUILD_WORKERS,
+    ):
+        if rebuild and archive is None:
+            raise ValueError("Rebuilding requires an archive")
+        self.brain = brain
+        self.previous = previous
+        self.queue_size = queue_size
+        self.extract_workers = extract_workers
+        self.embed_batch_size = embed_batch_size
+        self.use_async_crawler = use_async_crawler
+        self.fetch_workers = fetch_workers
+        self.near_duplicates = near_duplicates
+        self.progress = progress or IngestionProgress()
+        self.cancel = cancel or threading.Event()
+        self.archive = archive
+        self.rebuild = rebuild
+        self.rebuild_workers = rebuild_workers
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self, sitemap_url: str) -> dict:
+        """
+        Crawl and embed the site.
+
+        Returns:
+            dict: "data", "page_urls", "crawl_state", "chunk_hashes",
+                "chunks" (a `ChunkStore`), "chunk_vectors" (the
+                embedding row of every chunk), the float32 "embedding" matrix
+                of distinct vectors and "ingest_stats"
+        """
+        fetched = queue.Queue(self.queue_size)
+        extracted = queue.Queue(self.queue_size)
+        chunked = queue.Queue(self.queue_size)
+
+        read = self._read_archive if self.rebuild else self._fetch
+        stages = [threading.Thread(target=self._guard, args=(read, sitemap_url, fetched))]
+        stages += [
+            threading.Thread(target=self._guard, args=(self._extract, fetched, extracted))
+            for _ in range(self.extract_workers)
+        ]
+        stages.append(
+            threading.Thread(target=self._guard, args=(self._chunk, extracted, chunked))
+        )
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+
+        try:
+            result = self._embed(chunked)
+        finally:
+            self._stop.set()
+            for stage in stages:
+                stage.join()
+
+        if self.cancel.is_set():
+            raise IngestionCancelled()
+        if self._errors:
+            raise self._errors[0]
+        if self.archive is not None and not self.rebuild:
+            crawl_state = result["crawl_state"]
+            self.archive.save_manifest(
+                sitemap_url,
+                {url: crawl for url, crawl in crawl_state.items() if "digest" in crawl},
+            )
+        return result
+
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except Exception as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    def _stopped(self) -> bool:
+        if self.cancel.is_set():
+            self._stop.set()
+        return self._stop.is_set()
+
+    def _put(self, out, item):
+        while not self._stopped():
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, source):
+        while not self._stopped():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fetch(self, sitemap_url, out):
+        # Pages are fetched as the sitemap is read, without waiting for all of it
+        crawl_state = self.previous["crawl_state"]
+
+        if self.use_async_crawler:
+
+            async def discovered():
+                async for entry in iter_sitemap_entries_async(sitemap_url, self._stopped):
+                    self.progress.add("discovered")
+                    yield entry
+
+            async def crawl():
+                async for url, page in AsyncCrawler().crawl(discovered(), crawl_state, parse=False):
+                    self.progress.add("fetched")
+                    await asyncio.to_thread(self._put, out, (url, page))
+                    if self._stopped():
+                        break
+
+            asyncio.run(crawl())
+        else:
+            # Every worker hands its page to extraction itself, so pages flow on
+            # while discovery continues; at most `window` are in flight
+            window = self.fetch_workers * 4
+            slots = threading.BoundedSemaphore(window)
+            with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+                entries = iter_sitemap_entries(sitemap_url, stopped=self._stopped)
+                for entry in entries:
+                    self.progress.add("discovered")
+                    previous = crawl_state.get(entry["url"])
+                    if is_unchanged(entry, previous):
+                        self.progress.add("fetched")
+                        self._put(out, (entry["url"], {"crawl": {**previous, "not_modified": True}}))
+                        continue
+                    while not slots.acquire(timeout=0.1) and not self._stopped():
+                        pass
+                    if self._stopped():
+                        break
+                    executor.submit(self._guard, self._fetch_page, entry, previous, out, slots)
+                entries.close()
+                if self._stopped():
+                    executor.shutdown(cancel_futures=True)
+
+        logger.info("Found %d URLs in sitemap", self.progress.snapshot()["discovered"])
+        for _ in range(self.extract_workers):
+            self._put(out, _DONE)
+
+    def _fetch_page(self, entry, previous, out, slots):
+        try:
+            (url, page), = scrape_page(entry["url"], previous, False).items()
+            self.progress.add("fetched")
+            if "crawl" in page:
+                page["crawl"]["lastmod"] = entry["lastmod"]
+            self._put(out, (url, page))
+        finally:
+            slots.release()
+
+    def _read_archive(self, sitemap_url, out):
+        pages = self.archive.load_manifest(sitemap_url)
+        if not pages:
+            raise ValueError(f"No archived crawl of {sitemap_url}")
+        logger.info("Rebuilding %d archived pages of %s", len(pages), sitemap_url)
+        self.progress.add("discovered", len(pages))
+
+        workers = self.rebuild_workers or os.cpu_count()
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            # Pages go to the workers in batches, a bounded number at a time,
+            # so memory stays flat on large sites
+            items, pending = iter(pages.items()), deque()
+            while not self._stopped():
+                while len(pending) < 2 * workers and (batch := list(islice(items, 16))):
+                    digests = [crawl["digest"] for _, crawl in batch]
+                    pending.append((batch, executor.submit(_parse_archived, self.archive.root, digests)))
+                if not pending:
+                    break
+                batch, future = pending.popleft()
+                for (url, crawl), page in zip(batch, future.result()):
+                    page["crawl"] = dict(crawl)
+                    self.progress.add("fetched")
+                    self._put(out, (url, page))
+            if self._stopped():
+                executor.shutdown(cancel_futures=True)
+
+        for _ in range(self.extract_workers):
+            self._put(out, _DONE)
+
+    def _extract(self, source, out):
+        while (item := self._get(source)) is not _DONE:
+            url, page = item
+            if "html" in page:
+                html = page.pop("html")
+                crawl = page["crawl"]
+                if self.archive is not None:
+                    try:
+                        crawl["digest"] = self.archive.put(html)
+                    except OSError as e:
+                        logger.warning("Error archiving %s: %s", url, e)
+                try:
+                    page = parse_page(html)
+                except Exception as e:
+                    logger.warning("Error extracting %s: %s", url, e)
+                    page = {}
+                page["crawl"] = crawl
+            self.progress.add("parsed")
+            self._put(out, (url, page))
+        self._put(out, _DONE)
+
+    def _chunk(self, source, out):
+        pending_extractors = self.extract_workers
+        while pending_extractors:
+            item = self._get(source)
+            if item is _DONE:
+                if self._stop.is_set():
+                    return
+                pending_extractors -= 1
+                continue
+
+            url, page_data = item
+            crawl = page_data.pop("crawl", None)
+            not_modified = crawl and crawl.pop("not_modified", False)
+            if not_modified and url in self.previous["pages"]:
+                llm_context, rows = self.previous["pages"][url]
+                record = (url, crawl, llm_context, None, None, rows, 0)
+            else:
+                with timed("chunk"):
+                    llm_context = format_for_llm(page_data)
+                    texts, metadata, seen, dropped = [], [], set(), 0
+                    for chunk in format_for_embeddings(page_data):
+                        key = normalize_text(chunk["text"])
+                        if key in seen:
+                            dropped += 1
+                            continue
+                        seen.add(key)
+                        texts.append(chunk["text"])
+                        metadata.append(chunk_metadata(chunk))
+                record = (url, crawl, llm_context, texts, metadata, None, dropped)
+            self.progress.add("chunked")
+            self._put(out, record)
+        self._put(out, _DONE)
+
+    def _embed(self, source) -> dict:
+        db = self.previous["db"]
+        hash_vectors = self.previous["hash_vectors"]
+        previous_vectors = self.previous["chunk_vectors"]
+        data, page_urls, crawl_state = OrderedDict(), [], {}
+        chunk_hashes, chunk_vectors = array("Q"), array("i")
+        chunks = ChunkStoreBuilder()
+        vectors = EmbeddingBuffer()
+        hash_vector, reused_vector = {}, {}
+        near_duplicates = SimHashIndex() if self.near_duplicates else None
+        batch = {}
+        stats = {
+            "pages": 0,
+            "reused_pages": 0,
+            "chunks": 0,
+            "repeated_in_page": 0,
+            "exact_duplicates": 0,
+            "near_duplicates": 0,
+            "embedded": 0,
+            "reused": 0,
+        }
+
+        def copy_previous(previous_rows) -> list:
+            """Copy previous vectors over once; returns their new rows"""
+            missing = [row for row in dict.fromkeys(previous_rows) if row not in reused_vector]
+            if missing:
+                start = vectors.reserve(len(missing))
+                targets = list(range(start, start + len(missing)))
+                if db.get("embedding_full") is not None:
+                    vectors.write(targets, db["embedding_full"][missing])
+                else:
+                    vectors.write(
+                        targets,
+                        dequantize_embeddings(db["embedding"], db.get("embedding_scale"), missing),
+                    )
+                reused_vector.update(zip(missing, targets))
+                stats["reused"] += len(missing)
+            return [reused_vector[row] for row in previous_rows]
+
+        def flush():
+            if not batch:
+                return
+            embeddings = self.brain.generate_embeddings(
+                documents=list(batch.values()), use_multi_process=True
+            )
+            vectors.write(list(batch), embeddings)
+            stats["embedded"] += len(batch)
+            self.progress.add("embedded", len(batch))
+            batch.clear()
+
+        def vector_for(text, h) -> int:
+            if h in hash_vector:
+                stats["exact_duplicates"] += 1
+                return hash_vector[h]
+
+            fingerprint = simhash(text) if near_duplicates is not None else None
+            if fingerprint is not None:
+                vector = near_duplicates.find(fingerprint)
+                if vector is not None:
+                    stats["near_duplicates"] += 1
+                    hash_vector[h] = vector
+                    return vector
+
+            if h in hash_vectors:
+                vector = copy_previous([hash_vectors[h]])[0]
+            else:
+                vector = vectors.reserve(1)
+                batch[vector] = text
+            hash_vector[h] = vector
+            if fingerprint is not None:
+                near_duplicates.add(fingerprint, vector)
+            return vector
+
+        last_idx = 0
+        while (record := self._get(source)) is not _DONE:
+            url, crawl, llm_context, texts, metadata, previous_rows, dropped = record
+
+            if previous_rows is not None:
+                hashes = np.asarray(db["chunk_hashes"][previous_rows]).tolist()
+                chunks.extend(db["chunks"], previous_rows)
+                rows = copy_previous(previous_vectors[previous_rows].tolist())
+                for h, vector in zip(hashes, rows):
+                    hash_vector.setdefault(h, vector)
+                stats["reused_pages"] += 1
+            else:
+                hashes = [chunk_hash(text) for text in texts]
+                rows = [vector_for(text, h) for text, h in zip(texts, hashes)]
+                for position, (text, chunk) in enumerate(zip(texts, metadata)):
+                    chunks.append(text, position=position, **chunk)
+                if len(batch) >= self.embed_batch_size:
+                    flush()
+
+            # A page without chunks has no rows to point at, and its empty
+            # range would share its key with the next page
+            if hashes:
+                data[f"{last_idx}-{last_idx+len(hashes)}"] = llm_context
+                last_idx += len(hashes)
+                page_urls.append(url)
+            chunk_hashes.extend(hashes)
+            chunk_vectors.extend(rows)
+            if crawl:
+                crawl_state[url] = crawl
+            stats["pages"] += 1
+            stats["chunks"] += len(hashes)
+            stats["repeated_in_page"] += dropped
+            self.progress.add("pages")
+            self.progress.add("chunks", len(hashes))
+
+        if self.cancel.is_set():
+            raise IngestionCancelled()
+        if self._stop.is_set() and self._errors:
+            raise self._errors[0]
+        flush()
+
+        stats["vectors"] = vectors.size
+        logger.info(
+            "Ingested %d pages (%d unchanged): %d chunks on %d vectors after dropping "
+            "%d repeated within a page and sharing %d exact and %d near duplicates; "
+            "embedded %d new, reused %d",
+            stats["pages"],
+            stats["reused_pages"],
+            stats["chunks"],
+            stats["vectors"],
+            stats["repeated_in_page"],
+            stats["exact_duplicates"],
+            stats["near_duplicates"],
+            stats["embedded"],
+            stats["reused"],
+            extra={"ingest_stats": stats},
+        )
+        dim = db["embedding"].shape[1] if db.get("embedding") is not None else 0
+        return {
+            "data": data,
+            "page_urls": page_urls,
+            "crawl_state": crawl_state,
+            "chunk_hashes": np.frombuffer(chunk_hashes, dtype=np.uint64).copy(),
+            "chunks": chunks.build(),
+            "chunk_vectors": np.frombuffer(chunk_vectors, dtype=np.int32).copy(),
+            "embedding": vectors.to_array(dim),
+            "ingest_stats": stats,
+        }
@@ -0,0 +1,97 @@
+import numpy as np
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize_embeddings(embeddings, embedding_dtype: str = "float32"):
+    """
+    Convert float32 embeddings into the compact storage representation.
+
+    Args:
+        embeddings (np.ndarray): Float32 embedding matrix
+        embedding_dtype (str): One of "float32", "float16" or "int8"
+
+    Returns:
+        tuple: (matrix, scale) where `scale` holds the per-dimension int8 scale
+            factors, or None for the float modes
+    """
+    if embedding_dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"Invalid embedding dtype: {embedding_dtype}")
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embedding_dtype == "float32":
+        return embeddings, None
+    if embedding_dtype == "float16":
+        return embeddings.astype(np.float16), None
+
+    scale = np.abs(embeddings).max(axis=0, initial=0.0) / 127.0
+    scale = np.where(scale == 0, 1.0, scale).astype(np.float32)
+    matrix = np.clip(np.rint(embeddings / scale), -127, 127).astype(np.int8)
+    return matrix, scale
+
+
+def dequantize_embeddings(matrix, scale=None, rows=None) -> np.ndarray:
+    """Return float32 embeddings for `rows` (all rows when None)."""
+    block = matrix if rows is None else matrix[rows]
+    block = np.asarray(block, dtype=np.float32)
+    if scale is not None:
+        block = block * scale
+    return block
+
+
+def score_embeddings(
+    query_embedding, matrix, scale=None, rows=None, block_size: int = 2048
+) -> np.ndarray:
+    """
+    Dot-product scores of a single query against (a subset of) the matrix.
+
+    Compact matrices are upcast one block at a time so scoring never
+    materialises a full float32 copy; for int8 the per-dimension scale is
+    folded into the query instead of the matrix.
+
+    Args:
+        query_embedding (np.ndarray): Query embedding, shape (dim,) or (1, dim)
+        matrix (np.ndarray): Stored embedding matrix
+        scale (np.ndarray, optional): Per-dimension int8 scale factors
+        rows (np.ndarray, optional): Subset of rows to score
+        block_size (int): Rows upcast at a time for compact matrices
+
+    Returns:
+        np.ndarray: Float32 scores, one per scored row
+    """
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+    return score_embeddings_batch(query, matrix, scale, rows, block_size)[0]
+
+
+def score_embeddings_batch(
+    query_embeddings, matrix, scale=None, rows=None, block_size: int = 2048
+) -> np.ndarray:
+    """
+    Dot-product scores of many queries against (a subset of) the matrix,
+    as one matrix product per block of rows.
+
+    Args:
+        query_embeddings (np.ndarray): Query embeddings, shape (queries, dim)
+        matrix (np.ndarray): Stored embedding matrix
+        scale (np.ndarray, optional): Per-dimension int8 scale factors
+        rows (np.ndarray, optional): Subset of rows to score
+        block_size (int): Rows upcast at a time for compact matrices
+
+    Returns:
+        np.ndarray: Float32 scores, shape (queries, scored rows)
+    """
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    if scale is not None:
+        queries = queries * scale
+
+    num_rows = len(matrix) if rows is None else len(rows)
+    if matrix.dtype == np.float32:
+        block = matrix if rows is None else matrix[rows]
+        return np.dot(queries, block.T)
+
+    scores = np.empty((len(queries), num_rows), dtype=np.float32)
+    for start in range(0, num_rows, block_size):
+        stop = start + block_size
+        block = matrix[start:stop] if rows is None else matrix[rows[start:stop]]
+        scores[:, start:stop] = np.dot(queries, block.astype(np.float32).T)
+    return scores
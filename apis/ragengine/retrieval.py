@@ -0,0 +1,385 @@
+import numpy as np
+
+from configs import constants
+from .quantization import score_embeddings, score_embeddings_batch
+
+RETRIEVAL_MODES = ("dense", "hybrid", "prefilter")
+
+
+def build_page_index(doc_keys, num_chunks: int) -> np.ndarray:
+    """
+    Build a lookup array mapping every chunk row to the position of its page.
+
+    Page keys are "start-end" ranges as written by
+    `create_knowledge_base_from_sitemap`, where `start` is the first chunk row
+    of the page.
+
+    Args:
+        doc_keys (iterable): Ordered "start-end" page keys
+        num_chunks (int): Number of chunk rows
+
+    Returns:
+        np.ndarray: Page position for every chunk row
+    """
+    starts = np.fromiter(
+        (int(key.split("-")[0]) for key in doc_keys), dtype=np.int64
+    )
+    if not len(starts):
+        return np.zeros(0, dtype=np.int32)
+
+    page_index = np.searchsorted(starts, np.arange(num_chunks), side="right") - 1
+    return page_index.astype(np.int32)
+
+
+def num_chunks(VECTOR_DB) -> int:
+    """Number of chunk rows; without `chunk_vectors` every chunk has its own embedding row"""
+    chunk_vectors = VECTOR_DB.get("chunk_vectors")
+    return len(VECTOR_DB["embedding"] if chunk_vectors is None else chunk_vectors)
+
+
+def top_k_pages(scores, page_index, k: int = 3, candidate_rows=None) -> np.ndarray:
+    """
+    Select the positions of the `k` best pages, ranked by their best chunk score.
+
+    Only the highest scoring chunks are partitioned out with `np.argpartition`;
+    the candidate pool is doubled until it covers `k` distinct pages.
+
+    Args:
+        scores (np.ndarray): Chunk scores
+        page_index (np.ndarray): Page position for every chunk row
+        k (int): Number of pages to return
+        candidate_rows (np.ndarray, optional): Chunk row of every score, when
+            `scores` only covers a subset of the chunks
+
+    Returns:
+        np.ndarray: Page positions ordered by descending score
+    """
+    scores = np.asarray(scores).ravel()
+    total = len(scores)
+    if not total or k <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    pool = min(total, max(4 * k, 32))
+    while True:
+        if pool < total:
+            candidates = np.argpartition(-scores, pool - 1)[:pool]
+        else:
+            candidates = np.arange(total)
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        rows = candidates if candidate_rows is None else candidate_rows[candidates]
+        pages = page_index[rows]
+        unique_pages, first_seen = np.unique(pages, return_index=True)
+
+        if len(unique_pages) >= k or pool == total:
+            return unique_pages[np.argsort(first_seen)][:k]
+        pool = min(total, pool * 2)
+
+
+def top_k_pages_batch(scores, page_index, k: int = 3) -> np.ndarray:
+    """
+    `top_k_pages` for every row of a (queries, chunks) score matrix.
+
+    A page scores its best chunk: the rows of a page are contiguous, so the
+    page maxima of all queries come from one `np.maximum.reduceat`.
+
+    Returns:
+        np.ndarray: Page positions, shape (queries, k), best first
+    """
+    scores = np.asarray(scores)
+    page_index = np.asarray(page_index)[: scores.shape[1]]
+    if not page_index.size or k <= 0:
+        return np.zeros((len(scores), 0), dtype=np.int64)
+
+    starts = np.flatnonzero(np.r_[True, page_index[1:] != page_index[:-1]])
+    pages = page_index[starts]
+    page_scores = np.maximum.reduceat(scores, starts, axis=1)
+    best = ranked_rows_batch(page_scores, k)
+    return pages[best]
+
+
+def ranked_rows_batch(scores, limit: int) -> np.ndarray:
+    """Column positions of the `limit` best scores of every row, best first"""
+    scores = np.asarray(scores)
+    limit = min(limit, scores.shape[1])
+    if limit < scores.shape[1]:
+        best = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+    else:
+        best = np.broadcast_to(np.arange(limit), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(best, order, axis=1)
+
+
+def score_chunks(
+    VECTOR_DB,
+    query_embedding,
+    nprobe: int = None,
+    rescore: bool = True,
+    rescore_candidates: int = constants.RESCORE_CANDIDATES,
+    candidate_rows=None,
+):
+    """
+    Score the query against the stored chunk embeddings.
+
+    Duplicate chunks share one embedding row through `chunk_vectors`; every
+    distinct vector is scored once (see `score_vectors`) and its score is
+    gathered back to the chunks that use it.
+
+    Args:
+        VECTOR_DB (dict): The knowledge base
+        query_embedding (np.ndarray): Normalized query embedding
+        nprobe (int, optional): ANN buckets to probe
+        rescore (bool): Whether to rescore the coarse candidates in float32
+        rescore_candidates (int): Number of coarse candidates to rescore
+        candidate_rows (np.ndarray, optional): Only score these chunk rows
+
+    Returns:
+        tuple: (scores, candidate_rows) where `candidate_rows` maps every score
+            to its chunk row, or is None when all chunks were scored
+    """
+    chunk_vectors = VECTOR_DB.get("chunk_vectors")
+    if chunk_vectors is None:
+        return score_vectors(
+            VECTOR_DB, query_embedding, nprobe, rescore, rescore_candidates, candidate_rows
+        )
+
+    chunk_vectors = np.asarray(chunk_vectors)
+    vector_rows = None
+    if candidate_rows is not None:
+        candidate_rows = np.asarray(candidate_rows)
+        vector_rows = np.unique(chunk_vectors[candidate_rows])
+    scores, vector_rows = score_vectors(
+        VECTOR_DB, query_embedding, nprobe, rescore, rescore_candidates, vector_rows
+    )
+    if vector_rows is None:
+        return scores[chunk_vectors], None
+
+    lookup = np.full(len(VECTOR_DB["embedding"]), -np.inf, dtype=np.float32)
+    lookup[vector_rows] = scores
+    if candidate_rows is None:
+        candidate_rows = np.flatnonzero(np.isfinite(lookup[chunk_vectors]))
+    else:
+        candidate_rows = candidate_rows[np.isfinite(lookup[chunk_vectors[candidate_rows]])]
+    return lookup[chunk_vectors[candidate_rows]], candidate_rows
+
+
+def score_vectors(
+    VECTOR_DB,
+    query_embedding,
+    nprobe: int = None,
+    rescore: bool = True,
+    rescore_candidates: int = constants.RESCORE_CANDIDATES,
+    vector_rows=None,
+):
+    """
+    Score the query against the rows of the embedding matrix.
+
+    Coarse scores come from the stored (possibly float16/int8) matrix,
+    restricted to `vector_rows` when given, or else to the ANN candidates
+    when the knowledge base has an index.
+    When a float32 copy was kept at ingest time, the best
+    `rescore_candidates` rows are rescored exactly against it.
+
+    Returns:
+        tuple: (scores, vector_rows) where `vector_rows` maps every score to
+            its embedding row, or is None when all rows were scored
+    """
+    matrix = VECTOR_DB["embedding"]
+    scale = VECTOR_DB.get("embedding_scale")
+    full_matrix = VECTOR_DB.get("embedding_full")
+    ann_index = VECTOR_DB.get("ann_index")
+
+    if vector_rows is None and ann_index is not None:
+        vector_rows = ann_index.search(query_embedding, nprobe)
+        if not len(vector_rows):
+            vector_rows = None
+
+    scores = score_embeddings(query_embedding, matrix, scale, vector_rows)
+
+    if rescore and full_matrix is not None:
+        if len(scores) > rescore_candidates:
+            best = np.argpartition(-scores, rescore_candidates - 1)[:rescore_candidates]
+            vector_rows = best if vector_rows is None else vector_rows[best]
+        scores = score_embeddings(query_embedding, full_matrix, rows=vector_rows)
+
+    return scores, vector_rows
+
+
+def score_chunks_batch(
+    VECTOR_DB,
+    query_embeddings,
+    rescore: bool = True,
+    rescore_candidates: int = constants.RESCORE_CANDIDATES,
+) -> np.ndarray:
+    """
+    Score many queries against every chunk with one matrix product.
+
+    The ANN index is not used: a block of queries probes most buckets
+    anyway. Coarse scores come from the stored matrix; with `rescore` and a
+    kept float32 copy, the best `rescore_candidates` vectors of every query
+    are rescored exactly and the other vectors are dropped, as in
+    `score_vectors`.
+
+    Returns:
+        np.ndarray: Float32 scores, shape (queries, chunks), -inf for the
+            chunks that were not rescored
+    """
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    scores = score_embeddings_batch(
+        queries, VECTOR_DB["embedding"], VECTOR_DB.get("embedding_scale")
+    )
+    full_matrix = VECTOR_DB.get("embedding_full")
+    if rescore and full_matrix is not None and scores.shape[1] > rescore_candidates:
+        best = np.argpartition(-scores, rescore_candidates - 1, axis=1)[:, :rescore_candidates]
+        scores.fill(-np.inf)
+        for i, rows in enumerate(best):
+            scores[i, rows] = score_embeddings(queries[i], full_matrix, rows=rows)
+    elif rescore and full_matrix is not None:
+        scores = score_embeddings_batch(queries, full_matrix)
+
+    chunk_vectors = VECTOR_DB.get("chunk_vectors")
+    return scores if chunk_vectors is None else scores[:, np.asarray(chunk_vectors)]
+
+
+def query_block_size(
+    VECTOR_DB,
+    max_queries: int = constants.BATCH_QUERY_BLOCK_SIZE,
+    memory_budget: int = constants.BATCH_SCORE_MEMORY_BYTES,
+) -> int:
+    """
+    Queries to score per block so the (queries, chunks) score matrices of
+    `search_batch` stay within `memory_budget` bytes.
+    """
+    num_vectors = len(VECTOR_DB["embedding"])
+    # Float32 scores per vector and per chunk, and the int64 partition order
+    # and negated copy taken when ranking the chunks
+    bytes_per_query = 4 * num_vectors + 16 * num_chunks(VECTOR_DB)
+    return int(max(1, min(max_queries, memory_budget // max(bytes_per_query, 1))))
+
+
+def ranked_rows(scores, candidate_rows=None, limit: int = None) -> np.ndarray:
+    """Chunk rows of the `limit` best scores, best first"""
+    scores = np.asarray(scores).ravel()
+    order = np.arange(len(scores))
+    if limit is not None and len(scores) > limit:
+        order = np.argpartition(-scores, limit - 1)[:limit]
+    order = order[np.argsort(-scores[order], kind="stable")]
+    return order if candidate_rows is None else np.asarray(candidate_rows)[order]
+
+
+def fuse_rankings(rankings, k: int = constants.RRF_K):
+    """
+    Reciprocal rank fusion: a row scores `sum(1 / (k + rank))` over the
+    rankings it appears in.
+
+    Returns:
+        tuple: (scores, rows) over the union of the ranked rows
+    """
+    rows = np.concatenate([np.asarray(ranking, dtype=np.int64) for ranking in rankings])
+    contributions = np.concatenate(
+        [1.0 / (k + 1 + np.arange(len(ranking))) for ranking in rankings]
+    )
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    return np.bincount(inverse, weights=contributions), unique_rows
+
+
+def retrieve_chunks(
+    VECTOR_DB,
+    query: str,
+    query_embedding,
+    mode: str = constants.RETRIEVAL_MODE,
+    nprobe: int = None,
+    rescore: bool = True,
+    lexical_candidates: int = constants.LEXICAL_CANDIDATES,
+):
+    """
+    Score chunks for a query, densely or combined with the BM25 index.
+
+    - "dense": embedding similarity only, see `score_chunks`
+    - "hybrid": the best `lexical_candidates` dense and BM25 rows are merged
+      with reciprocal rank fusion
+    - "prefilter": only the BM25 candidates are scored densely, then fused
+      as in "hybrid"; falls back to dense scoring when no term matches
+
+    Knowledge bases without a BM25 index are always scored densely.
+
+    Returns:
+        tuple: (scores, candidate_rows) as returned by `score_chunks`
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Retrieval mode must be one of {RETRIEVAL_MODES}")
+
+    bm25_index = VECTOR_DB.get("bm25_index")
+    if mode == "dense" or bm25_index is None or not query:
+        return score_chunks(VECTOR_DB, query_embedding, nprobe=nprobe, rescore=rescore)
+
+    lexical_rows, _ = bm25_index.search(query, lexical_candidates)
+    scores, candidate_rows = score_chunks(
+        VECTOR_DB,
+        query_embedding,
+        nprobe=nprobe,
+        rescore=rescore,
+        candidate_rows=lexical_rows if mode == "prefilter" and len(lexical_rows) else None,
+    )
+    if not len(lexical_rows):
+        return scores, candidate_rows
+
+    dense_rows = ranked_rows(scores, candidate_rows, lexical_candidates)
+    return fuse_rankings([dense_rows, lexical_rows])
+
+
+def search_batch(
+    VECTOR_DB,
+    queries,
+    query_embeddings,
+    page_index,
+    k: int = 3,
+    mode: str = constants.RETRIEVAL_MODE,
+    rescore: bool = True,
+    lexical_candidates: int = constants.LEXICAL_CANDIDATES,
+    context_candidates: int = constants.CONTEXT_CANDIDATES,
+):
+    """
+    Batched `retrieve_chunks` followed by page selection.
+
+    Dense scores of all queries come from `score_chunks_batch` and their top
+    pages and chunks are selected for every row at once. In "hybrid" and
+    "prefilter" modes the BM25 candidates are then fused query by query, as
+    in `retrieve_chunks`; queries without a matching term keep their dense
+    ranking.
+
+    Args:
+        queries (list): Query texts, used for BM25 (None entries are dense only)
+        query_embeddings (np.ndarray): Normalized embeddings, shape (queries, dim)
+        page_index (np.ndarray): Page position for every chunk row
+
+    Returns:
+        list: (pages, chunk_rows) per query, as returned by `Brain.search`
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Retrieval mode must be one of {RETRIEVAL_MODES}")
+
+    bm25_index = None if mode == "dense" else VECTOR_DB.get("bm25_index")
+    scores = score_chunks_batch(VECTOR_DB, query_embeddings, rescore)
+    pages = top_k_pages_batch(scores, page_index, k)
+    width = context_candidates if bm25_index is None else max(context_candidates, lexical_candidates)
+    dense_rows = ranked_rows_batch(scores, width)
+
+    results = []
+    for i, query in enumerate(queries):
+        query_pages, rows = pages[i], dense_rows[i, :context_candidates]
+        lexical_rows = bm25_index.search(query, lexical_candidates)[0] if bm25_index is not None and query else ()
+        if len(lexical_rows):
+            if mode == "prefilter":
+                # Scored on their own: rescoring may have dropped some of them
+                lexical_scores, scored_rows = score_chunks(
+                    VECTOR_DB, query_embeddings[i], rescore=rescore, candidate_rows=lexical_rows
+                )
+                dense = ranked_rows(lexical_scores, scored_rows, lexical_candidates)
+            else:
+                dense = dense_rows[i, :lexical_candidates]
+            fused_scores, fused_rows = fuse_rankings([dense, lexical_rows])
+            query_pages = top_k_pages(fused_scores, page_index, k, fused_rows)
+            rows = ranked_rows(fused_scores, fused_rows, context_candidates)
+        results.append((query_pages, rows[np.isin(page_index[rows], query_pages)]))
+    return results
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, BackgroundTasks, HTTPException, status
+import time
+
+from fastapi import APIRouter, Body, HTTPException, status
 from fastapi.params import Depends
+from fastapi.responses import StreamingResponse
 
+from configs import constants
 from .brain import Brain
-from .db import get_db
+from .db import get_db, get_registry
+from .events import server_sent_events
+from .jobs import JobAlreadyRunning, JobScheduler
+from .metrics import collect_timings
+from .quantization import EMBEDDING_DTYPES
+from .retrieval import RETRIEVAL_MODES
 from .tags import Tags
-from .utils import create_knowledge_base_from_sitemap, load_vector_db_from_pickle_file, store_vector_db_in_pickle_file
 
 router = APIRouter(
     prefix=Tags.get_router_prefix(Tags.RAG_ENGINE),
@@ -13,51 +21,140 @@ router = APIRouter(
 
 # Initialize the brain
 brain = Brain()
+scheduler = JobScheduler(brain)
 
 
-@router.post("/ingest", status_code=status.HTTP_201_CREATED)
-async def create_knowledge_base(sitemap_url: str, store_in_pickle: bool, background_tasks: BackgroundTasks, db = Depends(get_db)):
+@router.post("/ingest", status_code=status.HTTP_202_ACCEPTED)
+async def create_knowledge_base(sitemap_url: str, store_in_pickle: bool, use_ann_index: bool = False, embedding_dtype: str = constants.EMBEDDING_DTYPE, keep_full_precision: bool = False, rebuild_from_archive: bool = False, kb_id: str = constants.DEFAULT_KB_ID):
     if not sitemap_url:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Sitemap URL is required")
 
-    db["status"] = "loading"
-    background_tasks.add_task(create_knowledge_base_from_sitemap, brain, sitemap_url, db)
-    
-    if store_in_pickle:
-        store_vector_db_in_pickle_file(db)
-    
-    return {"message": "Knowledge base ingestion started"}
+    if embedding_dtype not in EMBEDDING_DTYPES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Embedding dtype must be one of {EMBEDDING_DTYPES}")
+
+    try:
+        job = scheduler.submit(kb_id, sitemap_url, store=store_in_pickle, use_ann_index=use_ann_index, embedding_dtype=embedding_dtype, keep_full_precision=keep_full_precision, rebuild_from_archive=rebuild_from_archive)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except JobAlreadyRunning as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    return {"message": "Knowledge base ingestion started", "job_id": job.id}
+
+
+@router.get("/jobs", status_code=status.HTTP_200_OK)
+def get_jobs(kb_id: str | None = None):
+    return {"jobs": [job.to_dict() for job in scheduler.list(kb_id)]}
+
+
+@router.get("/jobs/{job_id}", status_code=status.HTTP_200_OK)
+def get_job(job_id: str):
+    job = scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown job {job_id}")
+
+    return job.to_dict()
+
+
+@router.post("/jobs/{job_id}/cancel", status_code=status.HTTP_202_ACCEPTED)
+def cancel_job(job_id: str):
+    job = scheduler.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown job {job_id}")
+
+    return job.to_dict()
 
 
 @router.get("/knowledge-base", status_code=status.HTTP_200_OK)
-def get_knowledge_base(db = Depends(get_db)):
+def get_knowledge_base(kb_id: str = constants.DEFAULT_KB_ID, db = Depends(get_db)):
+    if not db and scheduler.active_job(kb_id) is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Knowledge base is still loading")
+
     if not db:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Knowledge base is empty")
-    
-    if db.get("status") == "loading":
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Knowledge base is still loading")
 
     return {"message": f"Knowledge {db["url"]} base is ready for querying"}
 
 
 @router.get("/ask-query", status_code=status.HTTP_200_OK)
-def get_prompt(prompt: str, db = Depends(get_db)):
+async def get_prompt(prompt: str, nprobe: int | None = None, rescore: bool = True, use_cache: bool = True, retrieval_mode: str = constants.RETRIEVAL_MODE, timings: bool = False, db = Depends(get_db)):
+    if not prompt:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Prompt is required")
+
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Retrieval mode must be one of {RETRIEVAL_MODES}")
+    
+    if not db:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Knowledge base is empty")
+
+    start = time.perf_counter()
+    with collect_timings() as stage_seconds:
+        response = await brain.agenerate_response(prompt, db, nprobe=nprobe, rescore=rescore, use_cache=use_cache, retrieval_mode=retrieval_mode)
+
+    if not timings:
+        return {"response": response}
+
+    # Stages that did not run (e.g. generation on an answer cache hit) are left out
+    timings_ms = {stage: round(seconds * 1000, 3) for stage, seconds in stage_seconds.items()}
+    timings_ms["total"] = round((time.perf_counter() - start) * 1000, 3)
+    return {"response": response, "timings_ms": timings_ms}
+
+
+@router.post("/ask-queries", status_code=status.HTTP_200_OK)
+async def get_prompts(prompts: list[str] = Body(..., embed=True), k: int = 3, rescore: bool = True, use_cache: bool = True, retrieval_mode: str = constants.RETRIEVAL_MODE, retrieval_only: bool = False, db = Depends(get_db)):
+    if not prompts or not all(prompts):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Prompts are required")
+
+    if len(prompts) > constants.BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {constants.BATCH_MAX_PROMPTS} prompts per batch")
+
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Retrieval mode must be one of {RETRIEVAL_MODES}")
+
+    if not db:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Knowledge base is empty")
+
+    results = await brain.answer_batch(prompts, db, k=k, rescore=rescore, use_cache=use_cache, retrieval_mode=retrieval_mode, retrieval_only=retrieval_only)
+
+    return {"results": results}
+
+
+@router.get("/ask-query-stream", status_code=status.HTTP_200_OK)
+async def get_prompt_stream(prompt: str, nprobe: int | None = None, rescore: bool = True, use_cache: bool = True, retrieval_mode: str = constants.RETRIEVAL_MODE, db = Depends(get_db)):
     if not prompt:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Prompt is required")
+
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Retrieval mode must be one of {RETRIEVAL_MODES}")
     
     if not db:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Knowledge base is empty")
 
-    response = brain.generate_response(prompt, db)
+    fragments = brain.astream_response(prompt, db, nprobe=nprobe, rescore=rescore, use_cache=use_cache, retrieval_mode=retrieval_mode)
 
-    return {"response": response}
+    return StreamingResponse(server_sent_events(fragments), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @router.get("/load-vector-db-from-pickle", status_code=status.HTTP_201_CREATED)
-def load_vector_db_from_pickle(db = Depends(get_db)):
-    load_vector_db_from_pickle_file(db)
+def load_vector_db_from_pickle(kb_id: str = constants.DEFAULT_KB_ID):
+    try:
+        db = get_registry().load(kb_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No stored vector db for {kb_id}")
     
     if not db:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Knowledge base is empty")
     
-    return {"message": "Vector DB loaded successfully"}
\ No newline at end of file
+    return {"message": "Vector DB loaded successfully"}
+
+
+@router.get("/cache-stats", status_code=status.HTTP_200_OK)
+def get_cache_stats():
+    return brain.cache_stats()
+
+
+@router.get("/knowledge-bases", status_code=status.HTTP_200_OK)
+def get_knowledge_bases():
+    return {"knowledge_bases": get_registry().stats()}
@@ -1,10 +1,20 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
+import gzip
+import io
+import logging
+import queue
 import requests
 import re
+import threading
 import xml.etree.ElementTree as ET
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit, urlunsplit
 from concurrent.futures import ThreadPoolExecutor
 
+from configs import constants
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
 
 def clean_text(text):
     return re.sub(r"\s+", " ", text).strip()
@@ -23,7 +33,7 @@ def collect_title_headers_paragraphs_meta(soup):
             if soup and soup.title and soup.title.string:
                 page_data["title"] = clean_text(soup.title.string)
         except Exception as e:
-            print(f"Error extracting title: {str(e)}")
+            logger.warning("Error extracting title: %s", e)
 
         # Text-containing elements we want to collect
         text_elements = [
@@ -104,13 +114,15 @@ def collect_title_headers_paragraphs_meta(soup):
                         current_element = current_element.find_next_sibling()
 
                 except Exception as e:
-                    print(
-                        f"Error processing heading '{header_text if 'header_text' in locals() else 'unknown'}': {str(e)}"
+                    logger.warning(
+                        "Error processing heading '%s': %s",
+                        header_text if 'header_text' in locals() else 'unknown',
+                        e,
                     )
                     continue
 
         except Exception as e:
-            print(f"Error processing headings: {str(e)}")
+            logger.warning("Error processing headings: %s", e)
             page_data["headings"] = {}
 
         # Collect text content not under any heading
@@ -125,7 +137,7 @@ def collect_title_headers_paragraphs_meta(soup):
                             {"type": element.name, "content": text}
                         )
         except Exception as e:
-            print(f"Error collecting orphan texts: {str(e)}")
+            logger.warning("Error collecting orphan texts: %s", e)
             page_data["orphan_texts"] = []
 
         # Collect metadata safely
@@ -145,90 +157,418 @@ def collect_title_headers_paragraphs_meta(soup):
                                 }
                                 page_data["metadatas"].append(meta_data)
                     except Exception as e:
-                        print(f"Error processing metadata item: {str(e)}")
+                        logger.warning("Error processing metadata item: %s", e)
                         continue
         except Exception as e:
-            print(f"Error processing metadata: {str(e)}")
+            logger.warning("Error processing metadata: %s", e)
             page_data["metadatas"] = []
 
         return page_data
 
     except Exception as e:
-        print(f"Error in collect_title_headers_paragraphs_meta: {str(e)}")
+        logger.warning("Error in collect_title_headers_paragraphs_meta: %s", e)
         return {"title": "", "metadatas": [], "headings": {}, "orphan_texts": []}
 
 
-def get_urls_from_sitemap(sitemap_url):
-    """Extract all URLs from a sitemap"""
+TEXT_ELEMENTS = frozenset(
+    ["p", "span", "div", "li", "td", "th", "a", "strong", "em", "label"]
+)
+HEADING_LEVELS = {f"h{level}": level for level in range(1, 7)}
+
+
+def extract_page_data(soup):
+    """
+    Single-pass equivalent of `collect_title_headers_paragraphs_meta`.
+
+    Walks the tags once in document order. Every heading stays "open" in its
+    parent until a sibling heading of the same or a higher level closes it;
+    text elements met in between, and the text elements nested inside them,
+    are appended to all open headings of that parent. Each element's text is
+    computed once and shared by its heading and orphan entries.
+
+    Returns the same page_data dictionary as
+    `collect_title_headers_paragraphs_meta`, including its orphan_texts: with
+    current BeautifulSoup releases `heading.find(element)` never matches, so
+    every text element is reported there.
+    """
     try:
-        response = requests.get(sitemap_url, timeout=10)
-        response.raise_for_status()
+        page_data = {"title": "", "metadatas": [], "headings": {}, "orphan_texts": []}
+        title_tag = None
+        headings = []
+        open_headings = {}
+        collectors = {id(soup): ()}
+
+        for index, tag in enumerate(
+            node for node in soup.descendants if isinstance(node, Tag)
+        ):
+            name, parent = tag.name, tag.parent
+            inherited = collectors[id(parent)]
+
+            text = None
+            if name in TEXT_ELEMENTS:
+                text = clean_text(tag.text)
+                if text:
+                    page_data["orphan_texts"].append({"type": name, "content": text})
+                    for texts, element_text in inherited:
+                        if text != element_text:
+                            texts.append({"type": name, "content": text})
+
+            siblings_open = open_headings.get(id(parent))
+            if siblings_open and name[0] == "h":
+                if len(name) < 2:
+                    siblings_open.clear()
+                else:
+                    try:
+                        level = int(name[1])
+                        siblings_open[:] = [
+                            heading for heading in siblings_open if heading["level"] < level
+                        ]
+                    except ValueError:
+                        pass
+
+            if text is not None and siblings_open:
+                for heading in siblings_open:
+                    if text:
+                        heading["texts"].append({"type": name, "content": text})
+                collectors[id(tag)] = inherited + tuple(
+                    (heading["texts"], text) for heading in siblings_open
+                )
+            else:
+                collectors[id(tag)] = inherited
+
+            if name == "title" and title_tag is None:
+                title_tag = tag
+            elif name == "meta":
+                content = tag.get("content", "")
+                cleaned_text = clean_text(content) if content else ""
+                if cleaned_text:
+                    page_data["metadatas"].append(
+                        {
+                            "content": cleaned_text,
+                            "name": tag.get("name", ""),
+                            "property": tag.get("property", ""),
+                        }
+                    )
+            elif name in HEADING_LEVELS:
+                raw_text = tag.text
+                if raw_text:
+                    heading = {
+                        "level": HEADING_LEVELS[name],
+                        "text": clean_text(raw_text),
+                        "texts": [],
+                        "order": (tag.sourceline or 0, HEADING_LEVELS[name], index),
+                    }
+                    headings.append(heading)
+                    if heading["text"]:
+                        open_headings.setdefault(id(parent), []).append(heading)
+
+        if title_tag is not None and title_tag.string:
+            page_data["title"] = clean_text(title_tag.string)
+
+        headings.sort(key=lambda heading: heading["order"])
+        for position, heading in enumerate(headings):
+            header_text = heading["text"]
+            if not header_text:
+                continue
+
+            base_header_text = header_text
+            counter = 1
+            while header_text in page_data["headings"]:
+                header_text = f"{base_header_text} ({counter})"
+                counter += 1
+
+            page_data["headings"][header_text] = {
+                "level": heading["level"],
+                "texts": heading["texts"],
+                "position": position,
+            }
 
-        root = ET.fromstring(response.content)
-        namespace = root.tag.split("}")[0] + "}"
-        urls = []
-
-        if "sitemapindex" in root.tag:
-            sitemap_urls = [
-                elem.find(f"{namespace}loc").text
-                for elem in root.findall(f".//{namespace}sitemap")
-            ]
-            for url in sitemap_urls:
-                urls.extend(get_urls_from_sitemap(url))
-        else:
-            urls = [
-                elem.find(f"{namespace}loc").text
-                for elem in root.findall(f".//{namespace}url")
-            ]
-
-        return urls
+        return page_data
 
     except Exception as e:
-        print(f"Error processing sitemap {sitemap_url}: {str(e)}")
-        return []
+        logger.warning("Error in extract_page_data: %s", e)
+        return {"title": "", "metadatas": [], "headings": {}, "orphan_texts": []}
+
+
+def normalize_url(url):
+    """
+    Canonical form of a page URL: lowercase scheme and host, no default port,
+    "/" for an empty path and no fragment
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc
+    if parts.hostname and "@" not in netloc:
+        host = parts.hostname
+        netloc = f"[{host}]" if ":" in host else host
+        if port is not None and (scheme, port) not in (("http", 80), ("https", 443)):
+            netloc = f"{netloc}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _child_text(elem, name):
+    for child in elem:
+        if _local_name(child.tag) == name:
+            return child.text.strip() if child.text else None
+    return None
+
+
+def _parse_sitemap(sitemap_url, emit):
+    """
+    Stream one sitemap, calling `emit("url", entry)` for every page and
+    `emit("sitemap", url)` for every child of a sitemap index, until `emit`
+    returns False.
+
+    The body is parsed while it downloads, gzip-compressed sitemaps are
+    decompressed on the fly, and parsed elements are dropped right away, so
+    memory does not grow with the size of the sitemap.
+    """
+    with timed("sitemap_fetch"):
+        with requests.get(sitemap_url, timeout=10, stream=True) as response:
+            response.raise_for_status()
+            # Content-Encoding is undone by urllib3; .xml.gz files are gzip themselves
+            response.raw.decode_content = True
+            # The buffered reader still reads once the body is exhausted
+            response.raw.auto_close = False
+            stream = io.BufferedReader(response.raw)
+            if stream.peek(2)[:2] == b"\x1f\x8b":
+                stream = gzip.GzipFile(fileobj=stream)
+
+            root = None
+            for event, elem in ET.iterparse(stream, events=("start", "end")):
+                if root is None:
+                    root = elem
+                if event != "end":
+                    continue
+                name = _local_name(elem.tag)
+                if name == "url":
+                    loc = _child_text(elem, "loc")
+                    entry = {"url": loc, "lastmod": _child_text(elem, "lastmod")}
+                    if loc and not emit("url", entry):
+                        return
+                    root.clear()
+                elif name == "sitemap":
+                    loc = _child_text(elem, "loc")
+                    if loc and not emit("sitemap", loc):
+                        return
+                    root.clear()
+
+
+def iter_sitemap_batches(
+    sitemap_url,
+    max_workers=constants.SITEMAP_FETCH_WORKERS,
+    queue_size=constants.SITEMAP_QUEUE_SIZE,
+    stopped=None,
+    batch_size=256,
+):
+    """
+    Yield lists of `{"url", "lastmod"}` for the pages of a sitemap as they are
+    parsed: each list holds up to `batch_size` entries discovered since the
+    previous one, and is yielded without waiting for it to fill.
+
+    Child sitemaps of a sitemap index are fetched `max_workers` at a time.
+    Page URLs are normalized (see `normalize_url`) and yielded once, and a
+    child sitemap listed twice, or in a cycle, is only read once. At most
+    `queue_size` discovered entries wait for the consumer; parsing pauses
+    when it falls behind. A sitemap that fails is logged and skipped.
+
+    Args:
+        stopped (callable, optional): Polled while waiting on slow sitemaps;
+            discovery ends once it returns True
+    """
+    found = queue.Queue(queue_size)
+    stop = threading.Event()
 
+    def emit(kind, value):
+        while not stop.is_set():
+            try:
+                found.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-def scrape_page(url):
-    """Scrape a single page and return its data"""
+    def read(url):
+        try:
+            _parse_sitemap(url, emit)
+        except Exception as e:
+            logger.warning("Error processing sitemap %s: %s", url, e)
+        emit("done", url)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sitemap")
+    seen_sitemaps, seen_urls = {sitemap_url}, set()
+    try:
+        executor.submit(read, sitemap_url)
+        pending = 1
+        while pending:
+            try:
+                items = [found.get(timeout=0.1)]
+            except queue.Empty:
+                if stopped is not None and stopped():
+                    return
+                continue
+            while len(items) < batch_size:
+                try:
+                    items.append(found.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = []
+            for kind, value in items:
+                if kind == "done":
+                    pending -= 1
+                elif kind == "sitemap":
+                    if value not in seen_sitemaps:
+                        seen_sitemaps.add(value)
+                        pending += 1
+                        executor.submit(read, value)
+                else:
+                    url = normalize_url(value["url"])
+                    if url not in seen_urls:
+                        seen_urls.add(url)
+                        batch.append({**value, "url": url})
+            if batch:
+                yield batch
+    finally:
+        # Also reached when the consumer stops early: let the readers go
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_sitemap_entries(
+    sitemap_url,
+    max_workers=constants.SITEMAP_FETCH_WORKERS,
+    queue_size=constants.SITEMAP_QUEUE_SIZE,
+    stopped=None,
+):
+    """Yield `{"url", "lastmod"}` for every page of a sitemap as it is parsed"""
+    batches = iter_sitemap_batches(sitemap_url, max_workers, queue_size, stopped)
     try:
-        response = requests.get(url, timeout=10)
+        for batch in batches:
+            yield from batch
+    finally:
+        batches.close()
+
+
+def get_sitemap_entries(sitemap_url):
+    """Extract all URLs from a sitemap together with their <lastmod>"""
+    return list(iter_sitemap_entries(sitemap_url))
+
+
+def get_urls_from_sitemap(sitemap_url):
+    """Extract all URLs from a sitemap"""
+    return [entry["url"] for entry in get_sitemap_entries(sitemap_url)]
+
+
+def is_unchanged(entry, previous):
+    """Whether the sitemap <lastmod> says a page did not change since `previous`"""
+    return bool(
+        previous and entry["lastmod"] and previous.get("lastmod") == entry["lastmod"]
+    )
+
+
+def conditional_headers(validators):
+    """Build If-None-Match / If-Modified-Since headers from a previous crawl"""
+    headers = {}
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def response_validators(headers):
+    """HTTP validators of a response, sent back on the next crawl"""
+    return {
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+    }
+
+
+def parse_page(content, parser=constants.HTML_PARSER):
+    """Extract page data from a fetched HTML body"""
+    with timed("extract"):
+        soup = BeautifulSoup(content, parser)
+        return extract_page_data(soup)
+
+
+def scrape_page(url, validators=None, parse=True):
+    """
+    Scrape a single page and return its data
+
+    `validators` are the ETag / Last-Modified values of the previous crawl; they
+    are sent as conditional request headers, and a 304 answer is returned as
+    page data holding only `{"crawl": {..., "not_modified": True}}`.
+
+    With `parse=False` the body is not parsed; the page data then holds the
+    raw response as `{"html": ..., "crawl": ...}` for a later stage.
+    """
+    try:
+        with timed("page_fetch"):
+            response = requests.get(
+                url, headers=conditional_headers(validators), timeout=10
+            )
+        if response.status_code == 304:
+            return {url: {"crawl": {**(validators or {}), "not_modified": True}}}
         response.raise_for_status()
 
-        soup = BeautifulSoup(response.content, "html.parser")
-        page_data = collect_title_headers_paragraphs_meta(soup)
+        page_data = parse_page(response.content) if parse else {"html": response.content}
+        page_data["crawl"] = response_validators(response.headers)
 
         return {url: page_data}
 
     except Exception as e:
-        print(f"Error scraping {url}: {str(e)}")
+        logger.warning("Error scraping %s: %s", url, e)
         return {url: {}}
 
 
-def scrape_site_from_sitemap(sitemap_url, max_workers=5):
+def scrape_site_from_sitemap(sitemap_url, max_workers=5, crawl_state=None):
     """
     Scrape entire site using sitemap URL
 
     Args:
         sitemap_url (str): URL of the sitemap
         max_workers (int): Maximum number of concurrent threads for scraping
+        crawl_state (dict, optional): Per URL lastmod / ETag / Last-Modified of
+            the previous crawl. Pages whose sitemap <lastmod> did not change are
+            not fetched, the others are fetched conditionally.
 
     Returns:
         dict: Dictionary with URLs as keys and their content data as values
     """
-    print(f"Starting sitemap scraping from: {sitemap_url}")
-
-    urls = get_urls_from_sitemap(sitemap_url)
-    print(f"Found {len(urls)} URLs in sitemap")
+    logger.info("Starting sitemap scraping from: %s", sitemap_url)
 
+    crawl_state = crawl_state or {}
     site_data = {}
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_url = {executor.submit(scrape_page, url): url for url in urls}
-
-        for future in future_to_url:
+        future_to_url = {}
+        # Pages are fetched while the rest of the sitemap is still being read
+        for entry in iter_sitemap_entries(sitemap_url):
+            url, previous = entry["url"], crawl_state.get(entry["url"])
+            if is_unchanged(entry, previous):
+                site_data[url] = {"crawl": {**previous, "not_modified": True}}
+                continue
+            # Reserve the slot so pages keep the order they were discovered in
+            site_data[url] = {}
+            future_to_url[executor.submit(scrape_page, url, previous)] = entry
+        logger.info("Found %d URLs in sitemap", len(site_data))
+
+        for future, entry in future_to_url.items():
             try:
                 page_data = future.result()
+                if "crawl" in page_data[entry["url"]]:
+                    page_data[entry["url"]]["crawl"]["lastmod"] = entry["lastmod"]
                 site_data.update(page_data)
             except Exception as e:
-                print(f"Error processing future: {str(e)}")
+                logger.warning("Error processing future: %s", e)
 
     return site_data
@@ -0,0 +1,519 @@
+import json
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from array import array
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+from configs import constants
+from .ann import IVFIndex
+from .lexical import BM25Index
+from .retrieval import build_page_index, num_chunks
+
+FORMAT_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+PAGES_FILE = "pages.bin"
+CHUNKS_FILE = "chunks.bin"
+HEADINGS_FILE = "headings.bin"
+BM25_TERMS_FILE = "bm25_terms.bin"
+
+# Vector DB entries stored as raw .npy files and opened with mmap_mode
+ARRAY_KEYS = (
+    "embedding",
+    "embedding_scale",
+    "embedding_full",
+    "page_index",
+    "chunk_hashes",
+    "chunk_vectors",
+)
+ANN_ARRAYS = ("centroids", "list_offsets", "list_rows")
+BM25_ARRAYS = ("offsets", "rows", "tfs", "doc_lengths")
+# Vector DB entries stored in the manifest
+MANIFEST_KEYS = (
+    "url",
+    "status",
+    "version",
+    "embedding_dtype",
+    "embedding_model",
+    "ingest_stats",
+)
+# Vector DB entries stored in the crawl side file
+CRAWL_FILE = "crawl.json"
+CRAWL_KEYS = ("page_urls", "crawl_state")
+
+logger = logging.getLogger(__name__)
+
+
+def heap_nbytes(value) -> int:
+    """
+    Bytes `value` (an array or a buffer) holds in process memory: 0 when it
+    is memory-mapped, as its pages are read from disk on demand and shared
+    with the other processes mapping the same file.
+    """
+    base = value
+    while base is not None:
+        if isinstance(base, (np.memmap, mmap.mmap)):
+            return 0
+        base = getattr(base, "base", None)
+    return value.nbytes if isinstance(value, np.ndarray) else len(value)
+
+
+class TextStore(Sequence):
+    """
+    Read-only sequence of texts backed by a memory-mapped file.
+
+    Texts live back to back in one UTF-8 buffer; `offsets[i]:offsets[i+1]` is
+    the byte range of text `i`. Texts are only decoded when they are read.
+    """
+
+    def __init__(self, buffer, offsets):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("text index out of range")
+        start, end = self._offsets[position], self._offsets[position + 1]
+        return bytes(self._buffer[start:end]).decode("utf-8")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def heap_nbytes(self) -> int:
+        return heap_nbytes(self._buffer) + heap_nbytes(self._offsets)
+
+    @classmethod
+    def from_texts(cls, texts) -> "TextStore":
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+
+class ChunkStore:
+    """
+    Chunk texts and the metadata needed to rebuild their context, by column.
+
+    Chunk `i` is `texts[i]`. Its type is `type_names[types[i]]`, its heading
+    `heading_names[headings[i]]` (-1 for none), its heading level `levels[i]`
+    (0 for none) and its position among the chunks of its page
+    `positions[i]`. Types and headings repeat across chunks and are stored
+    once; every column is a flat array, so a loaded store is memory-mapped.
+    """
+
+    COLUMNS = ("types", "headings", "levels", "positions")
+
+    def __init__(self, texts: TextStore, type_names, heading_names: TextStore, types, headings, levels, positions):
+        self.texts = texts
+        self.type_names = list(type_names)
+        self.heading_names = heading_names
+        self.types = types
+        self.headings = headings
+        self.levels = levels
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.texts)
+
+    def metadata(self, row: int) -> dict:
+        """Metadata of chunk `row` in the form of `chunk_metadata`"""
+        heading = int(self.headings[row])
+        level = int(self.levels[row])
+        return {
+            "type": self.type_names[self.types[row]],
+            "heading": self.heading_names[heading] if heading >= 0 else None,
+            "level": level or None,
+            "position": int(self.positions[row]),
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.texts.nbytes
+            + len(self.texts._offsets) * 8
+            + self.heading_names.nbytes
+            + sum(np.asarray(getattr(self, column)).nbytes for column in self.COLUMNS)
+        )
+
+    @property
+    def heap_nbytes(self) -> int:
+        return (
+            self.texts.heap_nbytes
+            + self.heading_names.heap_nbytes
+            + sum(heap_nbytes(getattr(self, column)) for column in self.COLUMNS)
+        )
+
+
+class ChunkStoreBuilder:
+    """
+    Accumulates chunks into growable typed arrays and one text buffer;
+    `build` turns them into a `ChunkStore`.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offsets = array("q", [0])
+        self._types = array("H")
+        self._headings = array("i")
+        self._levels = array("b")
+        self._positions = array("I")
+        self._type_ids = {}
+        self._heading_ids = {}
+
+    def __len__(self):
+        return len(self._types)
+
+    def append(self, text: str, type: str, heading: str = None, level: int = None, position: int = 0):
+        self._buffer += text.encode("utf-8")
+        self._offsets.append(len(self._buffer))
+        self._types.append(self._type_ids.setdefault(type, len(self._type_ids)))
+        self._headings.append(
+            -1 if heading is None else self._heading_ids.setdefault(heading, len(self._heading_ids))
+        )
+        self._levels.append(level or 0)
+        self._positions.append(position)
+
+    def extend(self, chunks: ChunkStore, rows: slice):
+        """Copy the contiguous `rows` of another store, e.g. an unchanged page"""
+        start, stop, _ = rows.indices(len(chunks))
+        if start >= stop:
+            return
+        offsets = chunks.texts._offsets
+        base = len(self._buffer) - int(offsets[start])
+        self._buffer += bytes(chunks.texts._buffer[int(offsets[start]):int(offsets[stop])])
+        self._offsets.extend(
+            (np.asarray(offsets[start + 1:stop + 1], dtype=np.int64) + base).tolist()
+        )
+        type_ids = [self._type_ids.setdefault(name, len(self._type_ids)) for name in chunks.type_names]
+        self._types.extend(type_ids[code] for code in np.asarray(chunks.types[start:stop]).tolist())
+        for code in np.asarray(chunks.headings[start:stop]).tolist():
+            self._headings.append(
+                -1 if code < 0
+                else self._heading_ids.setdefault(chunks.heading_names[code], len(self._heading_ids))
+            )
+        self._levels.extend(np.asarray(chunks.levels[start:stop]).tolist())
+        self._positions.extend(np.asarray(chunks.positions[start:stop]).tolist())
+
+    def build(self) -> ChunkStore:
+        return ChunkStore(
+            TextStore(bytes(self._buffer), np.frombuffer(self._offsets, dtype=np.int64).copy()),
+            list(self._type_ids),
+            TextStore.from_texts(self._heading_ids),
+            np.frombuffer(self._types, dtype=np.uint16).copy(),
+            np.frombuffer(self._headings, dtype=np.int32).copy(),
+            np.frombuffer(self._levels, dtype=np.int8).copy(),
+            np.frombuffer(self._positions, dtype=np.uint32).copy(),
+        )
+
+
+class PageStore(Mapping):
+    """
+    Read-only "start-end" -> page text mapping over a `TextStore`, where
+    `ranges[i]` is the chunk key of page `i`.
+    """
+
+    def __init__(self, texts: TextStore, ranges):
+        self._texts = texts
+        self._keys = [f"{start}-{end}" for start, end in ranges.tolist()]
+        self._positions = {key: position for position, key in enumerate(self._keys)}
+
+    def __getitem__(self, key):
+        return self._texts[self._positions[key]]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def nbytes(self) -> int:
+        return self._texts.nbytes
+
+    @property
+    def heap_nbytes(self) -> int:
+        return self._texts.heap_nbytes
+
+
+def store_vector_db(db, path: str = constants.VECTOR_DB_DIR):
+    """
+    Write the vector DB to a new versioned directory and atomically publish it.
+
+    Everything is written into a temporary directory first; `path` is a
+    symlink that is swapped to the new version with a single `os.replace`,
+    so readers either see the previous version or the complete new one.
+
+    Args:
+        db (dict): The vector DB
+        path (str): Location of the published vector DB symlink
+
+    Returns:
+        str: The directory of the new version
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+
+    tmp_dir = os.path.join(parent, f".{os.path.basename(path)}.tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp_dir)
+    try:
+        manifest = _write_version(db, tmp_dir)
+        version_dir = f"{path}.v{manifest['created_at']}"
+        os.rename(tmp_dir, version_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    _publish(path, version_dir)
+    logger.info("Stored vector db in %s", version_dir)
+    return version_dir
+
+
+def load_vector_db(db, path: str = constants.VECTOR_DB_DIR):
+    """
+    Open the published vector DB without copying it into memory.
+
+    Arrays are opened with `mmap_mode="r"`, so loading is independent of the
+    size of the knowledge base and the OS page cache is shared by every
+    process that maps the same version.
+    """
+    version_dir = os.path.realpath(path)
+    with open(os.path.join(version_dir, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported vector db format version: {manifest.get('format_version')}"
+        )
+
+    loaded_db = {key: manifest[key] for key in MANIFEST_KEYS if key in manifest}
+    loaded_db.setdefault("version", manifest["created_at"])
+    for key in manifest["arrays"]:
+        loaded_db[key] = _load_array(version_dir, key)
+    for key in ARRAY_KEYS:
+        loaded_db.setdefault(key, None)
+
+    if manifest["num_pages"] is not None:
+        loaded_db["data"] = PageStore(
+            _load_texts(version_dir, PAGES_FILE, "page_offsets"),
+            _load_array(version_dir, "page_ranges"),
+        )
+    loaded_db["chunks"] = None
+    if manifest.get("chunks"):
+        loaded_db["chunks"] = ChunkStore(
+            _load_texts(version_dir, CHUNKS_FILE, "chunk_offsets"),
+            manifest["chunks"]["type_names"],
+            _load_texts(version_dir, HEADINGS_FILE, "heading_offsets"),
+            *(_load_array(version_dir, f"chunk_{column}") for column in ChunkStore.COLUMNS),
+        )
+
+    crawl_path = os.path.join(version_dir, CRAWL_FILE)
+    if os.path.exists(crawl_path):
+        with open(crawl_path) as crawl_file:
+            loaded_db.update(json.load(crawl_file))
+
+    loaded_db["ann_index"] = None
+    if manifest.get("ann_index"):
+        loaded_db["ann_index"] = IVFIndex(
+            *(_load_array(version_dir, f"ivf_{name}") for name in ANN_ARRAYS),
+            nprobe=manifest["ann_index"]["nprobe"],
+        )
+
+    loaded_db["bm25_index"] = None
+    if manifest.get("bm25_index"):
+        loaded_db["bm25_index"] = BM25Index(
+            _load_texts(version_dir, BM25_TERMS_FILE, "bm25_term_offsets"),
+            *(_load_array(version_dir, f"bm25_{name}") for name in BM25_ARRAYS),
+            k1=manifest["bm25_index"]["k1"],
+            b=manifest["bm25_index"]["b"],
+        )
+
+    if "data" in loaded_db and loaded_db["page_index"] is None:
+        loaded_db["page_index"] = build_page_index(
+            loaded_db["data"].keys(), num_chunks(loaded_db)
+        )
+
+    db.clear()
+    db.update(loaded_db)
+    logger.info("Size of loaded vector db: %d", len(db["data"]) if "data" in db else 0)
+
+
+def stored_version(path: str = constants.VECTOR_DB_DIR):
+    """Version of the vector DB published at `path`, or None if there is none"""
+    try:
+        with open(os.path.join(os.path.realpath(path), MANIFEST_FILE)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+    return manifest.get("version", manifest["created_at"])
+
+
+def published_version_dir(path: str = constants.VECTOR_DB_DIR):
+    """
+    Name of the version directory the `path` symlink points at, or None.
+
+    A single `readlink`: cheap enough to poll for newly stored versions.
+    """
+    try:
+        return os.readlink(path)
+    except OSError:
+        return None
+
+
+def spill_array(array, directory: str = constants.SPILL_DIR) -> np.ndarray:
+    """
+    Move `array` to an unlinked temporary file and map it read-only, so only
+    the pages being read are resident. The file is gone once the mapping is.
+    """
+    array = np.ascontiguousarray(array)
+    if not array.size:
+        return array
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryFile(dir=directory) as spill_file:
+        array.tofile(spill_file)
+        spill_file.flush()
+        return np.memmap(spill_file, dtype=array.dtype, mode="r", shape=array.shape)
+
+
+def _write_version(db, version_dir) -> dict:
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "created_at": time.time_ns(),
+        "arrays": [],
+        "num_pages": None,
+        "num_chunks": None,
+        "ann_index": None,
+        "bm25_index": None,
+        "chunks": None,
+    }
+    manifest.update({key: db[key] for key in MANIFEST_KEYS if key in db})
+
+    for key in ARRAY_KEYS:
+        if db.get(key) is not None:
+            _save_array(version_dir, key, db[key])
+            manifest["arrays"].append(key)
+    if db.get("embedding") is not None:
+        manifest["num_chunks"] = len(db["embedding"])
+
+    if "data" in db:
+        ranges = [[int(part) for part in key.split("-")] for key in db["data"].keys()]
+        manifest["num_pages"] = _save_texts(
+            version_dir, PAGES_FILE, "page_offsets", db["data"].values()
+        )
+        _save_array(version_dir, "page_ranges", np.array(ranges, dtype=np.int64).reshape(-1, 2))
+
+    chunks = db.get("chunks")
+    if chunks is not None:
+        _save_text_store(version_dir, CHUNKS_FILE, "chunk_offsets", chunks.texts)
+        _save_text_store(version_dir, HEADINGS_FILE, "heading_offsets", chunks.heading_names)
+        for column in ChunkStore.COLUMNS:
+            _save_array(version_dir, f"chunk_{column}", getattr(chunks, column))
+        manifest["chunks"] = {"count": len(chunks), "type_names": chunks.type_names}
+
+    crawl = {key: db[key] for key in CRAWL_KEYS if db.get(key) is not None}
+    if crawl:
+        with open(os.path.join(version_dir, CRAWL_FILE), "w") as crawl_file:
+            json.dump(crawl, crawl_file)
+            _sync(crawl_file)
+
+    ann_index = db.get("ann_index")
+    if ann_index is not None:
+        for name in ANN_ARRAYS:
+            _save_array(version_dir, f"ivf_{name}", getattr(ann_index, name))
+        manifest["ann_index"] = {"type": "ivf", "nprobe": ann_index.nprobe}
+
+    bm25_index = db.get("bm25_index")
+    if bm25_index is not None:
+        for name in BM25_ARRAYS:
+            _save_array(version_dir, f"bm25_{name}", getattr(bm25_index, name))
+        if isinstance(bm25_index.terms, TextStore):
+            _save_text_store(version_dir, BM25_TERMS_FILE, "bm25_term_offsets", bm25_index.terms)
+        else:
+            _save_texts(version_dir, BM25_TERMS_FILE, "bm25_term_offsets", bm25_index.terms)
+        manifest["bm25_index"] = {"k1": bm25_index.k1, "b": bm25_index.b}
+
+    with open(os.path.join(version_dir, MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+        _sync(manifest_file)
+    return manifest
+
+
+def _publish(path, version_dir):
+    """Point the `path` symlink at `version_dir` and drop older versions."""
+    if os.path.exists(path) and not os.path.islink(path):
+        raise ValueError(f"{path} exists and is not a vector db symlink")
+
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    link = f"{path}.link-{uuid.uuid4().hex}"
+    os.symlink(os.path.basename(version_dir), link)
+    os.replace(link, path)
+
+    # Processes that still map the old files keep them alive until they let go
+    if previous and previous != version_dir:
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def _save_array(version_dir, name, array):
+    with open(os.path.join(version_dir, f"{name}.npy"), "wb") as array_file:
+        np.save(array_file, np.asarray(array), allow_pickle=False)
+        _sync(array_file)
+
+
+def _load_array(version_dir, name):
+    return np.load(
+        os.path.join(version_dir, f"{name}.npy"), mmap_mode="r", allow_pickle=False
+    )
+
+
+def _save_texts(version_dir, name, offsets_name, texts) -> int:
+    """Write `texts` back to back into `name` and their offsets array; returns the count"""
+    sizes = []
+    with open(os.path.join(version_dir, name), "wb") as texts_file:
+        for text in texts:
+            encoded = text.encode("utf-8")
+            texts_file.write(encoded)
+            sizes.append(len(encoded))
+        _sync(texts_file)
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    _save_array(version_dir, offsets_name, offsets)
+    return len(sizes)
+
+
+def _save_text_store(version_dir, name, offsets_name, texts: TextStore):
+    """Write the buffer and offsets of `texts` as they are"""
+    with open(os.path.join(version_dir, name), "wb") as texts_file:
+        texts_file.write(memoryview(texts._buffer))
+        _sync(texts_file)
+    _save_array(version_dir, offsets_name, texts._offsets)
+
+
+def _load_texts(version_dir, name, offsets_name) -> TextStore:
+    return TextStore(_load_buffer(version_dir, name), _load_array(version_dir, offsets_name))
+
+
+def _load_buffer(version_dir, name):
+    buffer_path = os.path.join(version_dir, name)
+    if not os.path.getsize(buffer_path):
+        return b""
+    return np.memmap(buffer_path, dtype=np.uint8, mode="r")
+
+
+def _sync(file):
+    file.flush()
+    os.fsync(file.fileno())
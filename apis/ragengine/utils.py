@@ -1,57 +1,80 @@
-import pickle
-from collections import OrderedDict
+import logging
+import threading
+import time
 
 from configs import constants
-from .scrape import scrape_site_from_sitemap
-from .context_formatters import format_for_llm, format_for_embeddings
-
-
-def create_knowledge_base_from_sitemap(brain, sitemap_url: str, db):
-    site_data = scrape_site_from_sitemap(sitemap_url)
-
-    print("Site scraped successfully")
-
-    docs = []
-    for _, page_data in site_data.items():
-        llm_context, embedding_chunks = format_for_llm(
-            page_data
-        ), format_for_embeddings(page_data)
-        docs.append((llm_context, embedding_chunks))
-
-    print(f"Scraped {len(docs)} pages")
+from .ann import IVFIndex
+from .archive import HtmlArchive
+from .lexical import BM25Index
+from .pipeline import IngestionPipeline, IngestionProgress, previous_crawl
+from .quantization import quantize_embeddings
+from .retrieval import build_page_index
+from .store import spill_array
+
+logger = logging.getLogger(__name__)
+
+
+def create_knowledge_base_from_sitemap(
+    brain,
+    sitemap_url: str,
+    db,
+    use_ann_index: bool = False,
+    embedding_dtype: str = constants.EMBEDDING_DTYPE,
+    keep_full_precision: bool = False,
+    progress: IngestionProgress = None,
+    cancel: threading.Event = None,
+    rebuild_from_archive: bool = False,
+    archive: HtmlArchive = None,
+):
+    # Fetched pages go to the archive; a rebuild reads them back from it
+    if archive is None and (constants.ARCHIVE_HTML or rebuild_from_archive):
+        archive = HtmlArchive()
+    previous = previous_crawl(brain, sitemap_url, db)
+    pipeline = IngestionPipeline(
+        brain,
+        previous,
+        progress=progress,
+        cancel=cancel,
+        archive=archive,
+        rebuild=rebuild_from_archive,
+    )
+    result = pipeline.run(sitemap_url)
+    data, full_embedding = result["data"], result["embedding"]
 
     db["url"] = sitemap_url
-    data, embeddings = OrderedDict(), []
-
-    last_idx = 0
-    for llm_context, embedding_chunks in docs:
-        embedding_chunks_size = len(embedding_chunks)
-        data[f"{last_idx}-{last_idx+embedding_chunks_size}"] = llm_context
-        embeddings.extend(embedding_chunks)
-        last_idx += embedding_chunks_size + 1
-
-    db["data"], db["embedding"] = data, brain.generate_embeddings(
-        documents=embeddings, use_multi_process=True
+    db["data"] = data
+    db["page_urls"] = result["page_urls"]
+    db["crawl_state"] = result["crawl_state"]
+    db["chunk_hashes"] = result["chunk_hashes"]
+    db["chunks"] = result["chunks"]
+    db["chunk_vectors"] = result["chunk_vectors"]
+    db["ingest_stats"] = result["ingest_stats"]
+    db["bm25_index"] = BM25Index.build(result["chunks"].texts)
+    db["embedding_model"] = brain.embedding_model_name
+    db["page_index"] = build_page_index(data.keys(), len(result["chunk_vectors"]))
+    db["ann_index"] = (
+        IVFIndex.build(full_embedding, nprobe=constants.ANN_NPROBE)
+        if use_ann_index and len(full_embedding)
+        else None
     )
+    db["embedding"], db["embedding_scale"] = quantize_embeddings(
+        full_embedding, embedding_dtype
+    )
+    db["embedding_dtype"] = embedding_dtype
+    # The float32 copy is only read to rescore a few candidates per query:
+    # keep it on disk so the compact matrix is all that stays resident
+    db["embedding_full"] = (
+        spill_array(full_embedding)
+        if keep_full_precision and embedding_dtype != "float32"
+        else None
+    )
+    db["version"] = time.time_ns()
     db["status"] = "completed"
 
-    print(f"Created knowledge base with {len(db['data'])} documents")
-    print(f"Created knowledge base with {len(db['embedding'])} embeddings")
-
-
-def load_vector_db_from_pickle_file(
-    db: dict, file_path: str = constants.VECTOR_DB_FILE
-):
-    with open(file_path, "rb") as pickle_file:
-        loaded_db = pickle.load(pickle_file)
-        db.clear()
-        db.update(loaded_db)
-
-    print("Size of loaded vector db:", len(db["data"]) if "data" in db else 0)
-
-
-def store_vector_db_in_pickle_file(db: dict, file_path: str = constants.VECTOR_DB_FILE):
-    with open(file_path, "wb") as pickle_file:
-        pickle.dump(db, pickle_file)
+    logger.info(
+        "Created knowledge base with %d documents and %d embeddings for %d chunks",
+        len(db["data"]),
+        len(db["embedding"]),
+        len(db["chunk_vectors"]),
+    )
 
-    print("Stored vector db in pickle file")
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+Recall@k and latency of the IVF index against exact brute-force search.
+
+Embeddings are drawn from a mixture of gaussians on the unit sphere so that
+they cluster the way real chunk embeddings do.
+
+Run from the repository root:
+    python -m benchmarks.bench_ann
+"""
+import time
+
+import numpy as np
+
+from apis.ragengine.ann import IVFIndex
+
+
+def make_embeddings(num_rows, dim, num_topics, rng):
+    topics = rng.standard_normal((num_topics, dim)).astype(np.float32)
+    rows = topics[rng.integers(0, num_topics, num_rows)]
+    rows += 0.6 * rng.standard_normal((num_rows, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def exact_top_k(embeddings, query, k):
+    scores = np.dot(query, embeddings.T)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def ivf_top_k(index, embeddings, query, k, nprobe):
+    rows = index.search(query, nprobe)
+    scores = np.dot(query, embeddings[rows].T)
+    top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k]
+    return rows[top[np.argsort(-scores[top])]]
+
+
+def main(num_rows=200_000, dim=384, k=10, num_queries=200, nprobes=(1, 2, 4, 8, 16, 32)):
+    rng = np.random.default_rng(0)
+    embeddings = make_embeddings(num_rows, dim, num_topics=512, rng=rng)
+    queries = make_embeddings(num_queries, dim, num_topics=512, rng=rng)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(embeddings)
+    print(f"Build time: {time.perf_counter() - start:.2f}s\n")
+
+    truth, exact_time = [], 0.0
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(set(exact_top_k(embeddings, query, k)))
+        exact_time += time.perf_counter() - start
+
+    print(f"{'method':>12} {'recall@' + str(k):>10} {'latency ms':>11} {'speedup':>8}")
+    print(f"{'exact':>12} {1.0:>10.3f} {exact_time / num_queries * 1e3:>11.2f} {1.0:>7.1f}x")
+    for nprobe in nprobes:
+        hits, ivf_time = 0, 0.0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = ivf_top_k(index, embeddings, query, k, nprobe)
+            ivf_time += time.perf_counter() - start
+            hits += len(expected.intersection(found))
+        print(
+            f"{'nprobe=' + str(nprobe):>12} {hits / (k * num_queries):>10.3f} "
+            f"{ivf_time / num_queries * 1e3:>11.2f} {exact_time / ivf_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Retrieval for many queries: one `Brain.search` per query against
+`Brain.search_batch`, which scores a block of queries with one matrix
+product and selects every row's top pages at once.
+
+Run from the repository root:
+    python -m benchmarks.bench_batch_query
+"""
+import time
+
+import numpy as np
+
+from benchmarks.fakes import install_stub_sentence_transformers
+
+install_stub_sentence_transformers()
+
+from apis.ragengine.brain import Brain  # noqa: E402
+from apis.ragengine.retrieval import build_page_index  # noqa: E402
+
+
+def synthetic_db(num_pages, chunks_per_page, dim, seed):
+    rng = np.random.default_rng(seed)
+    embedding = rng.standard_normal((num_pages * chunks_per_page, dim)).astype(np.float32)
+    embedding /= np.linalg.norm(embedding, axis=1, keepdims=True)
+    keys = [
+        f"{page * chunks_per_page}-{(page + 1) * chunks_per_page}" for page in range(num_pages)
+    ]
+    return {
+        "data": dict.fromkeys(keys, ""),
+        "embedding": embedding,
+        "page_index": build_page_index(keys, len(embedding)),
+    }
+
+
+def main(num_pages=5000, chunks_per_page=10, dim=384, num_queries=2000, k=3, seed=0):
+    brain = Brain()
+    db = synthetic_db(num_pages, chunks_per_page, dim, seed)
+    queries = np.random.default_rng(seed + 1).standard_normal((num_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    single = [brain.search(db, query, k, retrieval_mode="dense")[0] for query in queries]
+    per_query = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = [pages for pages, _ in brain.search_batch(db, queries, k, retrieval_mode="dense")]
+    batched = time.perf_counter() - start
+
+    agree = np.mean([np.array_equal(a, b) for a, b in zip(single, batch)])
+    print(f"{len(db['embedding'])} chunks, {num_queries} queries, top {k} pages")
+    print(f"{'mode':>10} {'seconds':>8} {'queries/s':>10}")
+    for name, elapsed in (("per query", per_query), ("batch", batched)):
+        print(f"{name:>10} {elapsed:>8.2f} {num_queries / elapsed:>10.0f}")
+    print(f"same pages for {agree:.1%} of the queries")
+
+
+if __name__ == "__main__":
+    main()
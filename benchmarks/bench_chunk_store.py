@@ -0,0 +1,65 @@
+"""
+Memory held by chunk texts and metadata: one dict per chunk, as produced by
+`format_for_embeddings`, against the columnar `ChunkStore`.
+
+Run from the repository root:
+    python -m benchmarks.bench_chunk_store
+"""
+import time
+import tracemalloc
+
+from apis.ragengine.context_formatters import chunk_metadata, format_for_embeddings
+from apis.ragengine.store import ChunkStoreBuilder
+
+
+def page_data(page_id: int, sections: int) -> dict:
+    return {
+        "title": f"Page {page_id}",
+        "headings": {
+            f"Section {section} of page {page_id}": {
+                "level": 2,
+                "position": section,
+                "texts": [
+                    {"type": "p", "content": f"Paragraph {section} on page {page_id} explains topic {section * 7 + page_id}."},
+                    {"type": "li", "content": f"Item A{section}"},
+                    {"type": "li", "content": f"Item B{section}"},
+                ],
+            }
+            for section in range(sections)
+        },
+        "orphan_texts": [{"type": "div", "content": "Copyright Example Corporation"}],
+    }
+
+
+def as_dicts(pages):
+    return [chunk for page in pages for chunk in format_for_embeddings(page)]
+
+
+def as_chunk_store(pages):
+    builder = ChunkStoreBuilder()
+    for page in pages:
+        for position, chunk in enumerate(format_for_embeddings(page)):
+            builder.append(chunk["text"], position=position, **chunk_metadata(chunk))
+    return builder.build()
+
+
+def measure(build, pages):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = build(pages)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(chunks), size, elapsed
+
+
+def main(num_pages=20000, sections=5):
+    pages = [page_data(page_id, sections) for page_id in range(num_pages)]
+    print(f"{'layout':>14} {'chunks':>8} {'MB':>8} {'bytes/chunk':>12} {'seconds':>8}")
+    for build in (as_dicts, as_chunk_store):
+        count, size, elapsed = measure(build, pages)
+        print(f"{build.__name__:>14} {count:>8} {size / 2**20:>8.1f} {size / count:>12.0f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Prompt size and generation latency of whole-page context against
+token-budgeted chunk context, on long pages.
+
+The embedding model is a stub and generation uses the fake LLM provider,
+whose time to first fragment grows with the prompt size the way prefill
+does on a real model.
+
+Run from the repository root:
+    python -m benchmarks.bench_context
+"""
+import random
+import time
+
+from benchmarks.fakes import install_stub_sentence_transformers
+from benchmarks.site_server import SiteServer
+
+install_stub_sentence_transformers()
+
+from apis.ragengine.brain import Brain  # noqa: E402
+from apis.ragengine.context_formatters import estimate_tokens  # noqa: E402
+from apis.ragengine.llm import FakeLLMProvider  # noqa: E402
+from apis.ragengine.utils import create_knowledge_base_from_sitemap  # noqa: E402
+from configs import constants  # noqa: E402
+
+# The benchmark site is not worth keeping in the page archive
+constants.ARCHIVE_HTML = False
+
+
+def main(num_pages=50, sections=80, num_queries=30, seconds_per_prompt_token=0.0002):
+    llm = FakeLLMProvider(
+        first_token_latency=0.05,
+        token_interval=0.0,
+        seconds_per_prompt_token=seconds_per_prompt_token,
+    )
+    brain = Brain(llm=llm)
+    db = {}
+    with SiteServer(num_pages, latency=0, sections=sections) as server:
+        create_knowledge_base_from_sitemap(brain, server.sitemap_url, db)
+
+    rng = random.Random(0)
+    results = {"pages": [], "chunks": []}
+    for _ in range(num_queries):
+        page_id, section = rng.randrange(num_pages), rng.randrange(sections)
+        query = f"Paragraph {section} on page {page_id} explains topic {section * 7 + page_id}."
+        expected = f"explains topic {section * 7 + page_id}."
+        query_embedding = brain.encode_query(query)
+        pages, chunk_rows = brain.search(db, query_embedding, query=query)
+        doc_keys = list(db["data"].keys())
+        top_k_doc_keys = [doc_keys[page] for page in pages]
+
+        for mode, rows in (("pages", None), ("chunks", chunk_rows)):
+            context = brain.get_context(
+                db, query_embedding, top_k_doc_keys=top_k_doc_keys, chunk_rows=rows
+            )
+            prompt = brain.build_prompt(query, context)
+            start = time.perf_counter()
+            llm.generate(prompt)
+            elapsed = time.perf_counter() - start
+            results[mode].append((len(prompt), estimate_tokens(prompt), elapsed, expected in context))
+
+    print(f"\n{'context':>8} {'prompt chars':>13} {'prompt tokens':>14} {'latency ms':>11} {'hit':>6}")
+    for mode, rows in results.items():
+        chars, tokens, latency, hits = (sum(column) / len(rows) for column in zip(*rows))
+        print(f"{mode:>8} {chars:>13.0f} {tokens:>14.0f} {latency * 1e3:>11.0f} {hits:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
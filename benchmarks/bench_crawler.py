@@ -0,0 +1,50 @@
+"""
+Throughput of the thread-pool scraper against the asyncio crawler, both
+crawling a local HTTP server with per-request latency and 429 throttling.
+
+Run from the repository root:
+    python -m benchmarks.bench_crawler
+"""
+import asyncio
+import time
+
+from apis.ragengine.crawler import scrape_site_from_sitemap_async
+from apis.ragengine.scrape import scrape_site_from_sitemap
+from benchmarks.site_server import SiteServer
+
+
+def run(label, crawl, num_pages, latency, throttle_rate):
+    with SiteServer(num_pages, latency, throttle_rate) as server:
+        start = time.perf_counter()
+        site_data = crawl(server.sitemap_url)
+        elapsed = time.perf_counter() - start
+
+    scraped = sum(1 for page_data in site_data.values() if page_data)
+    print(
+        f"{label:>22} {scraped:>6}/{num_pages:<6} {elapsed:>8.2f}s "
+        f"{scraped / elapsed:>9.1f} pages/s {server.requests:>8} requests"
+    )
+
+
+def main(num_pages=500, latency=0.05, throttle_rate=0.05):
+    print(f"{num_pages} pages, {latency * 1e3:.0f} ms latency, {throttle_rate:.0%} throttled\n")
+    run("thread pool (5)", scrape_site_from_sitemap, num_pages, latency, throttle_rate)
+    for concurrency in (5, 20, 50):
+        run(
+            f"async ({concurrency})",
+            lambda url: asyncio.run(
+                scrape_site_from_sitemap_async(
+                    url,
+                    max_concurrency=concurrency,
+                    per_host_concurrency=concurrency,
+                    backoff_base=0.05,
+                )
+            ),
+            num_pages,
+            latency,
+            throttle_rate,
+        )
+
+
+if __name__ == "__main__":
+    main()
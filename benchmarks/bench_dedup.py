@@ -0,0 +1,56 @@
+"""
+Embedding work and index size with and without chunk deduplication, on a
+site whose pages share a navigation header and a slightly varying footer.
+
+- "per chunk": every extracted chunk is embedded, as before deduplication
+- "exact": repeated chunks share one vector
+- "near": chunks within a few SimHash bits share one vector as well
+
+Run from the repository root:
+    python -m benchmarks.bench_dedup
+"""
+import asyncio
+import time
+
+from apis.ragengine.context_formatters import format_for_embeddings
+from apis.ragengine.crawler import scrape_site_from_sitemap_async
+from apis.ragengine.pipeline import IngestionPipeline, previous_crawl
+from benchmarks.fakes import FakeBrain
+from benchmarks.site_server import SiteServer
+
+
+def per_chunk(brain, sitemap_url):
+    site_data = asyncio.run(scrape_site_from_sitemap_async(sitemap_url))
+    texts = [chunk["text"] for page in site_data.values() for chunk in format_for_embeddings(page)]
+    embedding = brain.generate_embeddings(texts)
+    return len(texts), embedding
+
+
+def deduplicated(near_duplicates):
+    def run(brain, sitemap_url):
+        previous = previous_crawl(brain, sitemap_url, {})
+        pipeline = IngestionPipeline(brain, previous, near_duplicates=near_duplicates)
+        result = pipeline.run(sitemap_url)
+        return len(result["chunk_vectors"]), result["embedding"]
+
+    return run
+
+
+def main(num_pages=300, sections=5, seconds_per_text=0.0005):
+    modes = {"per chunk": per_chunk, "exact": deduplicated(False), "near": deduplicated(True)}
+    results = {}
+    with SiteServer(num_pages, latency=0, sections=sections, boilerplate=True) as server:
+        for name, mode in modes.items():
+            brain = FakeBrain(seconds_per_text=seconds_per_text)
+            start = time.perf_counter()
+            chunks, embedding = mode(brain, server.sitemap_url)
+            elapsed = time.perf_counter() - start
+            results[name] = (chunks, brain.embedded_texts, embedding.nbytes, elapsed)
+
+    print(f"\n{'mode':>10} {'chunks':>7} {'embedded':>9} {'matrix MB':>10} {'seconds':>8}")
+    for name, (chunks, embedded, nbytes, elapsed) in results.items():
+        print(f"{name:>10} {chunks:>7} {embedded:>9} {nbytes / 2**20:>10.2f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
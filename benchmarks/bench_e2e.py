@@ -0,0 +1,153 @@
+"""
+End-to-end run over a synthetic site served locally, with a deterministic
+stub embedding model and the fake LLM provider, so it runs offline and
+numbers are comparable between commits.
+
+The site has a sitemap index over child sitemaps, and pages with headings,
+lists, pricing tables and a shared header and footer. The phases are:
+
+- scrape: `scrape_site_from_sitemap`
+- extract: `collect_title_headers_paragraphs_meta` over parsed pages
+- ingest: `create_knowledge_base_from_sitemap`, archiving the fetched pages
+- rebuild: the same from the archive, with the site server stopped
+- search: `Brain.get_top_k_matching_docs` for questions about one table
+  row, with the share of questions whose page ranks in the top k
+- answer: `Brain.generate_response` without the answer cache
+
+Peak RSS is the process high-water mark after each phase.
+
+Run from the repository root:
+    python -m benchmarks.bench_e2e
+"""
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from bs4 import BeautifulSoup
+
+from benchmarks.fakes import install_stub_sentence_transformers
+
+install_stub_sentence_transformers()
+
+from apis.ragengine import scrape  # noqa: E402
+from apis.ragengine.archive import HtmlArchive  # noqa: E402
+from apis.ragengine.brain import Brain  # noqa: E402
+from apis.ragengine.llm import FakeLLMProvider  # noqa: E402
+from apis.ragengine.utils import create_knowledge_base_from_sitemap  # noqa: E402
+from benchmarks.site_server import SiteServer, render_page  # noqa: E402
+from configs import constants  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(latencies) -> tuple[float, float]:
+    p50, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 99])
+    return p50, p99
+
+
+def questions(num_pages, sections, num_queries, seed):
+    rng = random.Random(seed)
+    for _ in range(num_queries):
+        page_id, section, tier = rng.randrange(num_pages), rng.randrange(sections), rng.randrange(3)
+        yield page_id, f"How much does Plan P{page_id}-{section}-{tier} cost?"
+
+
+def main(num_pages=500, sections=5, pages_per_sitemap=100, num_queries=500, k=3, seed=0):
+    brain = Brain(llm=FakeLLMProvider(first_token_latency=0, token_interval=0))
+    archive = HtmlArchive(tempfile.mkdtemp(prefix="bench_e2e_archive_"))
+    rows = []
+
+    with SiteServer(
+        num_pages,
+        latency=0,
+        sections=sections,
+        boilerplate=True,
+        tables=True,
+        pages_per_sitemap=pages_per_sitemap,
+    ) as server:
+        start = time.perf_counter()
+        site_data = scrape.scrape_site_from_sitemap(server.sitemap_url)
+        elapsed = time.perf_counter() - start
+        rows.append(("scrape", f"{len(site_data) / elapsed:.0f} pages/s", peak_rss_mb()))
+
+        soups = [
+            BeautifulSoup(render_page(page_id, sections, True, True), constants.HTML_PARSER)
+            for page_id in range(num_pages)
+        ]
+        start = time.perf_counter()
+        for soup in soups:
+            scrape.collect_title_headers_paragraphs_meta(soup)
+        elapsed = time.perf_counter() - start
+        del soups
+        rows.append(("extract", f"{num_pages / elapsed:.0f} pages/s", peak_rss_mb()))
+
+        db = {}
+        start = time.perf_counter()
+        create_knowledge_base_from_sitemap(brain, server.sitemap_url, db, archive=archive)
+        elapsed = time.perf_counter() - start
+        num_chunks = len(db["chunk_vectors"])
+        rows.append(
+            (
+                "ingest",
+                f"{len(db['data']) / elapsed:.0f} pages/s, {num_chunks / elapsed:.0f} chunks/s",
+                peak_rss_mb(),
+            )
+        )
+        base_url, sitemap_url = server.base_url, server.sitemap_url
+
+    # A fresh knowledge base, so every archived page is extracted again
+    rebuilt = {}
+    start = time.perf_counter()
+    create_knowledge_base_from_sitemap(
+        brain, sitemap_url, rebuilt, rebuild_from_archive=True, archive=archive
+    )
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(archive.root)
+    rows.append(
+        (
+            "rebuild",
+            f"{len(rebuilt['data']) / elapsed:.0f} pages/s, "
+            f"{len(rebuilt['chunk_vectors']) / elapsed:.0f} chunks/s",
+            peak_rss_mb(),
+        )
+    )
+
+    # Documents are keyed by their chunk range; map them back to page urls
+    key_urls = dict(zip(db["data"].keys(), db["page_urls"]))
+    latencies, hits = [], 0
+    for page_id, question in questions(num_pages, sections, num_queries, seed):
+        start = time.perf_counter()
+        pages = brain.get_top_k_matching_docs(db, brain.encode_query(question), k, query=question)
+        latencies.append(time.perf_counter() - start)
+        hits += f"{base_url}/page/{page_id}" in {key_urls[key] for key in pages}
+    p50, p99 = percentiles(latencies)
+    rows.append(
+        (
+            "search",
+            f"p50 {p50:.2f} ms, p99 {p99:.2f} ms, hit@{k} {hits / num_queries:.0%}",
+            peak_rss_mb(),
+        )
+    )
+
+    latencies = []
+    for _, question in questions(num_pages, sections, num_queries, seed + 1):
+        start = time.perf_counter()
+        brain.generate_response(question, db, use_cache=False)
+        latencies.append(time.perf_counter() - start)
+    p50, p99 = percentiles(latencies)
+    rows.append(("answer", f"p50 {p50:.2f} ms, p99 {p99:.2f} ms", peak_rss_mb()))
+
+    print(f"\n{num_pages} pages, {num_chunks} chunks, {len(db['embedding'])} vectors")
+    print(f"{'phase':>8} {'result':<48} {'peak RSS MB':>12}")
+    for phase, result, rss in rows:
+        print(f"{phase:>8} {result:<48} {rss:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
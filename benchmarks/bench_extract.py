@@ -0,0 +1,91 @@
+"""
+Golden-output check and per-page parse time of the single-pass extractor
+against `collect_title_headers_paragraphs_meta`.
+
+Run from the repository root:
+    python -m benchmarks.bench_extract
+"""
+import contextlib
+import io
+import random
+import time
+
+from bs4 import BeautifulSoup
+
+from apis.ragengine.scrape import collect_title_headers_paragraphs_meta, extract_page_data
+from benchmarks.site_server import render_page
+
+TEXT_TAGS = ["p", "span", "div", "li", "td", "th", "a", "strong", "em", "label", "b", "section"]
+
+
+def random_fragment(rng, depth):
+    roll = rng.random()
+    if depth <= 0 or roll < 0.3:
+        words = " ".join(rng.choice(["alpha", "beta", "gamma", "  ", "\n", "delta"]) for _ in range(rng.randint(0, 4)))
+        return words
+    if roll < 0.45:
+        level = rng.randint(1, 6)
+        return f"<h{level}>{rng.choice(['Intro', 'Usage', ' ', 'Usage (1)', 'FAQ'])}</h{level}>"
+    if roll < 0.5:
+        return rng.choice(["<hr>", "<header>Top</header>", "<br>", "<h>odd</h>"])
+    tag = rng.choice(TEXT_TAGS)
+    children = "".join(random_fragment(rng, depth - 1) for _ in range(rng.randint(0, 4)))
+    newline = "\n" if rng.random() < 0.5 else ""
+    return f"<{tag}>{children}</{tag}>{newline}"
+
+
+def random_page(rng, depth=4):
+    head = f"<title>{rng.choice(['Doc', ' Spaced  title ', ''])}</title>"
+    head += '<meta name="description" content="A page"><meta property="og:title" content=" ">'
+    body = "".join(random_fragment(rng, depth) for _ in range(rng.randint(3, 12)))
+    return f"<html><head>{head}</head><body>{body}</body></html>"
+
+
+def large_page(sections):
+    parts = ["<html><head><title>Docs</title></head><body><main>"]
+    for section in range(sections):
+        parts.append(f"<h2>Section {section}</h2>\n<p>Overview {section}</p>\n")
+        parts.append(f"<h3>Details {section}</h3>\n<div><p>Detail <a>link {section}</a></p><ul>")
+        parts.append("".join(f"<li>Item {section}.{item}</li>" for item in range(5)))
+        parts.append("</ul></div>\n<table><tr><td>Cell</td><th>Head</th></tr></table>\n")
+    parts.append("</main></body></html>")
+    return "".join(parts)
+
+
+def golden_check(num_pages=300, seed=0):
+    rng = random.Random(seed)
+    pages = [random_page(rng) for _ in range(num_pages)] + [render_page(i).decode() for i in range(20)]
+    for html in pages:
+        soup = BeautifulSoup(html, "html.parser")
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = collect_title_headers_paragraphs_meta(soup)
+        actual = extract_page_data(soup)
+        assert actual == expected, html
+    print(f"Golden output matches on {len(pages)} pages")
+
+
+def timeit(fn, html, parser, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(BeautifulSoup(html, parser))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    golden_check()
+    print(f"\n{'sections':>9} {'legacy ms':>10} {'single ms':>10} {'single+lxml ms':>15}")
+    for sections in (5, 20, 80):
+        html = large_page(sections)
+        legacy = timeit(collect_title_headers_paragraphs_meta, html, "html.parser", repeat=1)
+        single = timeit(extract_page_data, html, "html.parser")
+        try:
+            lxml = f"{timeit(extract_page_data, html, 'lxml') * 1e3:>15.1f}"
+        except Exception:
+            lxml = f"{'n/a':>15}"
+        print(f"{sections:>9} {legacy * 1e3:>10.1f} {single * 1e3:>10.1f} {lxml}")
+
+
+if __name__ == "__main__":
+    main()
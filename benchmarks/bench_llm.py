@@ -0,0 +1,88 @@
+"""
+Latency and concurrency of the blocking and async generation paths, using
+the offline fake LLM provider.
+
+The blocking path runs `generate` on a thread pool the size of the default
+FastAPI/anyio worker pool, as a sync route would; the async path awaits
+`agenerate` on the event loop. Streaming is compared on time to first
+fragment.
+
+Run from the repository root:
+    python -m benchmarks.bench_llm
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from apis.ragengine.llm import FakeLLMProvider
+
+WORKER_THREADS = 40
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(label, latencies, elapsed):
+    print(
+        f"{label:>24} {len(latencies) / elapsed:>8.1f} answers/s "
+        f"p50 {percentile(latencies, 0.5) * 1e3:>8.0f} ms "
+        f"p99 {percentile(latencies, 0.99) * 1e3:>8.0f} ms"
+    )
+
+
+def run_blocking(provider, num_requests):
+    def answer(i):
+        provider.generate(f"Question: question {i}")
+        # Measured from submission, so waiting for a free worker counts too
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(WORKER_THREADS) as executor:
+        latencies = list(executor.map(answer, range(num_requests)))
+    report(f"blocking ({WORKER_THREADS} threads)", latencies, time.perf_counter() - start)
+
+
+async def run_async(provider, num_requests):
+    async def answer(i):
+        start = time.perf_counter()
+        await provider.agenerate(f"Question: question {i}")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(answer(i) for i in range(num_requests)))
+    report("async", latencies, time.perf_counter() - start)
+
+
+async def run_streaming(provider, num_requests):
+    async def answer(i):
+        start = time.perf_counter()
+        first = None
+        async for _ in provider.astream(f"Question: question {i}"):
+            if first is None:
+                first = time.perf_counter() - start
+        return first, time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(answer(i) for i in range(num_requests)))
+    elapsed = time.perf_counter() - start
+    report("async, full answer", [total for _, total in results], elapsed)
+    report("async, first fragment", [first for first, _ in results], elapsed)
+
+
+def main(num_requests=200, first_token_latency=0.2, token_interval=0.02):
+    provider = FakeLLMProvider(
+        first_token_latency=first_token_latency, token_interval=token_interval
+    )
+    print(
+        f"{num_requests} concurrent questions, {first_token_latency * 1e3:.0f} ms to first "
+        f"fragment, {token_interval * 1e3:.0f} ms per fragment\n"
+    )
+    run_blocking(provider, num_requests)
+    asyncio.run(run_async(provider, num_requests))
+    asyncio.run(run_streaming(provider, num_requests))
+
+
+if __name__ == "__main__":
+    main()
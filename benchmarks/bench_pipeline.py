@@ -0,0 +1,59 @@
+"""
+Wall-clock time and peak RSS of the streaming ingestion pipeline against the
+previous collect-everything-then-embed approach.
+
+Every run happens in a fresh process so peak RSS is measured per run.
+
+Run from the repository root:
+    python -m benchmarks.bench_pipeline
+"""
+import asyncio
+import multiprocessing
+import resource
+import time
+
+from apis.ragengine.context_formatters import format_for_embeddings, format_for_llm
+from apis.ragengine.crawler import scrape_site_from_sitemap_async
+from apis.ragengine.pipeline import IngestionPipeline, previous_crawl
+from benchmarks.fakes import FakeBrain
+from benchmarks.site_server import SiteServer
+
+
+def sequential(brain, sitemap_url):
+    site_data = asyncio.run(scrape_site_from_sitemap_async(sitemap_url))
+    docs = [(format_for_llm(page), format_for_embeddings(page)) for page in site_data.values()]
+    texts = [chunk["text"] for _, chunks in docs for chunk in chunks]
+    return brain.generate_embeddings(texts)
+
+
+def streaming(brain, sitemap_url):
+    return IngestionPipeline(brain, previous_crawl(brain, sitemap_url, {})).run(sitemap_url)
+
+
+def measure(mode, num_pages, latency, seconds_per_text, results):
+    brain = FakeBrain(seconds_per_text=seconds_per_text)
+    with SiteServer(num_pages, latency) as server:
+        start = time.perf_counter()
+        mode(brain, server.sitemap_url)
+        elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((elapsed, peak_mb))
+
+
+def main(sizes=(200, 800), latency=0.02, seconds_per_text=0.0005):
+    context = multiprocessing.get_context("spawn")
+    print(f"{'mode':>10} {'pages':>6} {'seconds':>8} {'peak RSS MB':>12}")
+    for num_pages in sizes:
+        for mode in (sequential, streaming):
+            results = context.Queue()
+            process = context.Process(
+                target=measure, args=(mode, num_pages, latency, seconds_per_text, results)
+            )
+            process.start()
+            elapsed, peak_mb = results.get()
+            process.join()
+            print(f"{mode.__name__:>10} {num_pages:>6} {elapsed:>8.2f} {peak_mb:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
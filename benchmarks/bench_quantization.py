@@ -0,0 +1,52 @@
+"""
+Memory footprint, recall@k and latency of the embedding storage modes.
+
+Run from the repository root:
+    python -m benchmarks.bench_quantization
+"""
+import time
+
+import numpy as np
+
+from apis.ragengine.quantization import EMBEDDING_DTYPES, quantize_embeddings
+from apis.ragengine.retrieval import score_chunks
+from benchmarks.bench_ann import make_embeddings
+
+
+def top_k(scores, candidate_rows, k):
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top if candidate_rows is None else candidate_rows[top]
+
+
+def main(num_rows=200_000, dim=384, k=10, num_queries=100):
+    rng = np.random.default_rng(0)
+    embeddings = make_embeddings(num_rows, dim, num_topics=512, rng=rng)
+    queries = make_embeddings(num_queries, dim, num_topics=512, rng=rng)
+    truth = [set(top_k(np.dot(embeddings, query), None, k)) for query in queries]
+
+    print(f"{'mode':>18} {'matrix MB':>10} {'recall@' + str(k):>10} {'latency ms':>11}")
+    for embedding_dtype in EMBEDDING_DTYPES:
+        matrix, scale = quantize_embeddings(embeddings, embedding_dtype)
+        for rescore in (False, True) if embedding_dtype != "float32" else (False,):
+            db = {
+                "embedding": matrix,
+                "embedding_scale": scale,
+                "embedding_full": embeddings if rescore else None,
+            }
+            hits, elapsed = 0, 0.0
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                scores, candidate_rows = score_chunks(db, query)
+                found = top_k(scores, candidate_rows, k)
+                elapsed += time.perf_counter() - start
+                hits += len(expected.intersection(found))
+
+            label = embedding_dtype + (" + rescore" if rescore else "")
+            print(
+                f"{label:>18} {matrix.nbytes / 2**20:>10.1f} "
+                f"{hits / (k * num_queries):>10.3f} {elapsed / num_queries * 1e3:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Memory of a knowledge base served by several worker processes, and how
+long the workers take to switch to a newly stored version.
+
+- private: every worker holds its own copy of the embedding matrix, as
+  when each worker ingests or unpickles the knowledge base itself
+- shared: every worker maps the stored files through its registry
+
+PSS splits shared pages between the processes mapping them, so the sum
+over workers is the physical memory they use together.
+
+Run from the repository root:
+    python -m benchmarks.bench_shared_workers
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from apis.ragengine.db import KnowledgeBaseRegistry
+from apis.ragengine.store import store_vector_db
+
+KB_ID = "bench"
+
+
+def memory_mb() -> tuple[float, float]:
+    """(RSS, PSS) of this process in MB"""
+    values = {}
+    with open("/proc/self/smaps_rollup") as smaps:
+        for line in smaps:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                values[name] = int(rest.split()[0]) / 1024
+    return values["Rss"], values["Pss"]
+
+
+def synthetic_db(num_chunks, dim, chunks_per_page, seed) -> dict:
+    rng = np.random.default_rng(seed)
+    embedding = rng.standard_normal((num_chunks, dim), dtype=np.float32)
+    embedding /= np.linalg.norm(embedding, axis=1, keepdims=True)
+    keys = [f"{start}-{start + chunks_per_page}" for start in range(0, num_chunks, chunks_per_page)]
+    return {
+        "url": f"synthetic-{seed}",
+        "status": "completed",
+        "version": time.time_ns(),
+        "data": dict.fromkeys(keys, ""),
+        "embedding": embedding,
+    }
+
+
+def worker(root, private, reload_interval, ready, stored, swapped, results):
+    registry = KnowledgeBaseRegistry(root, reload_interval=reload_interval)
+    db = registry.get(KB_ID)
+    embedding = np.array(db["embedding"]) if private else db["embedding"]
+    query = np.ones(embedding.shape[1], dtype=np.float32)
+    np.dot(embedding, query)
+    # PSS depends on which other workers map the pages, so measure once all have
+    ready.wait()
+    before = memory_mb()
+
+    # Only requests in flight would still hold the previous version
+    version = db["version"]
+    del db, embedding
+    stored.wait()
+    start = time.perf_counter()
+    while registry.get(KB_ID)["version"] == version:
+        time.sleep(0.005)
+    swap_seconds = time.perf_counter() - start
+    np.dot(registry.get(KB_ID)["embedding"], query)
+    swapped.wait()
+    results.put((before, swap_seconds, memory_mb()))
+
+
+def run(root, workers, private, reload_interval, num_chunks, dim):
+    context = multiprocessing.get_context("spawn")
+    ready, stored, swapped = context.Barrier(workers + 1), context.Event(), context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(root, private, reload_interval, ready, stored, swapped, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    ready.wait()
+
+    store_vector_db(synthetic_db(num_chunks, dim, 10, seed=1), os.path.join(root, KB_ID))
+    stored.set()
+    measurements = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return measurements
+
+
+def main(workers=4, num_chunks=200_000, dim=384, reload_interval=0.5):
+    print(f"{workers} workers, {num_chunks} x {dim} float32 embeddings "
+          f"({num_chunks * dim * 4 / 2**20:.0f} MB)")
+    print(f"{'mode':>8} {'RSS MB':>8} {'sum PSS MB':>11} {'swap ms':>8} {'PSS after swap':>15}")
+    for private in (True, False):
+        with tempfile.TemporaryDirectory() as root:
+            store_vector_db(synthetic_db(num_chunks, dim, 10, seed=0), os.path.join(root, KB_ID))
+            measurements = run(root, workers, private, reload_interval, num_chunks, dim)
+        rss = np.mean([before[0] for before, _, _ in measurements])
+        pss = sum(before[1] for before, _, _ in measurements)
+        swap_ms = max(seconds for _, seconds, _ in measurements) * 1000
+        pss_after = sum(after[1] for _, _, after in measurements)
+        print(f"{'private' if private else 'shared':>8} {rss:>8.0f} {pss:>11.0f} {swap_ms:>8.0f} {pss_after:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Sitemap discovery over a sitemap index with many child sitemaps, each
+delayed like a remote server: how long until the first URL and until the
+whole site is known, reading the children one at a time or concurrently,
+plain and gzip-compressed.
+
+Run from the repository root:
+    python -m benchmarks.bench_sitemap
+"""
+import time
+
+from apis.ragengine.scrape import iter_sitemap_entries
+from benchmarks.site_server import SiteServer
+
+
+def discover(sitemap_url, max_workers) -> tuple[int, float, float]:
+    """(URLs, seconds to the first one, seconds to all of them)"""
+    start = time.perf_counter()
+    first, count = None, 0
+    for _ in iter_sitemap_entries(sitemap_url, max_workers=max_workers):
+        if first is None:
+            first = time.perf_counter() - start
+        count += 1
+    return count, first, time.perf_counter() - start
+
+
+def main(num_pages=50_000, pages_per_sitemap=1000, latency=0.05, workers=(1, 8)):
+    num_sitemaps = -(-num_pages // pages_per_sitemap)
+    print(f"{num_pages} URLs in {num_sitemaps} child sitemaps, {latency * 1000:.0f} ms per response")
+    print(f"{'sitemaps':>8} {'workers':>8} {'URLs':>7} {'first URL ms':>13} {'all s':>7} {'URLs/s':>8}")
+    for gzip_sitemaps in (False, True):
+        with SiteServer(
+            num_pages,
+            latency=latency,
+            pages_per_sitemap=pages_per_sitemap,
+            gzip_sitemaps=gzip_sitemaps,
+        ) as server:
+            for max_workers in workers:
+                count, first, total = discover(server.sitemap_url, max_workers)
+                print(
+                    f"{'gzip' if gzip_sitemaps else 'plain':>8} {max_workers:>8} {count:>7} "
+                    f"{first * 1000:>13.0f} {total:>7.2f} {count / total:>8.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
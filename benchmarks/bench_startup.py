@@ -0,0 +1,64 @@
+"""
+Time from a cold `import main` to the first HTTP response, to readiness and
+to the first embedded query, with a stub embedding model that takes
+`load_seconds` to load.
+
+- eager: the model is loaded at import, as `Brain()` used to do
+- lazy: nothing is loaded until the first query needs the model
+- warm-up: the lifespan hook loads the model in the background
+
+Every mode runs in a fresh process so imports are cold.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+"""
+import multiprocessing
+import os
+import time
+
+MODES = ("eager", "lazy", "warm-up")
+
+
+def measure(mode, load_seconds, results):
+    start = time.perf_counter()
+    os.environ["LLM_PROVIDER"] = "fake"
+    from benchmarks.fakes import install_stub_sentence_transformers
+
+    install_stub_sentence_transformers(load_seconds)
+    from configs import constants
+
+    constants.WARM_UP_ON_STARTUP = mode == "warm-up"
+    from fastapi.testclient import TestClient
+
+    import main
+
+    if mode == "eager":
+        main.brain.warm_up()
+    imported = time.perf_counter() - start
+
+    with TestClient(main.app) as client:
+        client.get("/").raise_for_status()
+        first_response = time.perf_counter() - start
+
+        while mode != "lazy" and client.get("/ready").status_code != 200:
+            time.sleep(0.01)
+        main.brain.encode_query("how fast is startup?")
+        first_query = time.perf_counter() - start
+    results.put((imported, first_response, first_query))
+
+
+def main(load_seconds=3.0):
+    context = multiprocessing.get_context("spawn")
+    print(f"stub model load time {load_seconds:.1f}s\n")
+    print(f"{'mode':>8} {'import s':>9} {'first response s':>17} {'first query s':>14}")
+    for mode in MODES:
+        results = context.Queue()
+        process = context.Process(target=measure, args=(mode, load_seconds, results))
+        process.start()
+        imported, first_response, first_query = results.get()
+        process.join()
+        print(f"{mode:>8} {imported:>9.2f} {first_response:>17.2f} {first_query:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
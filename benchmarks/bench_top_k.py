@@ -0,0 +1,84 @@
+"""
+Compare the legacy argsort + binary search top-k selection against the
+vectorized page index selection used by `Brain.get_top_k_matching_docs`.
+
+Run from the repository root:
+    python -m benchmarks.bench_top_k
+"""
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from apis.ragengine.retrieval import build_page_index, top_k_pages
+
+
+def legacy_top_k_matching_docs(docs, scores, k=3):
+    def bin_search_on_docs_embedding(target):
+        keys = list(docs.keys())
+
+        left, right = 0, len(keys) - 1
+
+        while left <= right:
+            mid = (left + right) // 2
+            start, end = keys[mid].split("-")
+            start, end = int(start), int(end)
+
+            if end < target:
+                left = mid + 1
+            elif start > target:
+                right = mid - 1
+            else:
+                return keys[mid]
+        return keys[left]
+
+    top_k_doc_keys = set()
+    for ids in np.argsort(scores.flatten())[::-1]:
+        if len(top_k_doc_keys) == k:
+            break
+        top_k_doc_keys.add(bin_search_on_docs_embedding(ids))
+    return top_k_doc_keys
+
+
+def make_docs(num_chunks, rng):
+    docs, last_idx, total = OrderedDict(), 0, 0
+    while total < num_chunks:
+        size = min(int(rng.integers(5, 80)), num_chunks - total)
+        docs[f"{last_idx}-{last_idx+size}"] = f"page {len(docs)}"
+        last_idx += size + 1
+        total += size
+    return docs
+
+
+def timeit(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(sizes=(10_000, 100_000, 1_000_000), k=3, repeat=5):
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>10} {'pages':>8} {'legacy ms':>10} {'vector ms':>10} {'speedup':>8}")
+    for num_chunks in sizes:
+        docs = make_docs(num_chunks, rng)
+        scores = rng.random((1, num_chunks), dtype=np.float32)
+        page_index = build_page_index(docs.keys(), num_chunks)
+        keys = list(docs.keys())
+
+        legacy_time, legacy = timeit(lambda: legacy_top_k_matching_docs(docs, scores, k), repeat)
+        vector_time, vector = timeit(
+            lambda: [keys[page] for page in top_k_pages(scores, page_index, k)], repeat
+        )
+        assert legacy == set(vector), (legacy, vector)
+
+        print(
+            f"{num_chunks:>10} {len(docs):>8} {legacy_time*1e3:>10.2f} "
+            f"{vector_time*1e3:>10.2f} {legacy_time/vector_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
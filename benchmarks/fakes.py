@@ -0,0 +1,73 @@
+"""
+Deterministic stand-ins for the embedding model, so benchmarks run offline.
+"""
+import hashlib
+import sys
+import time
+import types
+
+import numpy as np
+
+
+def fake_embedding(text: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeBrain:
+    """
+    Brain replacement whose embeddings are a pure function of the text.
+
+    Args:
+        dim (int): Embedding dimension
+        seconds_per_text (float): Simulated model cost per embedded text
+    """
+
+    def __init__(self, dim: int = 384, seconds_per_text: float = 0.0):
+        self.embedding_model_name = f"fake-{dim}"
+        self.dim = dim
+        self.seconds_per_text = seconds_per_text
+        self.embedded_texts = 0
+
+    def generate_embeddings(self, documents, use_multi_process: bool = False):
+        time.sleep(self.seconds_per_text * len(documents))
+        self.embedded_texts += len(documents)
+        if not documents:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([fake_embedding(text, self.dim) for text in documents])
+
+
+class StubSentenceTransformer:
+    """
+    `sentence_transformers.SentenceTransformer` stand-in with a simulated
+    load time, for measuring startup without torch or a model download.
+    """
+
+    load_seconds = 0.0
+
+    def __init__(self, model_name_or_path: str, trust_remote_code: bool = False, dim: int = 384):
+        time.sleep(self.load_seconds)
+        self.dim = dim
+
+    def encode(self, sentences, normalize_embeddings: bool = False):
+        if not sentences:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([fake_embedding(text, self.dim) for text in sentences])
+
+    def start_multi_process_pool(self):
+        return None
+
+    def encode_multi_process(self, sentences, pool, normalize_embeddings: bool = False):
+        return self.encode(sentences, normalize_embeddings)
+
+    def stop_multi_process_pool(self, pool):
+        pass
+
+
+def install_stub_sentence_transformers(load_seconds: float = 0.0):
+    """Make `import sentence_transformers` resolve to `StubSentenceTransformer`"""
+    module = types.ModuleType("sentence_transformers")
+    StubSentenceTransformer.load_seconds = load_seconds
+    module.SentenceTransformer = StubSentenceTransformer
+    sys.modules["sentence_transformers"] = module
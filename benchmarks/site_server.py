@@ -0,0 +1,186 @@
+"""
+Local HTTP server that serves a sitemap (or a sitemap index) and generated
+HTML pages.
+
+Used by the benchmarks to crawl a site without touching the network.
+"""
+import gzip
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+
+# Site chrome repeated on every page, as navigation, banners and footers are
+BOILERPLATE_HEADER = (
+    "<h2>Navigation</h2>"
+    "<p>Home, Products, Pricing, Documentation, Blog, Careers, Contact us and Support</p>"
+    "<p>We use cookies to improve your experience on our website. By continuing to "
+    "browse this site you agree to our use of cookies and our privacy policy.</p>"
+)
+BOILERPLATE_FOOTER = (
+    "<h2>Stay in touch</h2>"
+    "<p>Subscribe to our newsletter to get the latest product updates, articles and "
+    "event invitations delivered straight to your inbox every month.</p>"
+    "<p>Copyright Example Corporation. All rights reserved. This page was last reviewed "
+    "by the documentation team in {month} and is published under the site terms of use.</p>"
+)
+MONTHS = ("January", "February", "March", "April", "May", "June")
+
+
+def render_table(page_id: int, section: int) -> str:
+    rows = "".join(
+        f"<tr><td>Plan P{page_id}-{section}-{tier}</td><td>{(tier + 1) * 10 + page_id} USD</td>"
+        f"<td>{(tier + 1) * 1000} requests per day</td></tr>"
+        for tier in range(3)
+    )
+    return f"<table><tr><th>Plan</th><th>Price</th><th>Limit</th></tr>{rows}</table>"
+
+
+def render_page(page_id: int, sections: int = 5, boilerplate: bool = False, tables: bool = False) -> bytes:
+    parts = [f"<html><head><title>Page {page_id}</title>"]
+    parts.append(f'<meta name="description" content="Description of page {page_id}">')
+    parts.append("</head><body>")
+    if boilerplate:
+        parts.append(BOILERPLATE_HEADER)
+    for section in range(sections):
+        parts.append(f"<h2>Section {section} of page {page_id}</h2>")
+        parts.append(
+            f"<p>Paragraph {section} on page {page_id} explains topic {section * 7 + page_id}.</p>"
+        )
+        parts.append(f"<ul><li>Item A{section}</li><li>Item B{section}</li></ul>")
+        if tables:
+            parts.append(render_table(page_id, section))
+    if boilerplate:
+        # The footer differs slightly between pages: a near duplicate
+        parts.append(BOILERPLATE_FOOTER.format(month=MONTHS[page_id % len(MONTHS)]))
+    parts.append("</body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+def render_sitemap(base_url: str, num_pages: int, start: int = 0) -> bytes:
+    urls = "".join(
+        f"<url><loc>{base_url}/page/{page_id}</loc></url>"
+        for page_id in range(start, start + num_pages)
+    )
+    return f'<urlset xmlns="{SITEMAP_NS}">{urls}</urlset>'.encode("utf-8")
+
+
+def render_sitemap_index(base_url: str, num_sitemaps: int, suffix: str = ".xml") -> bytes:
+    sitemaps = "".join(
+        f"<sitemap><loc>{base_url}/sitemaps/{index}{suffix}</loc></sitemap>"
+        for index in range(num_sitemaps)
+    )
+    return f'<sitemapindex xmlns="{SITEMAP_NS}">{sitemaps}</sitemapindex>'.encode("utf-8")
+
+
+class SiteServer:
+    """
+    Serve `num_pages` pages on localhost in a background thread.
+
+    Args:
+        num_pages (int): Number of pages listed in /sitemap.xml
+        latency (float): Seconds every response is delayed by
+        throttle_rate (float): Fraction of page requests answered with 429
+        sections (int): Heading sections per page
+        boilerplate (bool): Add a navigation header and a footer to every page
+        tables (bool): Add a pricing table to every section
+        pages_per_sitemap (int, optional): Serve /sitemap.xml as a sitemap
+            index over child sitemaps of this many pages each
+        gzip_sitemaps (bool): Serve the child sitemaps gzip-compressed, as
+            /sitemaps/<n>.xml.gz
+    """
+
+    def __init__(
+        self,
+        num_pages: int = 200,
+        latency: float = 0.02,
+        throttle_rate: float = 0.0,
+        sections: int = 5,
+        boilerplate: bool = False,
+        tables: bool = False,
+        pages_per_sitemap: int = None,
+        gzip_sitemaps: bool = False,
+    ):
+        self.num_pages = num_pages
+        self.sections = sections
+        self.boilerplate = boilerplate
+        self.tables = tables
+        self.pages_per_sitemap = pages_per_sitemap
+        self.gzip_sitemaps = gzip_sitemaps
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def sitemap_url(self) -> str:
+        return f"{self.base_url}/sitemap.xml"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with site._lock:
+                    site.requests += 1
+                time.sleep(site.latency)
+
+                per_sitemap = site.pages_per_sitemap
+                if self.path == "/sitemap.xml":
+                    if per_sitemap:
+                        num_sitemaps = -(-site.num_pages // per_sitemap)
+                        suffix = ".xml.gz" if site.gzip_sitemaps else ".xml"
+                        return self._send(
+                            200, render_sitemap_index(site.base_url, num_sitemaps, suffix)
+                        )
+                    return self._send(200, render_sitemap(site.base_url, site.num_pages))
+                if self.path.startswith("/sitemaps/") and per_sitemap:
+                    start = int(self.path.rsplit("/", 1)[1].split(".")[0]) * per_sitemap
+                    count = min(per_sitemap, site.num_pages - start)
+                    body = render_sitemap(site.base_url, count, start)
+                    if self.path.endswith(".gz"):
+                        body = gzip.compress(body)
+                    return self._send(200, body)
+                if self.path.startswith("/page/"):
+                    if random.random() < site.throttle_rate:
+                        return self._send(429, headers={"Retry-After": "0"})
+                    page_id = int(self.path.rsplit("/", 1)[1])
+                    return self._send(
+                        200,
+                        render_page(page_id, site.sections, site.boilerplate, site.tables),
+                        {"Content-Type": "text/html"},
+                    )
+                self._send(404)
+
+        return Handler
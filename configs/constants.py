@@ -10,6 +10,11 @@ APP_DEBUG = True
 
 CONTACT = dict(name="Developer", url=None, email="imhariharanm@gmail.com")
 
+# DEBUG also logs prompts and per-request db access; WARNING for quiet production logs
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# "text" or "json" (one object per line, for log shippers)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+
 OPENAPI_URL = "/api/v1/openapi.json"
 DOCS_URL = "/api/v1/docs"
 REDOC_URL = "/api/v1/redoc"
@@ -17,4 +22,97 @@ REDOC_URL = "/api/v1/redoc"
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 EMBEDDING_MODEL_NAME = "Alibaba-NLP/gte-base-en-v1.5"
 
-VECTOR_DB_FILE = "data/vector_db.pkl"
+VECTOR_DB_DIR = "data/vector_db"
+# Float32 embedding copies kept for rescoring live in unlinked files here
+SPILL_DIR = "data/spill"
+
+ANN_NPROBE = 8
+
+EMBEDDING_DTYPE = "float32"
+RESCORE_CANDIDATES = 256
+
+USE_ASYNC_CRAWLER = True
+CRAWLER_MAX_CONCURRENCY = 20
+CRAWLER_PER_HOST_CONCURRENCY = 8
+CRAWLER_MAX_RETRIES = 3
+
+# Child sitemaps of a sitemap index read at once, and discovered URLs
+# buffered ahead of the fetch stage
+SITEMAP_FETCH_WORKERS = 8
+SITEMAP_QUEUE_SIZE = 10000
+
+PIPELINE_QUEUE_SIZE = 64
+PIPELINE_EXTRACT_WORKERS = 4
+# Fetch threads when the async crawler is off
+PIPELINE_FETCH_WORKERS = 5
+PIPELINE_EMBED_BATCH_SIZE = 256
+
+# Fetched page bodies are kept compressed in this content-addressed archive,
+# so knowledge bases can be rebuilt without crawling
+ARCHIVE_HTML = True
+HTML_ARCHIVE_DIR = "data/html_archive"
+# Processes parsing archived pages during a rebuild, None for one per core
+REBUILD_WORKERS = None
+
+# "html.parser", or "lxml" when the lxml package is installed
+HTML_PARSER = "html.parser"
+
+EMBEDDING_MAX_BATCH_SIZE = 32
+EMBEDDING_MAX_WAIT = 0.005
+EMBEDDING_INGEST_CHUNK_SIZE = 256
+# Batches smaller than this are encoded in-process instead of on the worker pool
+EMBEDDING_POOL_MIN_BATCH = 128
+
+QUERY_CACHE_SIZE = 4096
+QUERY_CACHE_TTL = 3600
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL = 3600
+# Cosine similarity for near-duplicate answer cache hits, None to disable
+ANSWER_CACHE_SIMILARITY = None
+
+# "gemini" or "fake" (offline, for load and latency testing)
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "gemini")
+LLM_MODEL = "gemini-pro"
+
+# Load the models in the background when the app starts instead of on the first query
+WARM_UP_ON_STARTUP = True
+
+# One published vector DB per knowledge base id under this directory
+KNOWLEDGE_BASES_DIR = "data/knowledge_bases"
+DEFAULT_KB_ID = "default"
+# Bytes of loaded knowledge bases kept in process memory before cold ones are
+# evicted; memory-mapped stored files do not count against it
+KNOWLEDGE_BASE_MEMORY_BUDGET = 2 * 1024**3
+# Seconds between checks for a newer stored version of a loaded knowledge
+# base, e.g. one stored by another worker; 0 checks on every access
+KNOWLEDGE_BASE_RELOAD_INTERVAL = 1.0
+
+# Ingestion jobs crawling at once; further jobs wait in the queue
+MAX_CONCURRENT_INGESTS = 2
+# Finished jobs kept for the status endpoint
+MAX_FINISHED_JOBS = 100
+
+# "dense", "hybrid" (dense + BM25 rank fusion) or "prefilter" (BM25 candidates only)
+RETRIEVAL_MODE = "hybrid"
+LEXICAL_CANDIDATES = 256
+RRF_K = 60
+
+# Prompt context is packed from the best matching chunks of the top pages
+CONTEXT_MAX_TOKENS = 2000
+CONTEXT_CANDIDATES = 64
+CHARS_PER_TOKEN = 4
+
+# Batch queries: prompts per request, queries scored per matrix product, bytes
+# of score matrices per block (fewer queries per block on large knowledge
+# bases) and LLM calls in flight at once
+BATCH_MAX_PROMPTS = 10000
+BATCH_QUERY_BLOCK_SIZE = 256
+BATCH_SCORE_MEMORY_BYTES = 256 * 2**20
+BATCH_GENERATION_CONCURRENCY = 8
+
+# Chunks within this many SimHash bits of an earlier chunk share its vector.
+# Chunks shorter than SIMHASH_MIN_TOKENS are only deduplicated exactly: one
+# changed word already moves a short text's fingerprint by several bits.
+DEDUP_NEAR_DUPLICATES = True
+SIMHASH_MAX_DISTANCE = 6
+SIMHASH_MIN_TOKENS = 16
@@ -1,9 +1,41 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, HTTPException, status
+from fastapi.responses import PlainTextResponse
 
-from apis.ragengine.routes import router as rag_engine_router
+from apis.ragengine.routes import brain, router as rag_engine_router, scheduler
 
+from apis.ragengine.logs import configure_logging
+from apis.ragengine.metrics import render as render_metrics
 from configs import constants
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+async def warm_up_brain():
+    try:
+        await asyncio.to_thread(brain.warm_up)
+    except Exception:
+        logger.exception("Error warming up models")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so the app answers (and reports not ready)
+    # while the models load
+    warm_up = None
+    if constants.WARM_UP_ON_STARTUP:
+        warm_up = asyncio.create_task(warm_up_brain())
+    yield
+    if warm_up is not None and not warm_up.done():
+        await asyncio.wait([warm_up])
+    # Running ingestions are cancelled; nothing half-built is published
+    await asyncio.to_thread(scheduler.shutdown)
+    brain.close()
+
 
 app = FastAPI(
     title=constants.APP_TITLE,
@@ -13,7 +45,8 @@ app = FastAPI(
     docs_url=constants.DOCS_URL,
     redoc_url=constants.REDOC_URL,
     debug=constants.APP_DEBUG,
-    contact=constants.CONTACT
+    contact=constants.CONTACT,
+    lifespan=lifespan,
 )
 
 app.include_router(rag_engine_router)
@@ -21,4 +54,16 @@ app.include_router(rag_engine_router)
 
 @app.get("/", tags=["System Check"])
 def root():
-    return {"message": f"Welcone to {constants.APP_TITLE}"}
\ No newline at end of file
+    return {"message": f"Welcone to {constants.APP_TITLE}"}
+
+
+@app.get("/ready", tags=["System Check"])
+def ready():
+    if not brain.is_ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Models are still loading")
+    return {"message": "Ready"}
+
+
+@app.get("/metrics", tags=["System Check"], response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
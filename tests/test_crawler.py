@@ -0,0 +1,38 @@
+import asyncio
+import random
+
+from apis.ragengine.crawler import scrape_site_from_sitemap_async
+from benchmarks.site_server import SiteServer
+
+NUM_PAGES = 40
+
+
+def crawl(server, **crawler_options):
+    return asyncio.run(scrape_site_from_sitemap_async(server.sitemap_url, **crawler_options))
+
+
+def page_urls(server):
+    return {f"{server.base_url}/page/{page_id}" for page_id in range(NUM_PAGES)}
+
+
+def test_throttled_pages_are_retried():
+    random.seed(0)
+    with SiteServer(NUM_PAGES, latency=0, throttle_rate=0.3) as server:
+        site_data = crawl(server, max_retries=10)
+        requests = server.requests
+
+    assert set(site_data) == page_urls(server)
+    for url, page_data in site_data.items():
+        assert page_data.get("title"), url
+    # The sitemap, every page once, and a retry for every 429
+    assert requests > NUM_PAGES + 1
+
+
+def test_pages_throttled_past_the_retries_are_empty():
+    with SiteServer(NUM_PAGES, latency=0, throttle_rate=1.0) as server:
+        site_data = crawl(server, max_retries=2)
+        requests = server.requests
+
+    assert set(site_data) == page_urls(server)
+    assert all(page_data == {} for page_data in site_data.values())
+    assert requests == 1 + NUM_PAGES * 3
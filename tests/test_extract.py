@@ -0,0 +1,50 @@
+import random
+
+import pytest
+from bs4 import BeautifulSoup
+
+from apis.ragengine.scrape import collect_title_headers_paragraphs_meta, extract_page_data
+from benchmarks.bench_extract import large_page, random_page
+from benchmarks.site_server import render_page
+
+EDGE_CASES = {
+    "empty page": "",
+    "empty body": "<html><head></head><body></body></html>",
+    "orphan text": "<html><body><p>Before any heading</p><div><span>Nested orphan</span></div></body></html>",
+    "nested headings": (
+        "<html><body><h1>Top</h1><p>Intro</p>"
+        "<section><h2>Inner</h2><p>Inner text</p><h3>Deeper</h3><li>Item</li></section>"
+        "<h2>Sibling</h2><div><p>After <a>link</a></p></div><h1>Next</h1><td>Cell</td></body></html>"
+    ),
+    "repeated heading names": "<h2>FAQ</h2><p>One</p><h2>FAQ</h2><p>Two</p><h2> </h2><p>Blank</p>",
+    "title and metadata": (
+        '<html><head><title> Spaced  title </title><meta name="description" content="About">'
+        '<meta property="og:title" content=" "></head><body><h1>Only heading</h1></body></html>'
+    ),
+}
+
+
+def assert_matches_legacy(html):
+    soup = BeautifulSoup(html, "html.parser")
+    expected = collect_title_headers_paragraphs_meta(soup)
+    assert extract_page_data(soup) == expected
+
+
+@pytest.mark.parametrize("html", EDGE_CASES.values(), ids=EDGE_CASES.keys())
+def test_edge_cases_match_legacy(html):
+    assert_matches_legacy(html)
+
+
+@pytest.mark.parametrize("page_id", range(10))
+def test_site_pages_match_legacy(page_id):
+    assert_matches_legacy(render_page(page_id, boilerplate=True, tables=True).decode())
+
+
+def test_large_page_matches_legacy():
+    assert_matches_legacy(large_page(10))
+
+
+def test_random_pages_match_legacy():
+    rng = random.Random(0)
+    for _ in range(200):
+        assert_matches_legacy(random_page(rng))